@@ -84,6 +84,102 @@ else:
         }
     }
 
+# Cache
+# Local memory by default; set REDIS_URL to share the cache between workers
+# (requires the `redis` package).
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'community-feed',
+            'OPTIONS': {
+                # Django's default of 300 would evict cached trees and version stamps of busy threads
+                'MAX_ENTRIES': config('LOCAL_CACHE_MAX_ENTRIES', default=20000, cast=int),
+            },
+        }
+    }
+# Whether the cache is shared by every worker (Redis) rather than per process.
+# The version stamps behind conditional GETs (ETag/304) and cached comment
+# trees are kept in it if so, and in the database (VersionStamp) otherwise.
+CACHE_SHARED = config('CACHE_SHARED', default=bool(REDIS_URL), cast=bool)
+
+# Seconds a computed leaderboard is served from the cache
+LEADERBOARD_CACHE_TTL = config('LEADERBOARD_CACHE_TTL', default=10, cast=int)
+# Karma changes delete expired karma buckets at most once per this many seconds
+KARMA_BUCKET_PRUNE_INTERVAL = config('KARMA_BUCKET_PRUNE_INTERVAL', default=60 * 60, cast=int)
+
+# Buffer like_count changes in memory and write them in batches every
+# LIKE_COUNT_FLUSH_INTERVAL_MS, instead of updating the row on every like.
+LIKE_COUNT_WRITE_BEHIND = config('LIKE_COUNT_WRITE_BEHIND', default=False, cast=bool)
+LIKE_COUNT_FLUSH_INTERVAL_MS = config('LIKE_COUNT_FLUSH_INTERVAL_MS', default=200, cast=int)
+
+# Posts/comments that get this many likes within a minute switch to
+# LIKE_COUNTER_SHARDS counter rows to spread row-lock contention (0 disables).
+LIKE_SHARDING_THRESHOLD = config('LIKE_SHARDING_THRESHOLD', default=120, cast=int)
+LIKE_COUNTER_SHARDS = config('LIKE_COUNTER_SHARDS', default=16, cast=int)
+# Seconds a sharded like count is cached for reads
+LIKE_SHARD_SUM_TTL = 1
+
+# Per-process LRU of username -> user id for the write endpoints (0 disables).
+# With USER_ID_CACHE_SHARED the ids are also kept in the shared cache for
+# USER_ID_CACHE_TTL seconds, so other workers skip the lookup too.
+USER_ID_CACHE_SIZE = config('USER_ID_CACHE_SIZE', default=10000, cast=int)
+USER_ID_CACHE_SHARED = config('USER_ID_CACHE_SHARED', default=bool(REDIS_URL), cast=bool)
+USER_ID_CACHE_TTL = 24 * 60 * 60
+
+# Render post reads from plain .values() rows instead of through the DRF
+# serializers (same JSON, a fraction of the CPU)
+FAST_READ_RENDERING = config('FAST_READ_RENDERING', default=True, cast=bool)
+
+# Seconds a post's comment tree is cached for (it is also retired whenever
+# a comment changes), and seconds the like counts patched into cached trees
+# are kept for
+COMMENT_TREE_CACHE_TTL = config('COMMENT_TREE_CACHE_TTL', default=60 * 60, cast=int)
+LIKE_COUNT_OVERLAY_TTL = 60
+
+# Hot feed ranking (?sort=hot): likes / (age in hours + 2) ** HOT_SCORE_GRAVITY.
+# A post is rescored when liked, at most once per HOT_SCORE_MIN_INTERVAL
+# seconds, and by the sweep_hot_scores command for the last
+# HOT_SCORE_WINDOW_HOURS (older posts drop to 0).
+HOT_SCORE_GRAVITY = config('HOT_SCORE_GRAVITY', default=1.8, cast=float)
+HOT_SCORE_MIN_INTERVAL = config('HOT_SCORE_MIN_INTERVAL', default=1, cast=int)
+HOT_SCORE_WINDOW_HOURS = config('HOT_SCORE_WINDOW_HOURS', default=7 * 24, cast=int)
+
+# Following feed: new posts are pushed into each follower's inbox, and the
+# followers' inboxes are trimmed back to INBOX_SIZE entries at most once per
+# INBOX_TRIM_INTERVAL seconds per author (0 trims on every post). Authors with
+# FANOUT_MAX_FOLLOWERS or more followers are pulled at read time instead. A
+# new follow pushes the followee's INBOX_BACKFILL latest posts.
+FANOUT_MAX_FOLLOWERS = config('FANOUT_MAX_FOLLOWERS', default=10000, cast=int)
+INBOX_SIZE = config('INBOX_SIZE', default=500, cast=int)
+INBOX_TRIM_INTERVAL = config('INBOX_TRIM_INTERVAL', default=60, cast=int)
+INBOX_BACKFILL = 20
+
+# Live updates over Server-Sent Events (/api/events/, only served through asgi.py,
+# e.g. uvicorn community_feed.asgi:application; 501 under WSGI).
+# The broker is in-process: a multi-worker deployment needs a shared one.
+EVENT_BROKER = 'feed.events.LocalBroker'
+# Updates arriving within this many ms are sent as one event per post
+EVENTS_COALESCE_MS = config('EVENTS_COALESCE_MS', default=250, cast=int)
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# Serve reads of the feed, posts and leaderboard from the async views in
+# feed/async_views.py. Only worth it when served through asgi.py (e.g.
+# uvicorn community_feed.asgi:application); under WSGI each would need an event loop.
+ASYNC_READ_VIEWS = config('ASYNC_READ_VIEWS', default=False, cast=bool)
+# Give the independent queries of an async read their own threads and
+# database connections so they run at the same time
+ASYNC_READ_CONCURRENT_QUERIES = config('ASYNC_READ_CONCURRENT_QUERIES', default=True, cast=bool)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -119,10 +215,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        # Same JSON as rest_framework.renderers.JSONRenderer, encoded with
+        # orjson when it is installed
+        'feed.renderers.FastJSONRenderer',
     ],
 }
 
+# Responses with at least this many JSON objects/arrays are encoded and sent
+# in STREAMING_JSON_CHUNK_SIZE byte chunks instead of as one body (0 disables)
+STREAMING_JSON_MIN_ITEMS = config('STREAMING_JSON_MIN_ITEMS', default=2000, cast=int)
+STREAMING_JSON_CHUNK_SIZE = 64 * 1024
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
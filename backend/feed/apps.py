@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class FeedConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'feed'
+
+    def ready(self):
+        # Registers the signals that evict deleted users from the user id cache,
+        # fan new posts out to followers and keep karma buckets and cached
+        # leaderboards in step with likes
+        from . import following, karma, users  # noqa: F401
+        # Puts back search triggers dropped when a migration rebuilt a table
+        from django.db.models.signals import post_migrate
+        from .search import search_index_installed
+        post_migrate.connect(search_index_installed, sender=self)
@@ -0,0 +1,158 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from . import karma, versions
+from .models import Post
+from .pagination import FeedPagination
+from .renderers import json_response
+from .rendering import cached_comment_tree, post_rows, render_posts
+from .serializers import LeaderboardSerializer
+from .views import _comment_limit, _conditional_get, _feed_ordering, _leaderboard_params, _object_id
+
+
+# Async versions of the busiest reads: the feed, a post and the leaderboard.
+#
+# Served through asgi.py (settings.ASYNC_READ_VIEWS), a worker keeps taking
+# requests while these wait on the database, and the queries of one request
+# that don't depend on each other run at the same time. The JSON is the same
+# as PostViewSet and LeaderboardViewSet send, and writes still go to them.
+
+
+def blocking(func):
+    """
+    Wrap `func`, blocking ORM or cache work, to be awaited from these views.
+
+    Django's async ORM runs every query of a request on one shared thread,
+    so two of them gathered still run one after the other. With
+    ASYNC_READ_CONCURRENT_QUERIES each call gets a thread and database
+    connection of its own instead, and gathered calls overlap.
+    """
+    if not getattr(settings, 'ASYNC_READ_CONCURRENT_QUERIES', True):
+        return sync_to_async(func)
+
+    @functools.wraps(func)
+    def on_own_connection(*args, **kwargs):
+        # Worker threads don't see request_started/finished, so mind their connections here
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(on_own_connection, thread_sensitive=False)
+
+
+def api_view(view):
+    """
+    Give an async view the DRF Request, and answer the DRF exceptions and
+    Http404 it raises with the same JSON errors the viewsets send.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(Request(request), *args, **kwargs)
+        except (APIException, Http404) as exc:
+            response = exception_handler(exc, {})
+            return json_response(response.data, status=response.status_code)
+
+    return wrapper
+
+
+def read_or_write(read_view, write_view):
+    """
+    One view for a URL whose GETs go to `read_view`, an async view from this
+    module, and everything else to `write_view`, a viewset's view.
+    """
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            return await read_view(request, *args, **kwargs)
+        return await sync_to_async(write_view)(request, *args, **kwargs)
+
+    # The viewsets are csrf_exempt, and Django checks the view the URL resolves to
+    view.csrf_exempt = True
+    return view
+
+
+@api_view
+async def post_list(request):
+    """
+    PostViewSet.list. On page-number pages the COUNT runs alongside the page
+    and its comments.
+    """
+    comment_limit = _comment_limit(request.query_params)
+    ordering = _feed_ordering(request.query_params)
+    version = await sync_to_async(versions.feed_version)()
+    headers, not_modified = _conditional_get(request, version, version // 10 ** 9)
+    if not_modified is not None:
+        return not_modified
+
+    queryset = post_rows(Post.objects.order_by(*ordering))
+    paginator = FeedPagination()
+    paginator.ordering = ordering
+    page_number = request.query_params.get(paginator.page_query_param) or '1'
+
+    if paginator.is_keyset(request) or not page_number.isdigit() or page_number == '0':
+        # Keyset pages are a single query, and a page like `last` needs the count first
+        def page():
+            return render_posts(paginator.paginate_queryset(queryset, request), comment_limit)
+
+        posts = await blocking(page)()
+    else:
+        page_size = paginator.get_page_size(request)
+        offset = (int(page_number) - 1) * page_size
+        count, posts = await asyncio.gather(
+            queryset.acount(),
+            blocking(render_posts)(queryset[offset:offset + page_size], comment_limit),
+        )
+        paginator.paginate_counted(posts, count, queryset, request)
+
+    return json_response(paginator.get_paginated_response(posts).data, headers=headers)
+
+
+@api_view
+async def post_detail(request, pk):
+    """
+    PostViewSet.retrieve. A full thread's post row and its cached comment tree
+    are read at the same time.
+    """
+    comment_limit = _comment_limit(request.query_params)
+    post_id = _object_id(pk)
+    version = await sync_to_async(versions.post_version)(post_id)
+    headers, not_modified = _conditional_get(request, version, version // 10 ** 9)
+    if not_modified is not None:
+        return not_modified
+
+    rows = post_rows(Post.objects.filter(pk=post_id))
+    if comment_limit is None:
+        posts, (comments, comment_count) = await asyncio.gather(
+            blocking(render_posts)(rows, 0),
+            blocking(cached_comment_tree)(post_id),
+        )
+        for post in posts:
+            post['comments'], post['comment_count'] = comments, comment_count
+    else:
+        posts = await blocking(render_posts)(rows, comment_limit)
+    if not posts:
+        raise Http404
+    return json_response(posts[0], headers=headers)
+
+
+@api_view
+async def top_users(request):
+    """LeaderboardViewSet.top_users."""
+    window, limit = _leaderboard_params(request.query_params)
+    version = await sync_to_async(karma.leaderboard_version)()
+    headers, not_modified = _conditional_get(request, version)
+    if not_modified is not None:
+        return not_modified
+
+    leaderboard_data = await blocking(karma.cached_top_users)(window, limit)
+    return json_response(LeaderboardSerializer(leaderboard_data, many=True).data, headers=headers)
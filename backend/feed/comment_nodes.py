@@ -0,0 +1,137 @@
+from operator import attrgetter
+
+
+# A post's comments as a compact tree, shared by feed.rendering, the
+# serializers and the comment tree cache.
+#
+# A Comment instance carries a __dict__, ORM state and a User instance of
+# its own. A CommentNode only has slots for the columns that get rendered,
+# and comments by the same author share one tuple of the author's columns.
+# Trees are built in O(n) from plain .values_list() rows and pickle back to
+# those flat rows, so caching one stores no per-comment objects and doesn't
+# recurse into deep threads.
+
+# Columns of a tree row, in order; the author's columns follow them
+NODE_FIELDS = (
+    'id', 'parent_id', 'content', 'created_at', 'updated_at',
+    'like_count', 'like_shards', 'reply_count', 'depth'
+)
+
+# Sibling orders, highest key first
+COMMENT_SORTS = {
+    'new': attrgetter('created_at', 'id'),
+    'top': attrgetter('like_count', 'created_at', 'id'),
+}
+DEFAULT_COMMENT_SORT = 'new'
+
+_AUTHOR_START = len(NODE_FIELDS)
+
+
+class CommentNode:
+    __slots__ = NODE_FIELDS + ('author', 'replies')
+
+    def __init__(self, row, author):
+        (
+            self.id, self.parent_id, self.content, self.created_at, self.updated_at,
+            self.like_count, self.like_shards, self.reply_count, self.depth
+        ) = row[:_AUTHOR_START]
+        self.author = author
+        # Most comments have no replies, and share this until they get one
+        self.replies = ()
+
+    def __repr__(self):
+        return f'<CommentNode {self.id}>'
+
+
+class CommentTree:
+    """
+    The comments of post `post_id`, from rows of NODE_FIELDS followed by the
+    author's columns, in any order.
+
+    `nodes` maps comment ids to their CommentNode, `roots` holds the
+    top-level comments, and every node's `replies` its direct children (an
+    empty tuple for none).
+
+    Siblings are sorted newest first, like the API serves them, until
+    sort_by() picks another of COMMENT_SORTS. `sort` is the order they are
+    in, None once like counts changed under it.
+    """
+    __slots__ = ('post_id', 'nodes', 'roots', 'sort')
+
+    def __init__(self, post_id, rows=()):
+        self.post_id = post_id
+        self.nodes = {}
+        self.roots = []
+        self.sort = None
+
+        authors = {}
+        for row in rows:
+            author = row[_AUTHOR_START:]
+            node = CommentNode(row, authors.setdefault(author, author))
+            self.nodes[node.id] = node
+
+        for node in self.nodes.values():
+            parent = self.nodes.get(node.parent_id)
+            if parent is None:
+                self.roots.append(node)
+            elif parent.replies:
+                parent.replies.append(node)
+            else:
+                parent.replies = [node]
+        self.sort_by(DEFAULT_COMMENT_SORT)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __reduce__(self):
+        return type(self), (self.post_id, self.rows())
+
+    def rows(self):
+        """The tree as the flat rows it is built from."""
+        return [
+            (
+                node.id, node.parent_id, node.content, node.created_at, node.updated_at,
+                node.like_count, node.like_shards, node.reply_count, node.depth, *node.author
+            )
+            for node in self.nodes.values()
+        ]
+
+    def sort_by(self, sort):
+        """Sort every comment's replies, and the top-level comments, by COMMENT_SORTS[sort]."""
+        if sort == self.sort:
+            return
+        self.sort = sort
+        key = COMMENT_SORTS[sort]
+        self.roots.sort(key=key, reverse=True)
+        for node in self.nodes.values():
+            if len(node.replies) > 1:
+                node.replies.sort(key=key, reverse=True)
+
+    def set_like_counts(self, like_counts):
+        """Update the like counts of the comments in `like_counts`, as {pk: like_count}."""
+        for pk, like_count in like_counts.items():
+            node = self.nodes.get(pk)
+            if node is not None and node.like_count != like_count:
+                node.like_count = like_count
+                # Siblings may be out of order for sorts by likes
+                self.sort = None
+
+    def subtree(self, comment_id):
+        """The node of comment `comment_id`, whose replies are its subtree, or None."""
+        return self.nodes.get(comment_id)
+
+    def walk(self, nodes=None, depth=None):
+        """
+        Yield (node, parent) for `nodes` (the top-level comments by default)
+        and everything below them, parents before their replies and siblings
+        in order. `parent` is None for `nodes` themselves. With a `depth`,
+        only that many levels are walked, `nodes` being the first.
+        """
+        if nodes is None:
+            nodes = self.roots
+        stack = [(node, None, 1) for node in reversed(nodes)]
+        while stack:
+            node, parent, level = stack.pop()
+            yield node, parent
+            if depth is None or level < depth:
+                stack.extend((reply, node, level + 1) for reply in reversed(node.replies))
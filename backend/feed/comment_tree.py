@@ -0,0 +1,115 @@
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Comment
+
+
+# Largest N accepted for ?comments=top:N on the feed
+COMMENT_PREVIEW_MAX_SIZE = 20
+
+# Levels below the requested comment, and replies per comment, served by the subtree endpoint
+SUBTREE_DEPTH = 3
+SUBTREE_MAX_DEPTH = 10
+SUBTREE_PAGE_SIZE = 20
+SUBTREE_MAX_PAGE_SIZE = 100
+
+
+def attach_comment_previews(posts, limit):
+    """
+    Give each post only its `limit` newest top-level comments, without replies.
+
+    All previews for the page come from one query, ranking the top-level
+    comments of each post with ROW_NUMBER() and keeping the first `limit`.
+    Posts get `comment_tree`, a list of Comment instances with empty
+    `tree_replies`, while the comment count comes from the denormalized
+    Post.comment_count, so the rest of a thread is never read. With a limit
+    of 0 no comments are fetched at all.
+    """
+    posts = list(posts)
+    for post in posts:
+        post.comment_tree = []
+    if not posts or limit <= 0:
+        return posts
+
+    posts_by_id = {post.pk: post for post in posts}
+    for comment in top_comments(posts_by_id.keys(), limit).select_related('author'):
+        # Replies stay out of the preview; reply_count tells clients there are more
+        comment.tree_replies = []
+        posts_by_id[comment.post_id].comment_tree.append(comment)
+    return posts
+
+
+def top_comments(post_ids, limit):
+    """The `limit` newest top-level comments of each post, ranked with ROW_NUMBER() in one query."""
+    return (
+        Comment.objects.filter(post_id__in=post_ids, parent__isnull=True)
+        .annotate(
+            position=Window(
+                RowNumber(), partition_by=[F('post_id')], order_by=[F('created_at').desc(), F('pk').desc()]
+            )
+        )
+        .filter(position__lte=limit)
+        .order_by('post_id', 'position')
+    )
+
+
+def load_subtree(root, depth=SUBTREE_DEPTH, limit=SUBTREE_PAGE_SIZE, after=None):
+    """
+    Load the replies under `root`, at most `depth` levels deep and at most
+    `limit` newest replies per comment, in a single query.
+
+    Descendants are a tree_path prefix range scan on the (post, tree_path)
+    index, so only the requested branch is read. ROW_NUMBER() per parent cuts
+    each comment's replies to `limit` (plus one, to tell whether there are
+    more). `after` is the (created_at, pk) of the last reply of `root` the
+    client already has, to page through `root`'s own replies.
+
+    Returns `root`'s replies, newest first, each comment holding its own in
+    a `tree_replies` list. Every comment also gets `more_replies`: True if it has replies that weren't loaded,
+    because of `limit` or because it sits at the depth limit.
+    """
+    comments = Comment.objects.filter(
+        post_id=root.post_id,
+        tree_path__startswith=root.tree_path,
+        depth__gt=root.depth,
+        depth__lte=root.depth + depth,
+    )
+    if after is not None:
+        created_at, pk = after
+        comments = comments.exclude(
+            Q(parent_id=root.pk)
+            & ~(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        )
+    comments = (
+        comments.select_related('author')
+        .annotate(
+            position=Window(
+                RowNumber(), partition_by=[F('parent_id')], order_by=[F('created_at').desc(), F('pk').desc()]
+            )
+        )
+        .filter(position__lte=limit + 1)
+        .order_by('tree_path')
+    )
+
+    root.tree_replies = []
+    nodes = {root.pk: root}
+    for comment in comments:
+        parent = nodes.get(comment.parent_id)
+        if parent is None:
+            # Below a reply that was cut off by `limit`
+            continue
+        comment.tree_replies = []
+        nodes[comment.pk] = comment
+        parent.tree_replies.append(comment)
+
+    for comment in nodes.values():
+        _sort_newest_first(comment.tree_replies)
+        comment.more_replies = len(comment.tree_replies) > limit
+        del comment.tree_replies[limit:]
+        if comment.depth == root.depth + depth:
+            comment.more_replies = comment.reply_count > 0
+    return root.tree_replies
+
+
+def _sort_newest_first(comments):
+    comments.sort(key=lambda c: (c.created_at, c.pk), reverse=True)
@@ -0,0 +1,262 @@
+import atexit
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+
+from .versions import post_version, stamps_shared
+
+
+def write_behind_enabled():
+    """Whether like_count changes are buffered (settings.LIKE_COUNT_WRITE_BEHIND)."""
+    return getattr(settings, 'LIKE_COUNT_WRITE_BEHIND', False)
+
+
+class LikeCountBuffer:
+    """
+    In-process store of like_count deltas that haven't been written yet.
+
+    Deltas for the same post/comment collapse into one number and are written
+    by flush() as a single UPDATE per model, so a burst of likes on a hot post
+    takes its row lock once per flush instead of once per like. Unless
+    LIKE_COUNT_FLUSH_INTERVAL_MS is 0, a background thread flushes on that
+    interval, and whatever is left is flushed at exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._in_flight = {}
+        self._flusher = None
+
+    def add(self, model, pk, delta):
+        with self._lock:
+            self._pending[model, pk] += delta
+        self._start_flusher()
+
+    def pending(self, model, pk):
+        """Delta not yet visible in the database, including a flush in progress."""
+        key = (model, pk)
+        with self._lock:
+            return self._pending.get(key, 0) + self._in_flight.get(key, 0)
+
+    def flush(self):
+        """
+        Write all buffered deltas, one UPDATE per model. Returns the number of rows updated.
+        pending() keeps counting the deltas until the UPDATE commits, i.e. with
+        the outer transaction if flush() is called inside one.
+        """
+        with self._flush_lock:
+            with self._lock:
+                drained, self._pending = self._pending, defaultdict(int)
+                # Readers keep seeing these until the UPDATE has committed
+                in_flight = self._in_flight = dict(drained)
+
+            def committed():
+                # Right as the deltas become visible in the database, so readers never count them twice
+                with self._lock:
+                    if self._in_flight is in_flight:
+                        self._in_flight = {}
+
+            by_model = defaultdict(dict)
+            for (model, pk), delta in drained.items():
+                if delta:
+                    by_model[model][pk] = delta
+
+            updated = 0
+            try:
+                with transaction.atomic():
+                    for model, deltas in by_model.items():
+                        change = Case(
+                            *[When(pk=pk, then=Value(delta)) for pk, delta in sorted(deltas.items())],
+                            default=Value(0),
+                            output_field=IntegerField()
+                        )
+                        changes = {'like_count': F('like_count') + change}
+                        if model._meta.model_name == 'post':
+                            changes['total_likes'] = F('total_likes') + change
+                        updated += model.objects.filter(pk__in=deltas.keys()).update(**changes)
+                    transaction.on_commit(committed)
+            except Exception:
+                # Keep the deltas for the next flush rather than losing them
+                with self._lock:
+                    for key, delta in drained.items():
+                        self._pending[key] += delta
+                    self._in_flight = {}
+                raise
+            return updated
+
+    def _start_flusher(self):
+        interval = getattr(settings, 'LIKE_COUNT_FLUSH_INTERVAL_MS', 200)
+        if self._flusher is not None or not interval:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, args=(interval / 1000,), name='like-count-flusher', daemon=True
+                )
+                self._flusher.start()
+                atexit.register(self.flush)
+
+    def _run_flusher(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                # Deltas were put back; try again on the next tick
+                pass
+            finally:
+                connection.close()
+
+
+like_counts = LikeCountBuffer()
+
+
+def bump_like_count(model, pk, delta, post_id):
+    """
+    Change a post's or comment's like_count by `delta`; `post_id` is the post
+    it belongs to. Written straight away, to a random shard for hot targets or
+    with an F() update otherwise, or buffered once the current transaction
+    commits when write-behind is enabled.
+    """
+    if model._meta.model_name == 'comment':
+        comment_like_count_changed(post_id)
+    if write_behind_enabled():
+        transaction.on_commit(lambda: like_counts.add(model, pk, delta))
+        return
+
+    changes = {'like_count': F('like_count') + delta}
+    if model._meta.model_name == 'post':
+        # total_likes, the top feed's column, moves with like_count on unsharded posts
+        changes['total_likes'] = F('total_likes') + delta
+    if model.objects.filter(pk=pk, like_shards=0).update(**changes):
+        if delta > 0:
+            note_like(model, pk)
+        return
+
+    shards = model.objects.filter(pk=pk).values_list('like_shards', flat=True).first()
+    if shards:
+        with connection.cursor() as cursor:
+            add_to_shard(cursor, model, pk, delta, shards)
+
+
+def current_like_count(obj):
+    """
+    The full like_count of a loaded post/comment: the stored column, plus its
+    shards when it is sharded, plus any delta buffered by write-behind.
+    """
+    return like_count_of(obj._meta.model, obj.pk, obj.like_count, obj.like_shards)
+
+
+def like_count_of(model, pk, like_count, like_shards):
+    """current_like_count for a target read as plain values."""
+    like_count += like_counts.pending(model, pk)
+    if like_shards:
+        like_count += shard_sum(model, pk)
+    return like_count
+
+
+# Like count overlay for cached comment trees
+#
+# Cached comment trees keep the like counts they were loaded with. The current
+# counts of a post's comments are kept in the cache as a single
+# {comment_id: like_count} entry per post, dropped whenever a like changes one
+# of them and read back in one query on the next miss. A like never has to
+# invalidate a whole tree, and a big thread takes one cache entry, not one per
+# comment. When the cache isn't shared another worker can't drop the entry, so
+# it is keyed by the post's version stamp instead, which every like moves on.
+
+def overlay_comment_like_counts(post_id, like_counts):
+    """Store the current like counts of a post's comments, as {comment_id: like_count}."""
+    cache.set(_like_counts_key(post_id), like_counts, getattr(settings, 'LIKE_COUNT_OVERLAY_TTL', 60))
+
+
+def overlaid_comment_like_counts(post_id):
+    """Current like counts of a post's comments as {comment_id: like_count}, with one query on a miss."""
+    like_counts = cache.get(_like_counts_key(post_id))
+    if like_counts is None:
+        comment_model = apps.get_model('feed', 'Comment')
+        like_counts = {
+            pk: like_count_of(comment_model, pk, like_count, like_shards)
+            for pk, like_count, like_shards in comment_model.objects.filter(post_id=post_id).values_list(
+                'pk', 'like_count', 'like_shards'
+            )
+        }
+        overlay_comment_like_counts(post_id, like_counts)
+    return like_counts
+
+
+def comment_like_count_changed(post_id):
+    """Drop the like counts of a post's comments from the overlay once the current transaction commits."""
+    if stamps_shared():
+        transaction.on_commit(lambda: cache.delete(_like_counts_key(post_id)))
+
+
+def _like_counts_key(post_id):
+    if stamps_shared():
+        return f'comment_like_counts:{post_id}'
+    return f'comment_like_counts:{post_id}:{post_version(post_id)}'
+
+
+# Sharded counters for hot posts/comments
+#
+# A target is promoted once it receives LIKE_SHARDING_THRESHOLD likes within a
+# minute: its like_shards is set to LIKE_COUNTER_SHARDS and from then on likes
+# land on a random LikeCountShard row instead of the target's own row. Writers
+# go by like_shards in the row itself, so a target demoted by
+# recompute_counters in any process is written to its row again right away.
+
+def note_like(model, pk):
+    """Track a target's like rate and promote it to sharded counting once it runs hot."""
+    threshold = getattr(settings, 'LIKE_SHARDING_THRESHOLD', 0)
+    if not threshold or connection.vendor not in ('postgresql', 'sqlite'):
+        # Shard writes rely on INSERT ... ON CONFLICT
+        return
+    key = f'like_rate:{model._meta.label_lower}:{pk}:{int(time.time() // 60)}'
+    cache.add(key, 0, 120)
+    try:
+        rate = cache.incr(key)
+    except ValueError:
+        return
+    if rate == threshold:
+        shards = getattr(settings, 'LIKE_COUNTER_SHARDS', 16)
+        model.objects.filter(pk=pk, like_shards=0).update(like_shards=shards)
+
+
+def add_to_shard(cursor, model, pk, delta, shards):
+    """Add `delta` to a random shard of the target with a single upsert."""
+    shard_model = apps.get_model('feed', 'LikeCountShard')
+    table = shard_model._meta.db_table
+    target = f'{model._meta.model_name}_id'
+    cursor.execute(
+        f'INSERT INTO {table} (post_id, comment_id, shard, count) VALUES (%s, %s, %s, %s) '
+        f'ON CONFLICT ({target}, shard) WHERE {target} IS NOT NULL '
+        f'DO UPDATE SET count = {table}.count + excluded.count',
+        [
+            pk if target == 'post_id' else None,
+            pk if target == 'comment_id' else None,
+            random.randrange(shards),
+            delta,
+        ]
+    )
+
+
+def shard_sum(model, pk):
+    """Sum of a sharded target's shards, cached for LIKE_SHARD_SUM_TTL seconds."""
+    key = f'like_shard_sum:{model._meta.label_lower}:{pk}'
+    total = cache.get(key)
+    if total is None:
+        shard_model = apps.get_model('feed', 'LikeCountShard')
+        total = shard_model.objects.filter(**{model._meta.model_name: pk}).aggregate(
+            total=Sum('count')
+        )['total'] or 0
+        cache.set(key, total, getattr(settings, 'LIKE_SHARD_SUM_TTL', 1))
+    return total
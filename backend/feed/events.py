@@ -0,0 +1,214 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .counters import like_count_of, overlaid_comment_like_counts
+
+
+class Subscription:
+    """One listener's queue of broker messages, read from its own event loop."""
+
+    def __init__(self, maxsize):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        # Set when messages had to be dropped; the listener should resync
+        self.overflowed = False
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class LocalBroker:
+    """
+    In-process pub/sub for live updates.
+
+    publish() may be called from any thread (request threads, on_commit
+    callbacks); each message is handed to every subscriber on its own event
+    loop. Only listeners in the same process see the messages, so several
+    workers need a shared broker behind settings.EVENT_BROKER.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, maxsize=1000):
+        subscription = Subscription(maxsize)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self):
+        return bool(self._subscriptions)
+
+    def publish(self, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # Its loop has closed; the stream is gone
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    """The process-wide broker, built from settings.EVENT_BROKER on first use."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'EVENT_BROKER', 'feed.events.LocalBroker'))()
+    return _broker
+
+
+# Publishing
+#
+# Each helper queues its message for when the current transaction commits,
+# and does nothing while nobody is listening.
+
+def like_changed(model, pk, post_id, like_count=None):
+    """A like on a post or comment changed its like count (read back if not given)."""
+    def publish():
+        if not broker().has_subscribers():
+            return
+        count = like_count
+        if count is None and model._meta.model_name == 'comment':
+            count = overlaid_comment_like_counts(post_id).get(pk, 0)
+        elif count is None:
+            row = model.objects.filter(pk=pk).values_list('like_count', 'like_shards').first()
+            count = like_count_of(model, pk, *row) if row else 0
+        broker().publish({
+            'type': model._meta.model_name, 'post_id': post_id, 'id': pk, 'like_count': count,
+        })
+
+    transaction.on_commit(publish)
+
+
+def comment_created(post_id, comment_id, parent_id):
+    def publish():
+        if broker().has_subscribers():
+            broker().publish({'type': 'new_comment', 'post_id': post_id, 'id': comment_id, 'parent': parent_id})
+
+    transaction.on_commit(publish)
+
+
+def leaderboard_changed():
+    """The cached leaderboards were invalidated (called once that has happened)."""
+    if broker().has_subscribers():
+        broker().publish({'type': 'leaderboard'})
+
+
+# Server-Sent Events
+
+async def event_stream(post_ids=None, window=None, limit=None):
+    """
+    Subscribe to the broker and turn what it publishes into a Server-Sent
+    Events stream, until the client goes away.
+
+    Messages arriving within EVENTS_COALESCE_MS of each other are merged into
+    one `post` event per post (its like count, changed comment like counts
+    and new comment ids), optionally only for `post_ids`. With a leaderboard
+    `window`, the stream starts with that board and then sends `leaderboard`
+    events holding only the rows that moved or changed and the users who
+    dropped off. A comment line goes out every EVENTS_KEEPALIVE_SECONDS
+    while idle, and a `resync` event if messages were dropped.
+    """
+    # Imported here: karma imports the models, which publish through this module
+    from .karma import cached_top_users
+
+    coalesce = getattr(settings, 'EVENTS_COALESCE_MS', 250) / 1000
+    keepalive = getattr(settings, 'EVENTS_KEEPALIVE_SECONDS', 15)
+    subscription = broker().subscribe()
+    board = []
+    try:
+        yield b'retry: 3000\n\n'
+        if window:
+            board = await sync_to_async(cached_top_users)(window, limit)
+            yield _sse('leaderboard', _leaderboard_diff([], board))
+
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                messages = [await asyncio.wait_for(subscription.queue.get(), keepalive)]
+            except asyncio.TimeoutError:
+                yield b': keepalive\n\n'
+                continue
+            deadline = loop.time() + coalesce
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    messages.append(await asyncio.wait_for(subscription.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield _sse('resync', {})
+
+            posts, leaderboard_moved = coalesce_messages(messages, post_ids)
+            for update in posts.values():
+                yield _sse('post', update)
+
+            if window and leaderboard_moved:
+                leaderboard = await sync_to_async(cached_top_users)(window, limit)
+                diff, board = _leaderboard_diff(board, leaderboard), leaderboard
+                if diff['changed'] or diff['removed']:
+                    yield _sse('leaderboard', diff)
+    finally:
+        broker().unsubscribe(subscription)
+
+
+def coalesce_messages(messages, post_ids=None):
+    """
+    Merge broker messages into one update per post, in order of first
+    appearance, keeping the latest like counts. Returns the updates by post
+    id and whether any message concerned the leaderboard.
+    """
+    posts = {}
+    leaderboard_moved = False
+    for message in messages:
+        if message['type'] == 'leaderboard':
+            leaderboard_moved = True
+            continue
+        post_id = message['post_id']
+        if post_ids is not None and post_id not in post_ids:
+            continue
+        update = posts.setdefault(post_id, {'post_id': post_id})
+        if message['type'] == 'post':
+            update['like_count'] = message['like_count']
+        elif message['type'] == 'comment':
+            update.setdefault('comment_like_counts', {})[message['id']] = message['like_count']
+        elif message['type'] == 'new_comment':
+            update.setdefault('new_comments', []).append({'id': message['id'], 'parent': message['parent']})
+    return posts, leaderboard_moved
+
+
+def _leaderboard_diff(old, new):
+    previous = {(rank, row['user_id']): row for rank, row in enumerate(old, 1)}
+    changed = [
+        dict(row, rank=rank) for rank, row in enumerate(new, 1)
+        if previous.get((rank, row['user_id'])) != row
+    ]
+    remaining = {row['user_id'] for row in new}
+    removed = [row['user_id'] for row in old if row['user_id'] not in remaining]
+    return {'changed': changed, 'removed': removed}
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'.encode()
@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Post, Follow, InboxEntry
+
+
+# The following feed is fanned out on write: a new post is pushed into an
+# inbox row per follower, so reading a page is a range read on one user's
+# inbox. Authors with FANOUT_MAX_FOLLOWERS or more followers would turn one
+# post into that many inserts, so their followers pull their posts at read
+# time instead and the two are merged.
+
+
+def fanout_max_followers():
+    return getattr(settings, 'FANOUT_MAX_FOLLOWERS', 10000)
+
+
+INBOX_TRIM_KEY = 'inbox:trimmed'
+
+
+def inbox_size():
+    """Entries kept per inbox by trim_inboxes (settings.INBOX_SIZE)."""
+    return getattr(settings, 'INBOX_SIZE', 500)
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    if created:
+        fan_out(instance)
+
+
+def fan_out(post):
+    """
+    Push a new post into its author's followers' inboxes, with a single
+    INSERT ... SELECT over their follow rows. Authors whose followers pull
+    get nothing pushed.
+
+    The followers' inboxes are then trimmed back to INBOX_SIZE, at most
+    once per INBOX_TRIM_INTERVAL seconds per author, so an inbox only
+    outgrows its size by what is pushed in between.
+    """
+    if Follow.objects.filter(followee_id=post.author_id, pull=True).exists():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {InboxEntry._meta.db_table} (user_id, post_id, created_at) '
+            f'SELECT follower_id, %s, %s FROM {Follow._meta.db_table} WHERE followee_id = %s',
+            [post.pk, connection.ops.adapt_datetimefield_value(post.created_at), post.author_id]
+        )
+    interval = getattr(settings, 'INBOX_TRIM_INTERVAL', 60)
+    if not interval or cache.add(f'{INBOX_TRIM_KEY}:{post.author_id}', True, interval):
+        trim_inboxes(followee_id=post.author_id)
+
+
+def follow(follower_id, followee_id):
+    """
+    Make `follower_id` follow `followee_id`. Returns False if they already did.
+
+    The followee's recent posts are pushed into the new follower's inbox. The
+    follow that takes the followee to FANOUT_MAX_FOLLOWERS switches all their
+    followers to pulling; their posts already in inboxes are merged away on read.
+    """
+    with transaction.atomic():
+        pull = Follow.objects.filter(followee_id=followee_id, pull=True).exists()
+        try:
+            with transaction.atomic():
+                Follow.objects.create(follower_id=follower_id, followee_id=followee_id, pull=pull)
+        except IntegrityError:
+            return False
+        if pull:
+            return True
+
+        if Follow.objects.filter(followee_id=followee_id)[:fanout_max_followers()].count() >= fanout_max_followers():
+            Follow.objects.filter(followee_id=followee_id).update(pull=True)
+            return True
+
+        recent = Post.objects.filter(author_id=followee_id).order_by('-created_at')[:getattr(settings, 'INBOX_BACKFILL', 20)]
+        InboxEntry.objects.bulk_create(
+            [
+                InboxEntry(user_id=follower_id, post_id=pk, created_at=created_at)
+                for pk, created_at in recent.values_list('pk', 'created_at')
+            ],
+            ignore_conflicts=True
+        )
+    return True
+
+
+def unfollow(follower_id, followee_id):
+    """Stop following, taking the followee's posts out of the inbox. Returns False if not following."""
+    with transaction.atomic():
+        if not Follow.objects.filter(follower_id=follower_id, followee_id=followee_id).delete()[0]:
+            return False
+        InboxEntry.objects.filter(user_id=follower_id, post__author_id=followee_id).delete()
+    return True
+
+
+def following_page(user_id, after, limit, rows):
+    """
+    Up to `limit` posts of `user_id`'s following feed, newest first, read
+    through `rows` (e.g. post_rows) and continuing after the cursor position
+    `after`, a (created_at, id) pair or None.
+
+    Pushed posts are one range read on the user's inbox. Pulled authors, if
+    the user follows any, add one read on the (author, -created_at) index,
+    and the two are merged.
+    """
+    # One filter() call, so every condition is on the same inbox row (the user's)
+    inbox = Q(inbox_entries__user_id=user_id)
+    if after is not None:
+        created_at, pk = after
+        inbox &= (
+            Q(inbox_entries__created_at__lt=created_at)
+            | Q(inbox_entries__created_at=created_at, inbox_entries__post_id__gt=pk)
+        )
+    pushed = Post.objects.filter(inbox)
+    results = list(rows(pushed.order_by('-inbox_entries__created_at', 'inbox_entries__post_id')[:limit]))
+
+    pulled_authors = list(Follow.objects.filter(follower_id=user_id, pull=True).values_list('followee_id', flat=True))
+    if pulled_authors:
+        pulled = Post.objects.filter(author_id__in=pulled_authors)
+        if after is not None:
+            pulled = pulled.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__gt=pk))
+        seen = {row['id'] for row in results}
+        results += [
+            row for row in rows(pulled.order_by('-created_at', 'id')[:limit]) if row['id'] not in seen
+        ]
+        results.sort(key=lambda row: row['id'])
+        results.sort(key=lambda row: row['created_at'], reverse=True)
+    return results[:limit]
+
+
+def trim_inboxes(size=None, followee_id=None):
+    """
+    Delete inbox entries beyond the newest `size` (settings.INBOX_SIZE) of
+    each user, or only of the followers of `followee_id`, keeping inboxes
+    bounded. Returns how many were deleted.
+    """
+    if size is None:
+        size = inbox_size()
+    table = InboxEntry._meta.db_table
+    where, params = '', []
+    if followee_id is not None:
+        where = f'WHERE user_id IN (SELECT follower_id FROM {Follow._meta.db_table} WHERE followee_id = %s) '
+        params.append(followee_id)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN (SELECT id FROM ('
+            f'SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at DESC, post_id) AS position '
+            f'FROM {table} {where}) ranked WHERE position > %s)',
+            params + [size]
+        )
+        return cursor.rowcount
@@ -0,0 +1,272 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import versions
+from .events import leaderboard_changed
+from .models import KarmaEvent, KarmaBucket, KARMA_BUCKET_SIZE, POST_LIKE_KARMA, COMMENT_LIKE_KARMA
+from .signals import karma_adjusted
+
+
+LEADERBOARD_WINDOWS = {
+    '1h': timedelta(hours=1),
+    '24h': timedelta(hours=24),
+    '7d': timedelta(days=7),
+}
+DEFAULT_LEADERBOARD_WINDOW = '24h'
+LEADERBOARD_WINDOW = LEADERBOARD_WINDOWS[DEFAULT_LEADERBOARD_WINDOW]
+LEADERBOARD_SIZE = 5
+# Largest `limit` the API accepts; every window is ranked this deep in one pass
+LEADERBOARD_MAX_SIZE = 50
+
+# Buckets older than this can no longer fall inside any leaderboard window
+KARMA_BUCKET_RETENTION = max(LEADERBOARD_WINDOWS.values()) + KARMA_BUCKET_SIZE
+
+LEADERBOARD_CACHE_KEY = 'leaderboard:top_users'
+KARMA_PRUNE_KEY = 'karma_buckets:pruned'
+
+
+def top_users(since=None, limit=LEADERBOARD_SIZE):
+    """
+    Rank users by karma received since `since` (default: the last 24 hours).
+    Returns dicts shaped for LeaderboardSerializer.
+    """
+    if since is None:
+        since = timezone.now() - LEADERBOARD_WINDOW
+    return rank_windows({'since': since}, limit)['since']
+
+
+def rank_windows(windows, limit=LEADERBOARD_MAX_SIZE):
+    """
+    Rank users for several windows at once, given as {name: since}.
+
+    Whole buckets inside each window are summed from KarmaBucket, and only the
+    partial bucket at each window's edge is read from the KarmaEvent ledger.
+    All windows come out of the same bucket query and the same ledger query,
+    with one conditional sum per window, so the cost grows with the number of
+    active users rather than the number of likes or windows.
+    """
+    edges = {}
+    for name, since in windows.items():
+        first_full_bucket = KarmaBucket.floor(since)
+        if first_full_bucket < since:
+            first_full_bucket += KARMA_BUCKET_SIZE
+        edges[name] = (since, first_full_bucket)
+
+    totals = {name: defaultdict(lambda: {'karma': 0, 'post_likes': 0, 'comment_likes': 0}) for name in windows}
+
+    bucket_sums = {}
+    for name, (since, first_full_bucket) in edges.items():
+        in_window = Q(bucket_start__gte=first_full_bucket)
+        bucket_sums[f'karma_{name}'] = Sum('karma', filter=in_window)
+        bucket_sums[f'post_likes_{name}'] = Sum('post_likes', filter=in_window)
+        bucket_sums[f'comment_likes_{name}'] = Sum('comment_likes', filter=in_window)
+    buckets = KarmaBucket.objects.filter(
+        bucket_start__gte=min(first_full_bucket for _, first_full_bucket in edges.values())
+    ).values('user_id').annotate(**bucket_sums).order_by()
+    for row in buckets:
+        for name in windows:
+            _accumulate(totals[name][row['user_id']], row, name)
+
+    edge_sums = {}
+    edge_ranges = Q()
+    for name, (since, first_full_bucket) in edges.items():
+        in_edge = Q(created_at__gte=since, created_at__lt=first_full_bucket)
+        edge_ranges |= in_edge
+        edge_sums[f'karma_{name}'] = Sum('points', filter=in_edge)
+        edge_sums[f'post_likes_{name}'] = Count('pk', filter=in_edge & Q(points=POST_LIKE_KARMA))
+        edge_sums[f'comment_likes_{name}'] = Count('pk', filter=in_edge & Q(points=COMMENT_LIKE_KARMA))
+    edge = KarmaEvent.objects.filter(edge_ranges).values('recipient_id').annotate(**edge_sums).order_by()
+    for row in edge:
+        for name in windows:
+            _accumulate(totals[name][row['recipient_id']], row, name)
+
+    ranked = {
+        name: sorted(
+            ((user_id, row) for user_id, row in window_totals.items() if row['karma'] > 0),
+            key=lambda item: (-item[1]['karma'], item[0])
+        )[:limit]
+        for name, window_totals in totals.items()
+    }
+
+    usernames = dict(
+        User.objects.filter(
+            pk__in={user_id for window_ranked in ranked.values() for user_id, _ in window_ranked}
+        ).values_list('pk', 'username')
+    )
+    return {
+        name: [
+            {
+                'user_id': user_id,
+                'username': usernames.get(user_id, ''),
+                'karma': row['karma'],
+                'post_likes': row['post_likes'],
+                'comment_likes': row['comment_likes'],
+            }
+            for user_id, row in window_ranked
+        ]
+        for name, window_ranked in ranked.items()
+    }
+
+
+def cached_top_users(window=DEFAULT_LEADERBOARD_WINDOW, limit=LEADERBOARD_SIZE, generation=None):
+    """
+    The top users for one of LEADERBOARD_WINDOWS, served from the cache.
+
+    On a miss every window is ranked LEADERBOARD_MAX_SIZE deep in a single pass
+    and cached, so the other windows and limits are then served without
+    recomputing. Entries live for LEADERBOARD_CACHE_TTL seconds, and likes that
+    could change a ranking invalidate them all through karma_changed. Pass
+    the `generation` (versions.leaderboard_version) if it's already been read.
+    """
+    if generation is None:
+        generation = versions.leaderboard_version()
+    key = f'{LEADERBOARD_CACHE_KEY}:{generation}:{window}:{limit}'
+    leaderboard = cache.get(key)
+    if leaderboard is not None:
+        return leaderboard
+
+    timeout = getattr(settings, 'LEADERBOARD_CACHE_TTL', 10)
+    full_keys = {name: f'{LEADERBOARD_CACHE_KEY}:{generation}:{name}' for name in LEADERBOARD_WINDOWS}
+    full = cache.get(full_keys[window])
+    if full is None:
+        now = timezone.now()
+        boards = rank_windows({name: now - delta for name, delta in LEADERBOARD_WINDOWS.items()})
+        cache.set_many({full_keys[name]: board for name, board in boards.items()}, timeout)
+        full = boards[window]
+
+    leaderboard = full[:limit]
+    cache.set(key, leaderboard, timeout)
+    return leaderboard
+
+
+def leaderboard_version(generation=None):
+    """
+    Version stamp for the cached leaderboards: their generation plus the
+    LEADERBOARD_CACHE_TTL period we're in, since boards also change as the
+    windows slide. Like the cache, it can lag a change by up to the TTL.
+    """
+    if generation is None:
+        generation = versions.leaderboard_version()
+    timeout = getattr(settings, 'LEADERBOARD_CACHE_TTL', 10)
+    return f'{generation}:{int(timezone.now().timestamp() // max(timeout, 1))}'
+
+
+def karma_changed(recipient_id, points):
+    """
+    Invalidate the cached leaderboards once a karma change commits, if it could
+    change a ranking. Nothing changes for a user who isn't on any board if
+    they lost karma, or if even after the gain they still score below the
+    last entry of every (full) board.
+    """
+    def invalidate():
+        generation = versions.leaderboard_version()
+        boards = cache.get_many([f'{LEADERBOARD_CACHE_KEY}:{generation}:{name}' for name in LEADERBOARD_WINDOWS])
+        if len(boards) == len(LEADERBOARD_WINDOWS) and all(
+            row['user_id'] != recipient_id for board in boards.values() for row in board
+        ):
+            if points < 0 or _below_every_board(recipient_id, boards.values()):
+                return
+        # Bumping the generation retires every cached (window, limit) entry at once
+        versions.leaderboards_changed()
+        leaderboard_changed()
+
+    transaction.on_commit(invalidate)
+    transaction.on_commit(_prune_buckets_now_and_then)
+
+
+@receiver(karma_adjusted)
+def karma_adjusted_by_like(sender, recipient_id, points, **kwargs):
+    """Invalidate the cached leaderboards for karma a Like recorded or re-dated."""
+    karma_changed(recipient_id, points)
+
+
+@receiver(pre_delete, sender=KarmaEvent)
+def karma_event_deleted(sender, instance, **kwargs):
+    """
+    Take a like's karma back out of its bucket when its ledger row goes, be it
+    through Like.delete or cascaded from a deleted post, comment or user.
+
+    A plain UPDATE: a bucket already pruned, or going with its user, is left alone.
+    """
+    is_post = 1 if instance.points == POST_LIKE_KARMA else 0
+    KarmaBucket.objects.filter(
+        user_id=instance.recipient_id, bucket_start=KarmaBucket.floor(instance.created_at)
+    ).update(
+        karma=F('karma') - instance.points,
+        post_likes=F('post_likes') - is_post,
+        comment_likes=F('comment_likes') - (1 - is_post),
+    )
+    karma_changed(instance.recipient_id, -instance.points)
+
+
+def _below_every_board(user_id, boards):
+    """
+    Whether `user_id` scores below the last entry of each of the full
+    `boards`. Their karma over the longest window, edge bucket included, is
+    an upper bound for every window, so it's one query on their buckets.
+    """
+    if any(len(board) < LEADERBOARD_MAX_SIZE for board in boards):
+        return False
+    since = KarmaBucket.floor(timezone.now() - max(LEADERBOARD_WINDOWS.values()))
+    karma = KarmaBucket.objects.filter(user_id=user_id, bucket_start__gte=since).aggregate(karma=Sum('karma'))['karma']
+    return all((karma or 0) < board[-1]['karma'] for board in boards)
+
+
+def prune_buckets(now=None):
+    """
+    Delete karma buckets that have slid out of every leaderboard window.
+    Karma changes do so at most once per KARMA_BUCKET_PRUNE_INTERVAL seconds.
+    """
+    if now is None:
+        now = timezone.now()
+    deleted, _ = KarmaBucket.objects.filter(bucket_start__lt=now - KARMA_BUCKET_RETENTION).delete()
+    return deleted
+
+
+def rebuild_buckets(now=None):
+    """
+    Rebuild the retained karma buckets from the KarmaEvent ledger.
+    Repairs drift from deletes made in raw SQL, outside the ORM.
+    """
+    if now is None:
+        now = timezone.now()
+    since = KarmaBucket.floor(now - KARMA_BUCKET_RETENTION)
+
+    buckets = {}
+    events = KarmaEvent.objects.filter(created_at__gte=since).values_list('recipient_id', 'created_at', 'points')
+    for recipient_id, created_at, points in events.iterator():
+        key = (recipient_id, KarmaBucket.floor(created_at))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = KarmaBucket(user_id=recipient_id, bucket_start=key[1])
+        bucket.karma += points
+        if points == POST_LIKE_KARMA:
+            bucket.post_likes += 1
+        else:
+            bucket.comment_likes += 1
+
+    with transaction.atomic():
+        KarmaBucket.objects.all().delete()
+        KarmaBucket.objects.bulk_create(buckets.values(), batch_size=1000)
+    return len(buckets)
+
+
+def _accumulate(total, row, name):
+    total['karma'] += row[f'karma_{name}'] or 0
+    total['post_likes'] += row[f'post_likes_{name}'] or 0
+    total['comment_likes'] += row[f'comment_likes_{name}'] or 0
+
+
+def _prune_buckets_now_and_then():
+    interval = getattr(settings, 'KARMA_BUCKET_PRUNE_INTERVAL', 60 * 60)
+    if not interval or cache.add(KARMA_PRUNE_KEY, True, interval):
+        prune_buckets()
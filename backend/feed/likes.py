@@ -0,0 +1,396 @@
+from collections import defaultdict
+from datetime import timezone as dt_timezone
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .counters import (
+    add_to_shard, comment_like_count_changed, current_like_count, like_counts, note_like, write_behind_enabled
+)
+from .karma import karma_changed
+from .models import (
+    Post, Comment, Like, KarmaEvent, KarmaBucket, LikeCountShard, POST_LIKE_KARMA, COMMENT_LIKE_KARMA
+)
+from .users import with_user_ids
+from .events import like_changed
+from .ranking import post_liked
+from .versions import post_changed
+
+
+# Largest number of operations accepted by apply_like_batch
+LIKE_BATCH_MAX_SIZE = 500
+# Unlikes deleted per statement: SQLite caps the depth of an expression tree
+# (1000 by default), and each one adds an OR to the WHERE clause
+LIKE_BATCH_DELETE_SIZE = 200
+
+
+def supports_fast_path():
+    """
+    Whether the database can do INSERT ... ON CONFLICT DO NOTHING and
+    UPDATE/DELETE ... RETURNING (PostgreSQL, SQLite 3.35+).
+    """
+    return connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_columns_from_insert
+
+
+def add_like(user_id, model, pk):
+    """
+    Like the Post or Comment `pk` as `user_id`.
+
+    Returns the new like_count, or None if the user had already liked it.
+    Raises model.DoesNotExist if there is no such post/comment.
+
+    The like is a single INSERT ... ON CONFLICT DO NOTHING, so the unique
+    constraints settle double likes without a SELECT first, and the counter
+    bump returns the new like_count and the author to credit in the same
+    UPDATE. Falls back to the model's save() on other databases.
+    """
+    if not supports_fast_path():
+        return _add_like_with_orm(user_id, model, pk)
+
+    _, target = _like_target(model)
+    points = POST_LIKE_KARMA if model is Post else COMMENT_LIKE_KARMA
+    now = timezone.now()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {Like._meta.db_table} (user_id, {target}, created_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT DO NOTHING RETURNING id',
+            [user_id, pk, connection.ops.adapt_datetimefield_value(now)]
+        )
+        inserted = cursor.fetchone()
+        if inserted is None:
+            return None
+
+        updated = _change_like_count(cursor, model, pk, 1)
+        if updated is None:
+            # Rolls back the like inserted above
+            raise model.DoesNotExist(f'No {model._meta.model_name} with id {pk}.')
+        like_count, recipient_id = updated
+
+        KarmaEvent.objects.create(like_id=inserted[0], recipient_id=recipient_id, points=points, created_at=now)
+        KarmaBucket.add(recipient_id, now, points)
+        karma_changed(recipient_id, points)
+
+    return like_count
+
+
+def remove_like(user_id, model, pk):
+    """
+    Remove `user_id`'s like from the Post or Comment `pk`.
+
+    Returns the new like_count, or None if the user had not liked it.
+    Raises model.DoesNotExist if there is no such post/comment.
+    Uses DELETE/UPDATE ... RETURNING instead of loading the like first; the
+    target is only looked up when there was no like to delete.
+    """
+    if not supports_fast_path():
+        return _remove_like_with_orm(user_id, model, pk)
+
+    _, target = _like_target(model)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # The ledger row goes first: raw deletes don't run the ORM's cascade
+        cursor.execute(
+            f'DELETE FROM {KarmaEvent._meta.db_table} WHERE like_id IN '
+            f'(SELECT id FROM {Like._meta.db_table} WHERE user_id = %s AND {target} = %s) '
+            f'RETURNING recipient_id, points, created_at',
+            [user_id, pk]
+        )
+        event = cursor.fetchone()
+
+        cursor.execute(
+            f'DELETE FROM {Like._meta.db_table} WHERE user_id = %s AND {target} = %s RETURNING id',
+            [user_id, pk]
+        )
+        if cursor.fetchone() is None:
+            return _missing_like(model, pk)
+
+        like_count, _ = _change_like_count(cursor, model, pk, -1)
+
+        if event is not None:
+            recipient_id, points, created_at = event
+            KarmaBucket.add(recipient_id, _as_datetime(created_at), points, count=-1)
+            karma_changed(recipient_id, -points)
+
+    return like_count
+
+
+def apply_like_batch(operations):
+    """
+    Apply a burst of like/unlike operations, e.g. a mobile client's offline queue.
+
+    `operations` is a list of dicts with `username`, `action` ('like' or
+    'unlike') and the target `model` (Post or Comment) and `pk`. Returns one
+    result per operation, in order: a `status` ('liked', 'already_liked',
+    'unliked', 'not_liked', 'not_found' or 'superseded') plus the target's
+    `like_count` once it has been updated.
+
+    Users that aren't cached are resolved in one query, likes are inserted in one
+    INSERT ... ON CONFLICT DO NOTHING and removed in one DELETE, and each
+    liked post/comment gets a single UPDATE for its net like_count change.
+    """
+    return with_user_ids(
+        {operation['username'] for operation in operations},
+        lambda user_ids: _apply_like_batch(operations, user_ids)
+    )
+
+
+def _apply_like_batch(operations, user_ids):
+    results = [None] * len(operations)
+
+    # Only the last operation on each (user, target) pair counts, as if applied in order
+    latest = {}
+    for index, operation in enumerate(operations):
+        key = (operation['username'], operation['model'], operation['pk'])
+        if key in latest:
+            results[latest[key]] = {'status': 'superseded'}
+        latest[key] = index
+
+    authors = {
+        model: dict(
+            model.objects.filter(
+                pk__in={operation['pk'] for operation in operations if operation['model'] is model}
+            ).values_list('pk', 'author_id')
+        )
+        for model in (Post, Comment)
+    }
+
+    to_add, to_remove = [], []
+    for index in sorted(latest.values()):
+        operation = operations[index]
+        if operation['pk'] not in authors[operation['model']]:
+            results[index] = {'status': 'not_found'}
+        elif operation['action'] == 'like':
+            to_add.append(index)
+        else:
+            to_remove.append(index)
+
+    if not supports_fast_path():
+        for index in to_add + to_remove:
+            operation = operations[index]
+            user_id = user_ids[operation['username']]
+            if index in to_add:
+                like_count = add_like(user_id, operation['model'], operation['pk'])
+                status = 'already_liked' if like_count is None else 'liked'
+            else:
+                like_count = remove_like(user_id, operation['model'], operation['pk'])
+                status = 'not_liked' if like_count is None else 'unliked'
+            results[index] = {'status': status} if like_count is None else {'status': status, 'like_count': like_count}
+        return results
+
+    now = timezone.now()
+    like_deltas = defaultdict(int)
+    karma_deltas = defaultdict(int)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if to_add:
+            params = []
+            for index in to_add:
+                operation = operations[index]
+                params += [
+                    user_ids[operation['username']],
+                    operation['pk'] if operation['model'] is Post else None,
+                    operation['pk'] if operation['model'] is Comment else None,
+                    connection.ops.adapt_datetimefield_value(now),
+                ]
+            cursor.execute(
+                f'INSERT INTO {Like._meta.db_table} (user_id, post_id, comment_id, created_at) VALUES '
+                + ', '.join(['(%s, %s, %s, %s)'] * len(to_add))
+                + ' ON CONFLICT DO NOTHING RETURNING id, user_id, post_id, comment_id',
+                params
+            )
+            inserted = {
+                (user_id, Post if post_id else Comment, post_id or comment_id): like_id
+                for like_id, user_id, post_id, comment_id in cursor.fetchall()
+            }
+
+            events = []
+            for index in to_add:
+                operation = operations[index]
+                model, pk = operation['model'], operation['pk']
+                like_id = inserted.get((user_ids[operation['username']], model, pk))
+                if like_id is None:
+                    results[index] = {'status': 'already_liked'}
+                    continue
+                results[index] = {'status': 'liked'}
+                like_deltas[model, pk] += 1
+
+                recipient_id = authors[model][pk]
+                points = POST_LIKE_KARMA if model is Post else COMMENT_LIKE_KARMA
+                events.append(KarmaEvent(like_id=like_id, recipient_id=recipient_id, points=points, created_at=now))
+                karma_deltas[recipient_id, KarmaBucket.floor(now), points] += 1
+            KarmaEvent.objects.bulk_create(events)
+
+        if to_remove:
+            removed = set()
+            for start in range(0, len(to_remove), LIKE_BATCH_DELETE_SIZE):
+                chunk = [operations[index] for index in to_remove[start:start + LIKE_BATCH_DELETE_SIZE]]
+                removed |= _delete_likes(cursor, chunk, user_ids, karma_deltas)
+            for index in to_remove:
+                operation = operations[index]
+                model, pk = operation['model'], operation['pk']
+                if (user_ids[operation['username']], model, pk) in removed:
+                    results[index] = {'status': 'unliked'}
+                    like_deltas[model, pk] -= 1
+                else:
+                    results[index] = {'status': 'not_liked'}
+
+        new_counts = {}
+        for (model, pk), delta in like_deltas.items():
+            new_counts[model, pk], _ = _change_like_count(cursor, model, pk, delta)
+
+        for (recipient_id, bucket_start, points), count in karma_deltas.items():
+            if count:
+                KarmaBucket.add(recipient_id, bucket_start, points, count=count)
+                karma_changed(recipient_id, count * points)
+
+    for index in to_add + to_remove:
+        operation = operations[index]
+        if results[index]['status'] in ('liked', 'unliked'):
+            results[index]['like_count'] = new_counts[operation['model'], operation['pk']]
+    return results
+
+
+def _delete_likes(cursor, operations, user_ids, karma_deltas):
+    """
+    Delete the likes of unlike `operations` (at most LIKE_BATCH_DELETE_SIZE)
+    with their ledger rows, taking the karma back out of `karma_deltas`.
+    Returns the (user_id, model, pk) of the likes that were there.
+    """
+    conditions, params = [], []
+    for operation in operations:
+        _, target = _like_target(operation['model'])
+        conditions.append(f'(user_id = %s AND {target} = %s)')
+        params += [user_ids[operation['username']], operation['pk']]
+    matching = ' OR '.join(conditions)
+
+    # The ledger rows go first: raw deletes don't run the ORM's cascade
+    cursor.execute(
+        f'DELETE FROM {KarmaEvent._meta.db_table} WHERE like_id IN '
+        f'(SELECT id FROM {Like._meta.db_table} WHERE {matching}) '
+        f'RETURNING recipient_id, points, created_at',
+        params
+    )
+    for recipient_id, points, created_at in cursor.fetchall():
+        karma_deltas[recipient_id, KarmaBucket.floor(_as_datetime(created_at)), points] -= 1
+
+    cursor.execute(
+        f'DELETE FROM {Like._meta.db_table} WHERE {matching} RETURNING user_id, post_id, comment_id',
+        params
+    )
+    return {
+        (user_id, Post if post_id else Comment, post_id or comment_id)
+        for user_id, post_id, comment_id in cursor.fetchall()
+    }
+
+
+def _add_like_with_orm(user_id, model, pk):
+    target = model.objects.get(pk=pk)
+    try:
+        with transaction.atomic():
+            Like.objects.create(user_id=user_id, **{model._meta.model_name: target})
+    except IntegrityError:
+        return None
+    return current_like_count(model.objects.only('like_count', 'like_shards').get(pk=pk))
+
+
+def _remove_like_with_orm(user_id, model, pk):
+    like = Like.objects.filter(user_id=user_id, **{f'{model._meta.model_name}_id': pk}).first()
+    if like is None:
+        return _missing_like(model, pk)
+    with transaction.atomic():
+        like.delete()
+    return current_like_count(model.objects.only('like_count', 'like_shards').get(pk=pk))
+
+
+def _missing_like(model, pk):
+    """None for an unlike of a target the user hadn't liked; raises model.DoesNotExist if it doesn't exist."""
+    if not model.objects.filter(pk=pk).exists():
+        raise model.DoesNotExist(f'No {model._meta.model_name} with id {pk}.')
+    return None
+
+
+def _change_like_count(cursor, model, pk, delta):
+    """
+    Apply `delta` to the target's like count and return (like_count, author_id),
+    or None if the target doesn't exist.
+
+    Normally a single UPDATE ... RETURNING. Hot (sharded) targets get an upsert
+    on a random shard instead, and with write-behind enabled the delta is
+    buffered; both then only read the target row. Either way the row also
+    gives the post whose version stamp is bumped and whose listeners are told.
+    """
+    table, target = _like_target(model)
+    thread = 'id' if model is Post else 'post_id'
+    if write_behind_enabled():
+        # A plain read: the row lock is only taken by the periodic flush
+        cursor.execute(f'SELECT like_count, author_id, {thread} FROM {table} WHERE id = %s', [pk])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        transaction.on_commit(lambda: like_counts.add(model, pk, delta))
+        return _like_count_changed(model, pk, row[0] + like_counts.pending(model, pk) + delta, *row[1:])
+
+    # The row decides: a sharded target's row isn't matched, so isn't locked either.
+    # Posts keep total_likes, the top feed's column, exact in the same UPDATE.
+    totals = ', total_likes = total_likes + %s' if model is Post else ''
+    cursor.execute(
+        f'UPDATE {table} SET like_count = like_count + %s{totals} WHERE id = %s AND like_shards = 0 '
+        f'RETURNING like_count, author_id, {thread}',
+        [delta] * (2 if model is Post else 1) + [pk]
+    )
+    row = cursor.fetchone()
+    if row is not None:
+        if delta > 0:
+            note_like(model, pk)
+        return _like_count_changed(model, pk, *row)
+
+    cursor.execute(f'SELECT like_shards FROM {table} WHERE id = %s', [pk])
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    add_to_shard(cursor, model, pk, delta, row[0])
+
+    cursor.execute(
+        f'SELECT t.like_count + COALESCE((SELECT SUM(s.count) FROM {LikeCountShard._meta.db_table} s '
+        f'WHERE s.{target} = t.id), 0), t.author_id, t.{thread} FROM {table} t WHERE t.id = %s',
+        [pk]
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return _like_count_changed(model, pk, *row)
+
+
+def _like_count_changed(model, pk, like_count, author_id, post_id):
+    """
+    Bump the post's version stamp, rescore it if the like was on the post
+    (or drop its comments' overlaid like counts if on a comment) and publish
+    the new count, then return (like_count, author_id).
+    """
+    post_changed(post_id)
+    if model is Post:
+        post_liked(pk)
+    else:
+        comment_like_count_changed(post_id)
+    like_changed(model, pk, post_id, like_count)
+    return like_count, author_id
+
+
+def _like_target(model):
+    """The counter table and the Like column pointing at it."""
+    if model is Post:
+        return Post._meta.db_table, 'post_id'
+    if model is Comment:
+        return Comment._meta.db_table, 'comment_id'
+    raise ValueError(f'Cannot like a {model.__name__}.')
+
+
+def _as_datetime(value):
+    """Raw cursors on SQLite return timestamps as text."""
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from feed.karma import prune_buckets
+
+
+class Command(BaseCommand):
+    """
+    Delete karma buckets that have slid out of the leaderboard window.
+    Karma changes already prune once per KARMA_BUCKET_PRUNE_INTERVAL; this
+    is for pruning on demand, e.g. after a quiet period.
+    """
+    help = 'Delete expired leaderboard karma buckets.'
+
+    def handle(self, *args, **options):
+        deleted = prune_buckets()
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} expired karma buckets.'))
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from feed.karma import rebuild_buckets
+from feed.models import Post, Comment, Like, LikeCountShard
+
+
+def _count_subquery(queryset, field):
+    """Correlated COUNT of `queryset` rows whose `field` points at the outer row."""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    """
+    Recompute the denormalized counters from the source rows.
+
+    Comment.save/delete and Like.save/delete keep these up to date, but bulk
+    deletes and manual data fixes bypass them. Run this to repair any drift.
+    It also folds sharded like counters back into like_count.
+    """
+    help = 'Recompute comment_count, reply_count, like_count and karma buckets from the source rows.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            # like_count becomes the full count again, so hot targets go back to a single row
+            LikeCountShard.objects.all().delete()
+            posts = Post.objects.update(
+                comment_count=_count_subquery(Comment.objects.all(), 'post'),
+                like_count=_count_subquery(Like.objects.all(), 'post'),
+                total_likes=_count_subquery(Like.objects.all(), 'post'),
+                like_shards=0,
+            )
+            comments = Comment.objects.update(
+                reply_count=_count_subquery(Comment.objects.all(), 'parent'),
+                like_count=_count_subquery(Like.objects.all(), 'comment'),
+                like_shards=0,
+            )
+        buckets = rebuild_buckets()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed counters for {posts} posts and {comments} comments, '
+            f'and rebuilt {buckets} karma buckets.'
+        ))
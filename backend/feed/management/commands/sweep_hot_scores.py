@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from feed.ranking import sweep_hot_scores
+
+
+class Command(BaseCommand):
+    """
+    Rescore recent posts for the hot feed, as their scores decay with age.
+    Meant to be run periodically (e.g. every few minutes from cron).
+    """
+    help = 'Recompute the hot_score of recent posts.'
+
+    def handle(self, *args, **options):
+        rescored = sweep_hot_scores()
+        self.stdout.write(self.style.SUCCESS(f'Rescored {rescored} posts.'))
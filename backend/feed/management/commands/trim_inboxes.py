@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from feed.following import trim_inboxes
+
+
+class Command(BaseCommand):
+    """
+    Trim following-feed inboxes back to their newest INBOX_SIZE entries.
+    New posts already trim their followers' inboxes; this trims every inbox
+    at once, e.g. after INBOX_SIZE was lowered.
+    """
+    help = 'Delete following-feed inbox entries beyond each inbox\'s size.'
+
+    def handle(self, *args, **options):
+        deleted = trim_inboxes()
+        self.stdout.write(self.style.SUCCESS(f'Trimmed {deleted} inbox entries.'))
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:49
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    Comment = apps.get_model('feed', 'Comment')
+
+    comments_per_post = Comment.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+        total=Count('pk')
+    ).values('total')
+    Post.objects.update(comment_count=Coalesce(Subquery(comments_per_post), 0))
+
+    replies_per_comment = Comment.objects.filter(parent=OuterRef('pk')).order_by().values('parent').annotate(
+        total=Count('pk')
+    ).values('total')
+    Comment.objects.update(reply_count=Coalesce(Subquery(replies_per_comment), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_karma_events(apps, schema_editor):
+    Like = apps.get_model('feed', 'Like')
+    KarmaEvent = apps.get_model('feed', 'KarmaEvent')
+
+    events = []
+    for like in Like.objects.select_related('post', 'comment').iterator():
+        if like.post_id:
+            recipient_id, points = like.post.author_id, 5
+        else:
+            recipient_id, points = like.comment.author_id, 1
+        events.append(KarmaEvent(
+            like_id=like.pk,
+            recipient_id=recipient_id,
+            points=points,
+            created_at=like.created_at,
+        ))
+    KarmaEvent.objects.bulk_create(events, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('feed', '0002_post_comment_count_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.SmallIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('like', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='karma_event', to='feed.like')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'recipient', 'points'], name='feed_karmae_created_0911e3_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_karma_events, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.9 on 2026-10-17 03:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import datetime, timedelta, timezone
+
+
+def backfill_karma_buckets(apps, schema_editor):
+    KarmaEvent = apps.get_model('feed', 'KarmaEvent')
+    KarmaBucket = apps.get_model('feed', 'KarmaBucket')
+
+    # Only the last day (plus one bucket) can still appear on the leaderboard
+    since = datetime.now(tz=timezone.utc) - timedelta(hours=24, minutes=5)
+    buckets = {}
+    events = KarmaEvent.objects.filter(created_at__gte=since).values_list('recipient_id', 'created_at', 'points')
+    for recipient_id, created_at, points in events.iterator():
+        seconds = int(created_at.timestamp())
+        start = datetime.fromtimestamp(seconds - seconds % 300, tz=timezone.utc)
+        bucket = buckets.get((recipient_id, start))
+        if bucket is None:
+            bucket = buckets[(recipient_id, start)] = KarmaBucket(user_id=recipient_id, bucket_start=start)
+        bucket.karma += points
+        if points == 5:
+            bucket.post_likes += 1
+        else:
+            bucket.comment_likes += 1
+    KarmaBucket.objects.bulk_create(buckets.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('feed', '0003_karmaevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('karma', models.IntegerField(default=0)),
+                ('post_likes', models.IntegerField(default=0)),
+                ('comment_likes', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='karmabucket',
+            constraint=models.UniqueConstraint(fields=('bucket_start', 'user'), name='unique_karma_bucket_per_user'),
+        ),
+        migrations.RunPython(backfill_karma_buckets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.9 on 2026-10-17 04:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0004_karmabucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='LikeCountShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='like_count_shards', to='feed.comment')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='like_count_shards', to='feed.post')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='likecountshard',
+            constraint=models.UniqueConstraint(condition=models.Q(('post__isnull', False)), fields=('post', 'shard'), name='unique_shard_per_post'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecountshard',
+            constraint=models.UniqueConstraint(condition=models.Q(('comment__isnull', False)), fields=('comment', 'shard'), name='unique_shard_per_comment'),
+        ),
+    ]
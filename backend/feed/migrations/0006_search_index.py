@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from feed.search import install_search_index
+    install_search_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from feed.search import drop_search_index
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0005_like_count_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
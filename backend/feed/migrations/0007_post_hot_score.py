@@ -0,0 +1,44 @@
+# Generated by Django 4.2.9 on 2026-10-17 04:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_hot_scores(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    now = timezone.now()
+    gravity = getattr(settings, 'HOT_SCORE_GRAVITY', 1.8)
+    posts = list(Post.objects.filter(like_count__gt=0).only('id', 'created_at', 'like_count'))
+    for post in posts:
+        age_hours = max((now - post.created_at).total_seconds(), 0) / 3600
+        post.hot_score = post.like_count / (age_hours + 2) ** gravity
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='feed_post_created_f96649_idx',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', 'id'], name='feed_post_hot_sco_45d4c5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-like_count', 'id'], name='feed_post_like_co_485fc7_idx'),
+        ),
+        migrations.RunPython(backfill_hot_scores, migrations.RunPython.noop),
+    ]
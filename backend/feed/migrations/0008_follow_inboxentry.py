@@ -0,0 +1,75 @@
+# Generated by Django 4.2.9 on 2026-10-17 04:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('feed', '0007_post_hot_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Follow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pull', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['author', '-created_at'], name='feed_post_author__c854fa_idx'),
+        ),
+        migrations.AddField(
+            model_name='inboxentry',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to='feed.post'),
+        ),
+        migrations.AddField(
+            model_name='inboxentry',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inbox_entries', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='followee',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='followers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='follow',
+            name='follower',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='following', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='inboxentry',
+            index=models.Index(fields=['user', '-created_at', 'post'], name='feed_inboxe_user_id_c53c9b_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inboxentry',
+            constraint=models.UniqueConstraint(fields=('user', 'post'), name='unique_inbox_entry'),
+        ),
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['followee', 'pull'], name='feed_follow_followe_8000aa_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.UniqueConstraint(fields=('follower', 'followee'), name='unique_follow'),
+        ),
+        migrations.AddConstraint(
+            model_name='follow',
+            constraint=models.CheckConstraint(check=models.Q(('follower', models.F('followee')), _negated=True), name='follow_not_self'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.9 on 2026-10-17 04:54
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_total_likes(apps, schema_editor):
+    Post = apps.get_model('feed', 'Post')
+    LikeCountShard = apps.get_model('feed', 'LikeCountShard')
+    shard_total = LikeCountShard.objects.filter(post=OuterRef('pk')).order_by().values('post').annotate(
+        total=Sum('count')
+    ).values('total')
+    Post.objects.update(total_likes=F('like_count') + Coalesce(Subquery(shard_total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0008_follow_inboxentry'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='post',
+            name='feed_post_like_co_485fc7_idx',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='total_likes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-total_likes', 'id'], name='feed_post_total_l_5058ef_idx'),
+        ),
+        migrations.RunPython(backfill_total_likes, migrations.RunPython.noop),
+    ]
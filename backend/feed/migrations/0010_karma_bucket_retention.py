@@ -0,0 +1,38 @@
+# Generated by Django 4.2.9 on 2026-10-17 05:10
+
+from django.db import migrations
+from datetime import datetime, timedelta, timezone
+
+
+def rebuild_karma_buckets(apps, schema_editor):
+    KarmaEvent = apps.get_model('feed', 'KarmaEvent')
+    KarmaBucket = apps.get_model('feed', 'KarmaBucket')
+
+    # 0004 only backfilled the last day; the 7d leaderboard needs the last week (plus one bucket)
+    since = datetime.now(tz=timezone.utc) - timedelta(days=7, minutes=5)
+    buckets = {}
+    events = KarmaEvent.objects.filter(created_at__gte=since).values_list('recipient_id', 'created_at', 'points')
+    for recipient_id, created_at, points in events.iterator():
+        seconds = int(created_at.timestamp())
+        start = datetime.fromtimestamp(seconds - seconds % 300, tz=timezone.utc)
+        bucket = buckets.get((recipient_id, start))
+        if bucket is None:
+            bucket = buckets[(recipient_id, start)] = KarmaBucket(user_id=recipient_id, bucket_start=start)
+        bucket.karma += points
+        if points == 5:
+            bucket.post_likes += 1
+        else:
+            bucket.comment_likes += 1
+    KarmaBucket.objects.all().delete()
+    KarmaBucket.objects.bulk_create(buckets.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0009_post_total_likes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_karma_buckets, migrations.RunPython.noop),
+    ]
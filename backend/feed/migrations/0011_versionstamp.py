@@ -0,0 +1,20 @@
+# Generated by Django 4.2.9 on 2026-10-17 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feed', '0010_karma_bucket_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionStamp',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -1,7 +1,22 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
 from django.db.models import F
 from django.utils import timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
+from .counters import bump_like_count
+from .events import comment_created, like_changed
+from .ranking import post_liked
+from .signals import karma_adjusted
+from .versions import comments_changed, post_changed
+
+
+# Karma earned by an author for each like they receive
+POST_LIKE_KARMA = 5
+COMMENT_LIKE_KARMA = 1
+
+# Width of the time buckets karma is rolled up into for the leaderboard
+KARMA_BUCKET_SIZE = timedelta(minutes=5)
 
 
 class Post(models.Model):
@@ -13,13 +28,33 @@ class Post(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     like_count = models.IntegerField(default=0, db_index=True)
+    # Number of LikeCountShard rows also holding likes for this post (0 = not sharded)
+    like_shards = models.PositiveSmallIntegerField(default=0)
+    # Denormalized total of all comments (at any depth), kept in sync by Comment.save/delete
+    comment_count = models.IntegerField(default=0)
+    # Time-decayed rank for the hot feed, kept up to date by feed.ranking
+    hot_score = models.FloatField(default=0)
+    # like_count plus the post's like shards, for the top feed, kept up to date by feed.ranking
+    total_likes = models.IntegerField(default=0)
     
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['-created_at', 'like_count']),
+            # One per feed sort, matching the keyset pagination order
+            models.Index(fields=['-hot_score', 'id']),
+            models.Index(fields=['-total_likes', 'id']),
+            # Posts of followed authors pulled into the following feed
+            models.Index(fields=['author', '-created_at']),
         ]
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        post_changed(self.pk)
+    
+    def delete(self, *args, **kwargs):
+        post_changed(self.pk)
+        return super().delete(*args, **kwargs)
+    
     def __str__(self):
         return f"Post by {self.author.username}: {self.content[:50]}"
 
@@ -36,6 +71,10 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     like_count = models.IntegerField(default=0)
+    # Number of LikeCountShard rows also holding likes for this comment (0 = not sharded)
+    like_shards = models.PositiveSmallIntegerField(default=0)
+    # Denormalized count of direct replies, kept in sync by save/delete
+    reply_count = models.IntegerField(default=0)
     
     # Tree path helps with efficient querying of nested structures
     # Format: "1/3/5/" means comment 5 is a child of 3, which is a child of 1
@@ -55,6 +94,7 @@ class Comment(models.Model):
         Override save to automatically calculate tree_path and depth.
         This enables efficient querying of comment trees without recursive queries.
         """
+        is_new = self.pk is None
         if self.parent:
             self.depth = self.parent.depth + 1
             if not self.pk:
@@ -74,6 +114,31 @@ class Comment(models.Model):
             else:
                 self.tree_path = f"{self.pk}/"
                 super().save(*args, **kwargs)
+        
+        if is_new:
+            # Update the denormalized counters on the post and parent comment
+            Post.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') + 1)
+            if self.parent_id:
+                Comment.objects.filter(pk=self.parent_id).update(reply_count=F('reply_count') + 1)
+            comment_created(self.post_id, self.pk, self.parent_id)
+        comments_changed(self.post_id)
+    
+    def delete(self, *args, **kwargs):
+        """
+        Override delete to update comment counts.
+        Replies are removed by the cascade, so the post loses the whole subtree.
+        """
+        removed = Comment.objects.filter(
+            post_id=self.post_id,
+            tree_path__startswith=self.tree_path
+        ).count() if self.tree_path else 1
+        
+        Post.objects.filter(pk=self.post_id).update(comment_count=F('comment_count') - removed)
+        if self.parent_id:
+            Comment.objects.filter(pk=self.parent_id).update(reply_count=F('reply_count') - 1)
+        comments_changed(self.post_id)
+        
+        return super().delete(*args, **kwargs)
     
     def __str__(self):
         return f"Comment by {self.author.username} on {self.post.id}"
@@ -127,23 +192,255 @@ class Like(models.Model):
         if is_new:
             # Update the like count on the related object
             if self.post:
-                Post.objects.filter(pk=self.post.pk).update(like_count=F('like_count') + 1)
+                bump_like_count(Post, self.post.pk, 1, self.thread_id)
+                post_liked(self.post_id)
             elif self.comment:
-                Comment.objects.filter(pk=self.comment.pk).update(like_count=F('like_count') + 1)
+                bump_like_count(Comment, self.comment.pk, 1, self.thread_id)
+            post_changed(self.thread_id)
+            like_changed(*self.target, self.thread_id)
+            
+            # Record the karma earned by the author of the liked post/comment
+            KarmaEvent.objects.create(
+                like=self,
+                recipient_id=self.karma_recipient_id,
+                points=self.karma_points,
+                created_at=self.created_at
+            )
+            KarmaBucket.add(self.karma_recipient_id, self.created_at, self.karma_points)
+            karma_adjusted.send(self.__class__, recipient_id=self.karma_recipient_id, points=self.karma_points)
+        elif kwargs.get('update_fields') is None or 'created_at' in kwargs['update_fields']:
+            # Keep the ledger and buckets in step if the like was re-dated
+            event = KarmaEvent.objects.filter(like=self).first()
+            if event and event.created_at != self.created_at:
+                KarmaBucket.add(event.recipient_id, event.created_at, event.points, count=-1)
+                KarmaBucket.add(event.recipient_id, self.created_at, event.points)
+                KarmaEvent.objects.filter(pk=event.pk).update(created_at=self.created_at)
+                karma_adjusted.send(self.__class__, recipient_id=event.recipient_id, points=event.points)
     
     def delete(self, *args, **kwargs):
         """
         Override delete to update like counts when a like is removed.
+        The like's KarmaEvent is removed with it by the cascade, taking its
+        karma out of the buckets (see karma.karma_event_deleted).
         """
         if self.post:
-            Post.objects.filter(pk=self.post.pk).update(like_count=F('like_count') - 1)
+            bump_like_count(Post, self.post.pk, -1, self.thread_id)
+            post_liked(self.post_id)
         elif self.comment:
-            Comment.objects.filter(pk=self.comment.pk).update(like_count=F('like_count') - 1)
-        
+            bump_like_count(Comment, self.comment.pk, -1, self.thread_id)
+        post_changed(self.thread_id)
+        like_changed(*self.target, self.thread_id)
         super().delete(*args, **kwargs)
     
+    @property
+    def karma_recipient_id(self):
+        """The user who earns karma from this like."""
+        return self.post.author_id if self.post else self.comment.author_id
+    
+    @property
+    def target(self):
+        """The liked model and its pk."""
+        return (Post, self.post_id) if self.post_id else (Comment, self.comment_id)
+    
+    @property
+    def thread_id(self):
+        """The post whose thread shows this like."""
+        return self.post_id or self.comment.post_id
+    
+    @property
+    def karma_points(self):
+        return POST_LIKE_KARMA if self.post else COMMENT_LIKE_KARMA
+    
     def __str__(self):
         if self.post:
             return f"{self.user.username} liked post {self.post.id}"
         else:
             return f"{self.user.username} liked comment {self.comment.id}"
+
+
+class LikeCountShard(models.Model):
+    """
+    One of K counter rows sharing the like count of a hot post or comment.
+    Writers add to a random shard so concurrent likes don't queue on one row
+    lock; the full count is like_count plus the sum of the shards.
+    """
+    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.CASCADE, related_name='like_count_shards')
+    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE, related_name='like_count_shards')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['post', 'shard'],
+                condition=models.Q(post__isnull=False),
+                name='unique_shard_per_post'
+            ),
+            models.UniqueConstraint(
+                fields=['comment', 'shard'],
+                condition=models.Q(comment__isnull=False),
+                name='unique_shard_per_comment'
+            ),
+        ]
+    
+    def __str__(self):
+        target = f"post {self.post_id}" if self.post_id else f"comment {self.comment_id}"
+        return f"Shard {self.shard} of {target}: {self.count}"
+
+
+class KarmaEvent(models.Model):
+    """
+    Karma ledger: one row per like, crediting the author of the liked post or comment.
+    Written by Like.save and removed with the like, so summing points over a
+    time window gives exactly the karma from likes that still exist.
+    """
+    like = models.OneToOneField(Like, on_delete=models.CASCADE, related_name='karma_event')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_events')
+    points = models.SmallIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            # Covering index for the leaderboard: window range scan grouped by recipient
+            models.Index(fields=['created_at', 'recipient', 'points']),
+        ]
+    
+    def __str__(self):
+        return f"{self.points} karma for {self.recipient_id} at {self.created_at}"
+
+
+class KarmaBucket(models.Model):
+    """
+    Karma rolled up per user into fixed KARMA_BUCKET_SIZE time buckets.
+    A 24h window is then the sum of ~288 bucket rows per active user instead of
+    one ledger row per like. Maintained by Like.save/delete.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='karma_buckets')
+    bucket_start = models.DateTimeField()
+    karma = models.IntegerField(default=0)
+    post_likes = models.IntegerField(default=0)
+    comment_likes = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            # Also serves as the (bucket_start, user) index for window scans
+            models.UniqueConstraint(fields=['bucket_start', 'user'], name='unique_karma_bucket_per_user'),
+        ]
+    
+    @staticmethod
+    def floor(timestamp):
+        """Start of the bucket that `timestamp` falls into."""
+        size = int(KARMA_BUCKET_SIZE.total_seconds())
+        seconds = int(timestamp.timestamp())
+        return datetime.fromtimestamp(seconds - seconds % size, tz=dt_timezone.utc)
+    
+    @classmethod
+    def add(cls, user_id, timestamp, points, count=1):
+        """
+        Atomically add `count` likes worth `points` karma each (a negative count
+        removes them) to the user's bucket for `timestamp`, creating it if needed.
+        """
+        is_post = 1 if points == POST_LIKE_KARMA else 0
+        if connection.vendor in ('postgresql', 'sqlite'):
+            # Single-statement upsert
+            table = cls._meta.db_table
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, bucket_start, karma, post_likes, comment_likes) '
+                    f'VALUES (%s, %s, %s, %s, %s) '
+                    f'ON CONFLICT (bucket_start, user_id) DO UPDATE SET '
+                    f'karma = {table}.karma + excluded.karma, '
+                    f'post_likes = {table}.post_likes + excluded.post_likes, '
+                    f'comment_likes = {table}.comment_likes + excluded.comment_likes',
+                    [
+                        user_id,
+                        connection.ops.adapt_datetimefield_value(cls.floor(timestamp)),
+                        count * points,
+                        count * is_post,
+                        count * (1 - is_post),
+                    ]
+                )
+            return
+        
+        bucket = cls.objects.filter(user_id=user_id, bucket_start=cls.floor(timestamp))
+        changes = {
+            'karma': F('karma') + count * points,
+            'post_likes': F('post_likes') + count * is_post,
+            'comment_likes': F('comment_likes') + count * (1 - is_post),
+        }
+        if bucket.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    user_id=user_id,
+                    bucket_start=cls.floor(timestamp),
+                    karma=count * points,
+                    post_likes=count * is_post,
+                    comment_likes=count * (1 - is_post)
+                )
+        except IntegrityError:
+            # Another writer created the bucket first
+            bucket.update(**changes)
+    
+    def __str__(self):
+        return f"{self.karma} karma for {self.user_id} from {self.bucket_start}"
+
+
+class Follow(models.Model):
+    """
+    One user following another, for the personalized "following" feed.
+    """
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='followers')
+    # The followee has too many followers to push posts to: followers pull
+    # their posts at read time instead (see feed.following)
+    pull = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            # Also serves as the follower index
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+            models.CheckConstraint(check=~models.Q(follower=models.F('followee')), name='follow_not_self'),
+        ]
+        indexes = [
+            models.Index(fields=['followee', 'pull']),
+        ]
+    
+    def __str__(self):
+        return f"{self.follower_id} follows {self.followee_id}"
+
+
+class InboxEntry(models.Model):
+    """
+    A post pushed into a follower's inbox when it was created, so a page of
+    their following feed is a range read on (user, -created_at, post).
+    created_at is the post's, copied so the index holds the feed order.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='inbox_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='inbox_entries')
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'post'], name='unique_inbox_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-created_at', 'post']),
+        ]
+    
+    def __str__(self):
+        return f"Post {self.post_id} in the inbox of {self.user_id}"
+
+
+class VersionStamp(models.Model):
+    """
+    A version stamp kept in the database, for when the cache isn't shared
+    between workers (see feed.versions). Read by primary key.
+    """
+    key = models.CharField(max_length=100, primary_key=True)
+    value = models.BigIntegerField()
+    
+    def __str__(self):
+        return f"{self.key} = {self.value}"
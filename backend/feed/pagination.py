@@ -0,0 +1,124 @@
+import base64
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class FeedPagination(PageNumberPagination):
+    """
+    Page-number pagination with an opt-in keyset (cursor) mode.
+
+    `?pagination=cursor` switches to keyset pagination ordered by
+    `ordering`, (-created_at, id) unless the view sets another descending
+    column. Each page is a single range scan on that column's index with no
+    COUNT and no OFFSET, so page N costs the same as page 1. The response
+    carries an opaque `next` link holding the cursor.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset(request)
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            field = queryset.model._meta.get_field(self.ordering[0].lstrip('-'))
+            value, pk = self.decode_cursor(cursor, field)
+            queryset = queryset.filter(
+                Q(**{f'{field.name}__lt': value}) | Q(**{field.name: value, 'id__gt': pk})
+            )
+
+        # Fetch one extra row to know whether there is a next page
+        results = list(queryset[:self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page_results = results[:self.page_size]
+        return self.page_results
+
+    def paginate_fetched(self, fetch, request):
+        """
+        Keyset-paginate rows read by `fetch(after, limit)` rather than from a
+        queryset: `after` is the decoded cursor position or None, and `fetch`
+        returns up to `limit` rows following it in this paginator's ordering.
+        """
+        self.keyset = True
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        results = list(fetch(self.decode_cursor(cursor) if cursor else None, self.page_size + 1))
+        self.has_next = len(results) > self.page_size
+        self.page_results = results[:self.page_size]
+        return self.page_results
+
+    def is_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.cursor_query_param in request.query_params
+        )
+
+    def paginate_counted(self, results, count, queryset, request):
+        """
+        Set up a page-number page as paginate_queryset would, from its `results`
+        and the `count` of the whole queryset, for callers that ran the COUNT
+        alongside the page query instead of before it.
+        """
+        self.keyset = False
+        self.request = request
+        page_number = request.query_params.get(self.page_query_param) or 1
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        paginator.count = count
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = results
+        return results
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        last = self.page_results[-1]
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        url = replace_query_param(url, self.mode_query_param, 'cursor')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(last))
+
+    def encode_cursor(self, obj):
+        # Pages hold model instances, or plain rows on the fast rendering path
+        name = self.ordering[0].lstrip('-')
+        value, pk = (obj[name], obj['id']) if isinstance(obj, dict) else (getattr(obj, name), obj.pk)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        position = f'{value}|{pk}'
+        return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor, field=None):
+        """The (value, pk) in a cursor, with the value parsed by `field` (a created_at datetime by default)."""
+        try:
+            position = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            value, pk = position.rsplit('|', 1)
+            value = datetime.fromisoformat(value) if field is None else field.to_python(value)
+            return value, int(pk)
+        except (TypeError, ValueError, UnicodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
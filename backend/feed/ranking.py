@@ -0,0 +1,175 @@
+import atexit
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .versions import feed_changed
+
+
+# Orderings of the feed's `sort` modes, each backed by a (column, id) index
+FEED_SORTS = {
+    'new': ('-created_at', 'id'),
+    'hot': ('-hot_score', 'id'),
+    'top': ('-total_likes', 'id'),
+}
+DEFAULT_FEED_SORT = 'new'
+
+HOT_SCORE_KEY = 'hot_score:rescored'
+
+
+def hot_score(like_count, created_at, now=None):
+    """
+    How hot a post is: its likes over its age in hours (plus 2) raised to
+    settings.HOT_SCORE_GRAVITY, so a post needs ever more likes to stay up.
+    """
+    if now is None:
+        now = timezone.now()
+    age_hours = max((now - created_at).total_seconds(), 0) / 3600
+    return like_count / (age_hours + 2) ** getattr(settings, 'HOT_SCORE_GRAVITY', 1.8)
+
+
+def rescore_posts(queryset, now=None):
+    """
+    Recompute and store the hot_score of the posts in `queryset`, in one
+    bulk UPDATE per batch. Returns how many were rescored.
+
+    Likes keep total_likes exact with F() deltas, except on sharded posts
+    whose likes land on their shards: those get their total re-summed here,
+    straight from LikeCountShard in one query rather than through the
+    shard_sum cache, so a rescore never stores a stale total.
+    """
+    post_model = apps.get_model('feed', 'Post')
+    if now is None:
+        now = timezone.now()
+    posts = list(queryset.only('id', 'created_at', 'like_count', 'like_shards', 'total_likes'))
+    sharded = [post for post in posts if post.like_shards]
+    if sharded:
+        shard_totals = dict(
+            apps.get_model('feed', 'LikeCountShard').objects.filter(post_id__in=[post.pk for post in sharded])
+            .values('post_id').annotate(total=Sum('count')).values_list('post_id', 'total')
+        )
+        for post in sharded:
+            post.total_likes = post.like_count + shard_totals.get(post.pk, 0)
+    for post in posts:
+        post.hot_score = hot_score(post.total_likes, post.created_at, now)
+    post_model.objects.bulk_update(
+        [post for post in posts if not post.like_shards], ['hot_score'], batch_size=500
+    )
+    post_model.objects.bulk_update(sharded, ['total_likes', 'hot_score'], batch_size=500)
+    return len(posts)
+
+
+class PendingRescores:
+    """
+    Posts liked again within HOT_SCORE_MIN_INTERVAL of their last rescore.
+
+    Rather than rewriting a hot post's row on every like, their rescores are
+    collected here and run together by flush(). A background thread flushes
+    every HOT_SCORE_MIN_INTERVAL seconds, so a throttled rescore trails the
+    burst by at most that, and whatever is left is flushed at exit.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._post_ids = set()
+        self._flusher = None
+
+    def add(self, post_id):
+        with self._lock:
+            self._post_ids.add(post_id)
+        self._start_flusher()
+
+    def __contains__(self, post_id):
+        with self._lock:
+            return post_id in self._post_ids
+
+    def flush(self):
+        """Rescore every post collected so far. Returns how many were rescored."""
+        with self._lock:
+            post_ids, self._post_ids = self._post_ids, set()
+        if not post_ids:
+            return 0
+        try:
+            rescored = rescore_posts(apps.get_model('feed', 'Post').objects.filter(pk__in=post_ids))
+        except Exception:
+            # Keep them for the next flush
+            with self._lock:
+                self._post_ids |= post_ids
+            raise
+        feed_changed()
+        return rescored
+
+    def _start_flusher(self):
+        interval = getattr(settings, 'HOT_SCORE_MIN_INTERVAL', 1)
+        if self._flusher is not None or not interval:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(
+                    target=self._run_flusher, args=(interval,), name='hot-score-flusher', daemon=True
+                )
+                self._flusher.start()
+                atexit.register(self._flush_at_exit)
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            # Nothing is lost that the next sweep_hot_scores won't redo
+            pass
+
+    def _run_flusher(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                # Posts were put back; try again on the next tick
+                pass
+            finally:
+                connection.close()
+
+
+pending_rescores = PendingRescores()
+
+
+def post_liked(post_id):
+    """
+    Rescore a post once a like on it commits. A post liked again within
+    HOT_SCORE_MIN_INTERVAL seconds is left to pending_rescores instead, so
+    a burst of likes on a hot post doesn't rewrite its row every time.
+    """
+    def rescore():
+        interval = getattr(settings, 'HOT_SCORE_MIN_INTERVAL', 1)
+        if interval and not cache.add(f'{HOT_SCORE_KEY}:{post_id}', True, interval):
+            pending_rescores.add(post_id)
+            return
+        rescore_posts(apps.get_model('feed', 'Post').objects.filter(pk=post_id))
+        feed_changed()
+
+    transaction.on_commit(rescore)
+
+
+def sweep_hot_scores(now=None):
+    """
+    Periodic batch rescoring, as scores decay with age. Posts from the last
+    HOT_SCORE_WINDOW_HOURS are rescored, older ones drop to 0. Sharded posts
+    of any age are rescored too, folding their shards into total_likes.
+    Returns how many posts were rescored.
+    """
+    post_model = apps.get_model('feed', 'Post')
+    if now is None:
+        now = timezone.now()
+    since = now - timedelta(hours=getattr(settings, 'HOT_SCORE_WINDOW_HOURS', 7 * 24))
+    with transaction.atomic():
+        rescored = rescore_posts(post_model.objects.filter(Q(created_at__gte=since) | Q(like_shards__gt=0)), now)
+        post_model.objects.filter(created_at__lt=since, hot_score__gt=0).update(hot_score=0)
+    feed_changed()
+    return rescored
@@ -0,0 +1,157 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.compat import LONG_SEPARATORS, SHORT_SEPARATORS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed, falling back
+    to the standard library encoder otherwise. Output is the same JSON either
+    way, including the \\u2028/\\u2029 escaping.
+
+    iter_render() encodes a response a piece at a time, for streaming.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            # Pretty printing is left to the standard renderer
+            return super().render(data, accepted_media_type, renderer_context)
+        return self.encode(data)
+
+    def encode(self, data):
+        """Compact JSON for `data`, as bytes."""
+        if orjson is not None and self.compact and not self.ensure_ascii:
+            ret = orjson.dumps(
+                data,
+                default=self._default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        else:
+            ret = json.dumps(
+                data, cls=self.encoder_class, ensure_ascii=self.ensure_ascii,
+                allow_nan=not self.strict, separators=SHORT_SEPARATORS if self.compact else LONG_SEPARATORS
+            ).encode()
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+    def iter_render(self, data, chunk_size=None):
+        """
+        Yield the JSON for `data` in chunks of roughly `chunk_size` bytes
+        (settings.STREAMING_JSON_CHUNK_SIZE). Dicts and lists are opened up two
+        levels deep, so only one item of a feed page or one top-level comment
+        is encoded at a time.
+        """
+        if chunk_size is None:
+            chunk_size = getattr(settings, 'STREAMING_JSON_CHUNK_SIZE', 64 * 1024)
+        buffer = []
+        buffered = 0
+        for piece in self._iter_encode(data, 2):
+            buffer.append(piece)
+            buffered += len(piece)
+            if buffered >= chunk_size:
+                yield b''.join(buffer)
+                buffer, buffered = [], 0
+        if buffer:
+            yield b''.join(buffer)
+
+    def _iter_encode(self, data, depth):
+        if depth and isinstance(data, dict):
+            yield b'{'
+            for index, (key, value) in enumerate(data.items()):
+                yield (b',' if index else b'') + self.encode(str(key)) + b':'
+                yield from self._iter_encode(value, depth - 1)
+            yield b'}'
+        elif depth and isinstance(data, (list, tuple)):
+            yield b'['
+            for index, item in enumerate(data):
+                if index:
+                    yield b','
+                yield from self._iter_encode(item, depth - 1)
+            yield b']'
+        else:
+            yield self.encode(data)
+
+    def _default(self, obj):
+        # Whatever orjson can't encode natively goes through DRF's encoder
+        return self.encoder_class().default(obj)
+
+
+class StreamingJSONMixin:
+    """
+    View mixin that encodes large JSON responses a chunk at a time as they
+    are sent, instead of all at once before the first byte goes out.
+
+    Successful responses rendered by FastJSONRenderer whose data holds at
+    least STREAMING_JSON_MIN_ITEMS dicts and lists (0 disables streaming)
+    are sent as a StreamingHttpResponse fed by iter_render().
+
+    Only the encoding is streamed: the view has built `response.data` in
+    full by then, and it is kept until the last chunk is sent, so this
+    doesn't lower the peak memory of a request by much.
+    """
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        renderer = getattr(response, 'accepted_renderer', None)
+        if (
+            not isinstance(response, Response)
+            or not isinstance(renderer, FastJSONRenderer)
+            or response.status_code != 200
+            or renderer.get_indent(response.accepted_media_type, response.renderer_context) is not None
+            or not _has_items(response.data, getattr(settings, 'STREAMING_JSON_MIN_ITEMS', 2000))
+        ):
+            return response
+
+        streaming = StreamingHttpResponse(
+            renderer.iter_render(response.data), status=response.status_code, content_type=renderer.media_type
+        )
+        for header, value in response.items():
+            if header.lower() != 'content-type':
+                streaming[header] = value
+        return streaming
+
+
+def json_response(data, status=200, headers=None):
+    """
+    A response with the JSON FastJSONRenderer makes of `data`, for the async
+    views in feed.async_views. Large data is streamed as StreamingJSONMixin
+    does, from an async iterator.
+    """
+    renderer = FastJSONRenderer()
+    if status == 200 and _has_items(data, getattr(settings, 'STREAMING_JSON_MIN_ITEMS', 2000)):
+        async def chunks():
+            for chunk in renderer.iter_render(data):
+                yield chunk
+
+        return StreamingHttpResponse(chunks(), status=status, content_type=renderer.media_type, headers=headers)
+    return HttpResponse(renderer.encode(data), status=status, content_type=renderer.media_type, headers=headers)
+
+
+def _has_items(data, minimum):
+    """Whether `data` holds at least `minimum` dicts and lists, stopping as soon as it does."""
+    if not minimum:
+        return False
+    remaining = minimum
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+        else:
+            continue
+        remaining -= 1
+        if not remaining:
+            return True
+    return False
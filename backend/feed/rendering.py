@@ -0,0 +1,214 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+from .comment_nodes import DEFAULT_COMMENT_SORT, NODE_FIELDS, CommentTree
+from .comment_tree import top_comments
+from .counters import like_count_of, overlaid_comment_like_counts, overlay_comment_like_counts
+from .models import Post, Comment
+from .versions import comment_tree_version
+
+
+USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name')
+AUTHOR_FIELDS = tuple(f'author__{name}' for name in USER_FIELDS)
+POST_FIELDS = (
+    'id', 'content', 'created_at', 'updated_at', 'like_count', 'like_shards', 'comment_count', 'hot_score',
+    'total_likes'
+)
+COMMENT_FIELDS = (
+    'id', 'post_id', 'parent_id', 'content', 'created_at', 'updated_at',
+    'like_count', 'like_shards', 'reply_count', 'depth'
+)
+COMMENT_TREE_FIELDS = NODE_FIELDS + AUTHOR_FIELDS
+
+COMMENT_TREE_CACHE_KEY = 'comment_tree:nodes'
+
+# Formats datetimes exactly like the serializers do (REST_FRAMEWORK DATETIME_FORMAT, current timezone)
+_datetime = serializers.DateTimeField()
+
+
+def post_rows(queryset):
+    """The columns render_posts needs, as plain rows of a Post queryset."""
+    return queryset.values(*POST_FIELDS, *AUTHOR_FIELDS)
+
+
+def comment_rows(queryset):
+    """The columns render_comments needs, as plain rows of a Comment queryset."""
+    return queryset.values(*COMMENT_FIELDS, *AUTHOR_FIELDS)
+
+
+def load_comment_trees(post_ids):
+    """
+    The comments of every post in `post_ids` as a CommentTree per post, as
+    {post_id: tree}, read in a single query with their current like counts.
+    """
+    rows_by_post = {pk: [] for pk in post_ids}
+    if rows_by_post:
+        comments = Comment.objects.filter(post_id__in=rows_by_post.keys())
+        for row in comments.values_list('post_id', *COMMENT_TREE_FIELDS):
+            rows_by_post[row[0]].append(row[1:])
+
+    trees = {}
+    for pk, rows in rows_by_post.items():
+        tree = trees[pk] = CommentTree(pk, rows)
+        tree.set_like_counts({
+            node.id: like_count_of(Comment, node.id, node.like_count, node.like_shards)
+            for node in tree.nodes.values()
+        })
+    return trees
+
+
+def attach_comment_trees(posts):
+    """
+    Load the comment trees for a whole page of Post instances in a single query.
+
+    Each post gets `comment_tree`, its CommentTree, and `comment_total`, the
+    number of comments on it, which PostSerializer picks up instead of
+    querying per post.
+    """
+    posts = list(posts)
+    trees = load_comment_trees([post.pk for post in posts])
+    for post in posts:
+        post.comment_tree = trees[post.pk]
+        post.comment_total = len(post.comment_tree)
+    return posts
+
+
+def render_posts(rows, comment_limit=None):
+    """
+    Build PostSerializer's output for post rows from post_rows, without serializers.
+
+    Comments are read as plain rows too: the whole tree of every post in one
+    query when `comment_limit` is None, or the `comment_limit` newest top-level
+    comments per post as in attach_comment_previews (none for 0). The output
+    is the same JSON as the serializers produce.
+    """
+    rows = list(rows)
+    post_ids = [row['id'] for row in rows]
+
+    if comment_limit is None:
+        trees = load_comment_trees(post_ids)
+    else:
+        comments_by_post = {pk: [] for pk in post_ids}
+        if comment_limit > 0 and post_ids:
+            for row in comment_rows(top_comments(post_ids, comment_limit)):
+                comments_by_post[row['post_id']].append(row)
+
+    posts = []
+    for row in rows:
+        if comment_limit is None:
+            tree = trees[row['id']]
+            comments, comment_count = render_comment_tree(tree), len(tree)
+        else:
+            # Previews leave out replies, as in attach_comment_previews
+            comments, comment_count = render_comments(comments_by_post[row['id']]), row['comment_count']
+        posts.append({
+            'id': row['id'],
+            'author': _author(row),
+            'content': row['content'],
+            'created_at': _datetime.to_representation(row['created_at']),
+            'updated_at': _datetime.to_representation(row['updated_at']),
+            'like_count': like_count_of(Post, row['id'], row['like_count'], row['like_shards']),
+            'comments': comments,
+            'comment_count': comment_count,
+        })
+    return posts
+
+
+def render_thread(rows):
+    """
+    Build PostSerializer's output for one post row from post_rows, with its
+    full comment tree from cached_comment_tree. Returns None if there is no row.
+    """
+    posts = render_posts(rows, comment_limit=0)
+    if not posts:
+        return None
+    post = posts[0]
+    post['comments'], post['comment_count'] = cached_comment_tree(post['id'])
+    return post
+
+
+def cached_comment_tree(post_id, sort=DEFAULT_COMMENT_SORT, depth=None):
+    """
+    The rendered comment tree of a post and its number of comments, from a
+    CommentTree cached per post and comment_tree_version. `sort` and `depth`
+    are as for render_comment_tree.
+
+    Creating, editing or deleting a comment moves the version on, while
+    likes only refresh the like counts patched in from the overlay. A hot
+    thread is therefore served without reading its comments at all. With a
+    per-process cache each worker caches its own trees, the stamps that
+    retire them coming from the database (see feed.versions).
+    """
+    key = f'{COMMENT_TREE_CACHE_KEY}:{post_id}:{comment_tree_version(post_id)}'
+    tree = cache.get(key)
+    if tree is None:
+        tree = load_comment_trees([post_id])[post_id]
+        cache.set(key, tree, getattr(settings, 'COMMENT_TREE_CACHE_TTL', 60 * 60))
+        overlay_comment_like_counts(post_id, {node.id: node.like_count for node in tree.nodes.values()})
+    else:
+        tree.set_like_counts(overlaid_comment_like_counts(post_id))
+    return render_comment_tree(tree, sort=sort, depth=depth), len(tree)
+
+
+def render_comment_tree(tree, nodes=None, sort=DEFAULT_COMMENT_SORT, depth=None):
+    """
+    Build CommentSerializer's output for a CommentTree: the top-level
+    comments, or `nodes` (e.g. a slice of them or a subtree's replies), each
+    with its replies nested below it.
+
+    Siblings come in the order of COMMENT_SORTS[sort]. With a `depth`, only
+    that many levels are rendered and deeper comments are left out, their
+    parents' reply_count still telling that they are there.
+    """
+    tree.sort_by(sort)
+    comments = []
+    rendered = {}
+    for node, parent in tree.walk(nodes, depth):
+        comment = rendered[node.id] = _comment_node(tree.post_id, node)
+        if parent is None:
+            comments.append(comment)
+        else:
+            rendered[parent.id]['replies'].append(comment)
+    return comments
+
+
+def render_comments(rows):
+    """Build CommentSerializer's output for comment rows from comment_rows, as a flat list without replies."""
+    return [_comment(row) for row in rows]
+
+
+def _comment(row):
+    return {
+        'id': row['id'],
+        'author': _author(row),
+        'post': row['post_id'],
+        'parent': row['parent_id'],
+        'content': row['content'],
+        'created_at': _datetime.to_representation(row['created_at']),
+        'updated_at': _datetime.to_representation(row['updated_at']),
+        'like_count': like_count_of(Comment, row['id'], row['like_count'], row['like_shards']),
+        'reply_count': row['reply_count'],
+        'depth': row['depth'],
+        'replies': [],
+    }
+
+
+def _comment_node(post_id, node):
+    return {
+        'id': node.id,
+        'author': dict(zip(USER_FIELDS, node.author)),
+        'post': post_id,
+        'parent': node.parent_id,
+        'content': node.content,
+        'created_at': _datetime.to_representation(node.created_at),
+        'updated_at': _datetime.to_representation(node.updated_at),
+        'like_count': node.like_count,
+        'reply_count': node.reply_count,
+        'depth': node.depth,
+        'replies': [],
+    }
+
+
+def _author(row):
+    return {name: row[f'author__{name}'] for name in USER_FIELDS}
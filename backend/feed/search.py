@@ -0,0 +1,174 @@
+import re
+
+from django.db import OperationalError, connection
+
+from .models import Post, Comment
+
+
+# Full-text search over Post.content and Comment.content.
+#
+# On PostgreSQL each table has a GIN index on to_tsvector(SEARCH_CONFIG,
+# content), which Postgres keeps up to date as rows are written. On SQLite
+# each table has an external-content FTS5 table kept in step by triggers.
+# Either way an insert, edit or delete updates the index in the same
+# transaction, and a search reads only the index. Other databases, or a
+# SQLite built without FTS5, fall back to scanning with icontains.
+
+SEARCH_CONFIG = 'english'
+SEARCH_MODELS = (Post, Comment)
+
+_fts5_tables = {}
+
+
+def install_search_index(connection):
+    """
+    Create the search indexes for SEARCH_MODELS if they are missing.
+
+    Run by migration 0006 and again after every migrate: rebuilding a table,
+    as SQLite migrations do to alter one, drops its triggers, so any that
+    went missing are put back and the FTS5 table is rebuilt from the rows.
+    """
+    tables = connection.introspection.table_names()
+    with connection.cursor() as cursor:
+        for model in SEARCH_MODELS:
+            table = model._meta.db_table
+            if table not in tables:
+                # Not migrated this far
+                continue
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_content_search "
+                    f"ON {table} USING gin (to_tsvector('{SEARCH_CONFIG}', content))"
+                )
+            elif connection.vendor == 'sqlite':
+                try:
+                    cursor.execute(
+                        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5("
+                        f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+                    )
+                except OperationalError:
+                    # No FTS5 in this SQLite build, searches scan instead
+                    return
+                cursor.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                    [f'{table}_fts_%']
+                )
+                if cursor.fetchone()[0] == 3:
+                    continue
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+                    f"INSERT INTO {table}_fts(rowid, content) VALUES (new.id, new.content); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+                    f"INSERT INTO {table}_fts({table}_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+                )
+                cursor.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF content ON {table} BEGIN "
+                    f"INSERT INTO {table}_fts({table}_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+                    f"INSERT INTO {table}_fts(rowid, content) VALUES (new.id, new.content); END"
+                )
+                cursor.execute(f"INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')")
+    _fts5_tables.clear()
+
+
+def drop_search_index(connection):
+    with connection.cursor() as cursor:
+        for model in SEARCH_MODELS:
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute(f'DROP INDEX IF EXISTS {table}_content_search')
+            elif connection.vendor == 'sqlite':
+                for trigger in ('insert', 'delete', 'update'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{trigger}')
+                cursor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+    _fts5_tables.clear()
+
+
+def search_index_installed(sender, using, **kwargs):
+    """post_migrate receiver putting back search indexes a migration dropped."""
+    from django.db import connections
+    from django.db.migrations.loader import MigrationLoader
+
+    loader = MigrationLoader(connections[using])
+    if 'feed' in loader.migrated_apps and ('feed', '0006_search_index') not in loader.applied_migrations:
+        # Migrated back past the index
+        return
+    install_search_index(connections[using])
+
+
+class SearchResults:
+    """
+    The ids of the `model` rows whose content matches `query`, best matches
+    first (newest first when scanning).
+
+    Only the count and the slices asked for are read, so a Paginator can
+    page through it like a queryset.
+    """
+
+    def __init__(self, model, query):
+        self.model = model
+        self.table = model._meta.db_table
+        # Words only: user input never reaches the query syntax of either index
+        self.terms = re.findall(r'\w+', query)
+
+    def count(self):
+        if not self.terms:
+            return 0
+        if connection.vendor == 'postgresql':
+            return self._fetch(
+                f'SELECT COUNT(*) FROM {self.table} '
+                f"WHERE to_tsvector('{SEARCH_CONFIG}', content) @@ plainto_tsquery('{SEARCH_CONFIG}', %s)",
+                [' '.join(self.terms)]
+            )[0]
+        if self._fts5():
+            return self._fetch(
+                f'SELECT COUNT(*) FROM {self.table}_fts WHERE {self.table}_fts MATCH %s', [self._match()]
+            )[0]
+        return self._scan().count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('SearchResults only supports slicing.')
+        offset = index.start or 0
+        limit = index.stop - offset
+        if not self.terms or limit <= 0:
+            return []
+        if connection.vendor == 'postgresql':
+            return self._fetch(
+                f'SELECT id FROM {self.table} '
+                f"WHERE to_tsvector('{SEARCH_CONFIG}', content) @@ plainto_tsquery('{SEARCH_CONFIG}', %s) "
+                f"ORDER BY ts_rank(to_tsvector('{SEARCH_CONFIG}', content), plainto_tsquery('{SEARCH_CONFIG}', %s)) DESC, "
+                f'id DESC LIMIT %s OFFSET %s',
+                [' '.join(self.terms)] * 2 + [limit, offset]
+            )
+        if self._fts5():
+            # rank is bm25(), lower is better
+            return self._fetch(
+                f'SELECT rowid FROM {self.table}_fts WHERE {self.table}_fts MATCH %s '
+                f'ORDER BY rank, rowid DESC LIMIT %s OFFSET %s',
+                [self._match(), limit, offset]
+            )
+        return list(self._scan().values_list('pk', flat=True)[offset:offset + limit])
+
+    def _match(self):
+        # Every word, quoted so it is taken literally
+        return ' '.join(f'"{term}"' for term in self.terms)
+
+    def _scan(self):
+        queryset = self.model.objects.all()
+        for term in self.terms:
+            queryset = queryset.filter(content__icontains=term)
+        return queryset.order_by('-created_at', '-id')
+
+    def _fts5(self):
+        if connection.vendor != 'sqlite':
+            return False
+        if self.table not in _fts5_tables:
+            _fts5_tables[self.table] = f'{self.table}_fts' in connection.introspection.table_names()
+        return _fts5_tables[self.table]
+
+    def _fetch(self, sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
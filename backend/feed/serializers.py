@@ -2,6 +2,11 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Post, Comment, Like
 from django.db.models import Prefetch
+from .comment_nodes import CommentTree
+from .counters import current_like_count
+from .likes import LIKE_BATCH_MAX_SIZE
+from .rendering import load_comment_trees, render_comment_tree
+from .users import with_user_id
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -19,21 +24,29 @@ class CommentSerializer(serializers.ModelSerializer):
     Handles the comment tree structure efficiently.
     """
     author = UserSerializer(read_only=True)
+    like_count = serializers.SerializerMethodField()
     replies = serializers.SerializerMethodField()
     
     class Meta:
         model = Comment
         fields = ['id', 'author', 'post', 'parent', 'content', 'created_at', 
-                  'updated_at', 'like_count', 'depth', 'replies']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'like_count', 'depth']
+                  'updated_at', 'like_count', 'reply_count', 'depth', 'replies']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'like_count', 'reply_count', 'depth']
+    
+    def get_like_count(self, obj):
+        """Stored like_count plus any change still buffered by write-behind."""
+        return current_like_count(obj)
     
     def get_replies(self, obj):
         """
         Get nested replies efficiently using prefetched data.
-        This avoids N+1 queries by using the prefetched 'replies' relation.
+        This avoids N+1 queries by using the replies linked by load_subtree,
+        or the prefetched 'replies' relation.
         """
-        # Check if replies were prefetched
-        if hasattr(obj, '_prefetched_objects_cache') and 'replies' in obj._prefetched_objects_cache:
+        if hasattr(obj, 'tree_replies'):
+            # Replies were linked in memory, no queries needed at any depth
+            replies = obj.tree_replies
+        elif hasattr(obj, '_prefetched_objects_cache') and 'replies' in obj._prefetched_objects_cache:
             replies = obj.replies.all()
         else:
             # Fallback to direct query (will cause N+1 if not careful)
@@ -42,10 +55,27 @@ class CommentSerializer(serializers.ModelSerializer):
             )
         
         if replies:
-            return CommentSerializer(replies, many=True, context=self.context).data
+            return type(self)(replies, many=True, context=self.context).data
         return []
 
 
+class SubtreeCommentSerializer(CommentSerializer):
+    """
+    Comment serializer for the subtree endpoint.
+    `more_replies` links to the next page of a comment's replies, if any weren't loaded.
+    """
+    more_replies = serializers.SerializerMethodField()
+    
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['more_replies']
+    
+    def get_more_replies(self, obj):
+        more_replies = self.context.get('more_replies')
+        if more_replies is None or not getattr(obj, 'more_replies', False):
+            return None
+        return more_replies(obj)
+
+
 class CommentCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating comments."""
     username = serializers.CharField(write_only=True, required=False)
@@ -61,17 +91,14 @@ class CommentCreateSerializer(serializers.ModelSerializer):
             import random
             username = f"User{random.randint(1, 9999)}"
         
-        user, _ = User.objects.get_or_create(
-            username=username,
-            defaults={'email': f'{username}@example.com'}
-        )
-        validated_data['author'] = user
-        return super().create(validated_data)
+        create = super().create
+        return with_user_id(username, lambda author_id: create({**validated_data, 'author_id': author_id}))
 
 
 class PostSerializer(serializers.ModelSerializer):
     """Serializer for Post model with nested comments."""
     author = UserSerializer(read_only=True)
+    like_count = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
     comment_count = serializers.SerializerMethodField()
     
@@ -81,36 +108,32 @@ class PostSerializer(serializers.ModelSerializer):
                   'like_count', 'comments', 'comment_count']
         read_only_fields = ['id', 'created_at', 'updated_at', 'like_count']
     
+    def get_like_count(self, obj):
+        """Stored like_count plus any change still buffered by write-behind."""
+        return current_like_count(obj)
+    
     def get_comments(self, obj):
         """
         Get all top-level comments with their nested replies.
-        Uses efficient prefetching to avoid N+1 queries.
-        This loads the entire comment tree in a minimal number of queries.
+        The whole tree is fetched in one query as plain rows and linked into
+        a CommentTree, so the number of queries doesn't grow with depth and
+        no Comment instances are built for it.
         """
-        # Get only top-level comments (no parent)
-        # Recursively prefetch all nested replies to avoid N+1 problem
-        top_level_comments = obj.comments.filter(parent__isnull=True).select_related('author').prefetch_related(
-            Prefetch(
-                'replies',
-                queryset=Comment.objects.select_related('author').prefetch_related(
-                    Prefetch(
-                        'replies',
-                        queryset=Comment.objects.select_related('author').prefetch_related(
-                            Prefetch(
-                                'replies',
-                                queryset=Comment.objects.select_related('author').all()
-                            )
-                        )
-                    )
-                )
-            )
-        )
-        
-        return CommentSerializer(top_level_comments, many=True, context=self.context).data
+        comment_tree = getattr(obj, 'comment_tree', None)
+        if comment_tree is None:
+            comment_tree = load_comment_trees([obj.pk])[obj.pk]
+        if isinstance(comment_tree, CommentTree):
+            return render_comment_tree(comment_tree)
+        # Previews from attach_comment_previews
+        return CommentSerializer(comment_tree, many=True, context=self.context).data
     
     def get_comment_count(self, obj):
         """Get total count of all comments on this post."""
-        return obj.comments.count()
+        # Already worked out by attach_comment_trees for feed pages
+        if hasattr(obj, 'comment_total'):
+            return obj.comment_total
+        # Otherwise use the denormalized counter instead of a COUNT query
+        return obj.comment_count
 
 
 class PostCreateSerializer(serializers.ModelSerializer):
@@ -128,12 +151,8 @@ class PostCreateSerializer(serializers.ModelSerializer):
             import random
             username = f"User{random.randint(1, 9999)}"
         
-        user, _ = User.objects.get_or_create(
-            username=username,
-            defaults={'email': f'{username}@example.com'}
-        )
-        validated_data['author'] = user
-        return super().create(validated_data)
+        create = super().create
+        return with_user_id(username, lambda author_id: create({**validated_data, 'author_id': author_id}))
 
 
 class LikeSerializer(serializers.ModelSerializer):
@@ -158,10 +177,36 @@ class LikeSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class LikeOperationSerializer(serializers.Serializer):
+    """Serializer for one queued like/unlike in a batch."""
+    username = serializers.CharField(max_length=150)
+    action = serializers.ChoiceField(choices=['like', 'unlike'], default='like')
+    post = serializers.IntegerField(required=False)
+    comment = serializers.IntegerField(required=False)
+    
+    def validate(self, data):
+        """Ensure that an operation targets either a post or a comment, not both."""
+        if data.get('post') is not None and data.get('comment') is not None:
+            raise serializers.ValidationError("A like can be for either a post or a comment, not both.")
+        if data.get('post') is None and data.get('comment') is None:
+            raise serializers.ValidationError("A like must be for either a post or a comment.")
+        return data
+
+
+class LikeBatchSerializer(serializers.Serializer):
+    """Serializer for a batch of like/unlike operations."""
+    operations = LikeOperationSerializer(many=True, allow_empty=False)
+    
+    def validate_operations(self, value):
+        if len(value) > LIKE_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(f"A batch can hold at most {LIKE_BATCH_MAX_SIZE} operations.")
+        return value
+
+
 class LeaderboardSerializer(serializers.Serializer):
     """Serializer for leaderboard data."""
     user_id = serializers.IntegerField()
     username = serializers.CharField()
     karma = serializers.IntegerField()
-    post_likes = serializers.IntegerField()  # Likes received on posts in last 24h
-    comment_likes = serializers.IntegerField()  # Likes received on comments in last 24h
+    post_likes = serializers.IntegerField()  # Likes received on posts in the window
+    comment_likes = serializers.IntegerField()  # Likes received on comments in the window
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent by Like when the karma it earns its target's author is recorded or
+# moved to another time, with `recipient_id` and `points`. feed.karma listens
+# to keep the cached leaderboards current.
+karma_adjusted = Signal()
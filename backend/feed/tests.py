@@ -1,11 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
 from django.utils import timezone
 from datetime import timedelta
 from .models import Post, Comment, Like
 from django.db.models import Q, Count, F
-from django.db import connection
+from django.db import connection, transaction
 from django.test.utils import override_settings
+from django.core.cache import cache
+import asyncio
 
 
 class LeaderboardTestCase(TestCase):
@@ -26,6 +28,9 @@ class LeaderboardTestCase(TestCase):
         self.post1 = Post.objects.create(author=self.user1, content='Post by user1')
         self.post2 = Post.objects.create(author=self.user2, content='Post by user2')
         
+        # Start every test from an empty leaderboard cache
+        cache.clear()
+        
         # Create comments
         self.comment1 = Comment.objects.create(
             post=self.post1,
@@ -99,6 +104,190 @@ class LeaderboardTestCase(TestCase):
         usernames = [u.username for u in leaderboard]
         self.assertNotIn('user2', usernames, "user2 should not appear (old like doesn't count)")
     
+    def test_ledger_leaderboard_matches_like_graph(self):
+        """
+        Test that the KarmaEvent ledger ranks users exactly like the like-graph
+        query, including backdated likes and likes that get removed.
+        """
+        from .karma import top_users
+        
+        Like.objects.create(user=self.liker, post=self.post1)
+        Like.objects.create(user=self.liker, comment=self.comment1)
+        Like.objects.create(user=self.liker, comment=self.comment2)
+        removed = Like.objects.create(user=self.liker, post=self.post2)
+        old_like = Like.objects.create(user=self.user3, post=self.post2)
+        old_like.created_at = timezone.now() - timedelta(hours=25)
+        old_like.save(update_fields=['created_at'])
+        
+        # Removing a like takes its karma away again
+        removed.delete()
+        
+        leaderboard = top_users()
+        self.assertEqual(
+            [(row['username'], row['karma'], row['post_likes'], row['comment_likes']) for row in leaderboard],
+            [('user1', 6, 1, 1), ('user2', 1, 0, 1)]
+        )
+        
+        response = self.client.get('/api/leaderboard/top_users/', secure=True)
+        self.assertEqual(response.data, leaderboard)
+    
+    def test_deletes_take_cascaded_karma_away(self):
+        """
+        Test that deleting a post, a comment or a liker takes the karma of the
+        likes cascaded away with them out of the buckets too.
+        """
+        from .karma import rank_windows
+        from .models import KarmaBucket
+        
+        Like.objects.create(user=self.liker, post=self.post1)
+        Like.objects.create(user=self.user3, post=self.post1)
+        Like.objects.create(user=self.liker, comment=self.comment1)
+        Like.objects.create(user=self.liker, comment=self.comment2)
+        Like.objects.create(user=self.user3, post=self.post2)
+        
+        def boards():
+            since = timezone.now() - timedelta(days=7)
+            return [(row['username'], row['karma']) for row in rank_windows({'7d': since})['7d']]
+        
+        self.assertEqual(boards(), [('user1', 11), ('user2', 6)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post1.delete()
+        self.assertEqual(boards(), [('user2', 5)])
+        self.assertEqual(KarmaBucket.objects.get(user=self.user1).karma, 0)
+        
+        Like.objects.create(user=self.liker, post=self.post2)
+        self.liker.delete()
+        self.assertEqual(boards(), [('user2', 5)])
+        self.user3.delete()
+        self.assertEqual(boards(), [])
+    
+    def test_likes_prune_expired_buckets(self):
+        """
+        Test that karma changes delete buckets past retention, at most once per interval.
+        """
+        from .karma import KARMA_BUCKET_RETENTION
+        from .models import KarmaBucket
+        
+        def expire():
+            KarmaBucket.objects.create(
+                user=self.user3, bucket_start=KarmaBucket.floor(timezone.now() - KARMA_BUCKET_RETENTION * 2), karma=5
+            )
+        
+        expire()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.post1.pk}/like/', {'username': 'fan'}, secure=True)
+        self.assertEqual(list(KarmaBucket.objects.values_list('user__username', flat=True)), ['user1'])
+        
+        expire()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.post2.pk}/like/', {'username': 'fan'}, secure=True)
+        self.assertEqual(KarmaBucket.objects.filter(user=self.user3).count(), 1)
+    
+    def test_bucketed_window_scans_edge_bucket_exactly(self):
+        """
+        Test that likes sharing the window's edge bucket are split exactly at
+        the 24h cutoff, and that pruning keeps buckets still inside the window.
+        """
+        from .karma import top_users, prune_buckets
+        
+        since = timezone.now() - timedelta(hours=24)
+        inside = Like.objects.create(user=self.liker, post=self.post1)
+        inside.created_at = since + timedelta(seconds=1)
+        inside.save(update_fields=['created_at'])
+        outside = Like.objects.create(user=self.liker, post=self.post2)
+        outside.created_at = since - timedelta(seconds=1)
+        outside.save(update_fields=['created_at'])
+        Like.objects.create(user=self.liker, comment=self.comment2)
+        
+        prune_buckets()
+        
+        leaderboard = top_users(since=since)
+        self.assertEqual(
+            [(row['username'], row['karma']) for row in leaderboard],
+            [('user1', 5), ('user2', 1)]
+        )
+    
+    def test_cached_leaderboard_invalidated_by_likes(self):
+        """
+        Test that the leaderboard is served from the cache and invalidated when
+        a like lands, but not when karma drops for a user who isn't on it.
+        """
+        from .karma import karma_changed
+        
+        Like.objects.create(user=self.liker, post=self.post1)
+        Like.objects.create(user=self.liker, comment=self.comment2)
+        
+        response = self.client.get('/api/leaderboard/top_users/', secure=True)
+        self.assertEqual([row['karma'] for row in response.data], [5, 1])
+        
+        # Cached: a second read only looks up the version stamp
+        with self.assertNumQueries(1):
+            self.client.get('/api/leaderboard/top_users/', secure=True)
+        
+        # Losing karma doesn't touch the board for a user who isn't on it
+        with self.captureOnCommitCallbacks(execute=True):
+            karma_changed(self.user3.pk, -5)
+        with self.assertNumQueries(1):
+            self.client.get('/api/leaderboard/top_users/', secure=True)
+        
+        # A new like invalidates the cached board once it commits
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.liker, comment=self.comment1)
+        response = self.client.get('/api/leaderboard/top_users/', secure=True)
+        self.assertEqual([row['karma'] for row in response.data], [6, 1])
+    
+    def test_low_scorer_keeps_cached_board(self):
+        """
+        Test that a like for a user who stays below every full board keeps it
+        cached, and one that lifts a user onto a board invalidates it.
+        """
+        from .karma import LEADERBOARD_MAX_SIZE
+        from .models import KarmaBucket
+        
+        now = KarmaBucket.floor(timezone.now())
+        regulars = User.objects.bulk_create(User(username=f'regular{i}') for i in range(LEADERBOARD_MAX_SIZE))
+        KarmaBucket.objects.bulk_create(
+            KarmaBucket(user=user, bucket_start=now, karma=10, post_likes=2) for user in regulars
+        )
+        self.client.get('/api/leaderboard/top_users/', secure=True)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/comments/{self.comment1.pk}/like/', {'username': 'fan'}, secure=True)
+        with self.assertNumQueries(1):
+            self.client.get('/api/leaderboard/top_users/', secure=True)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                self.client.post(f'/api/posts/{self.post1.pk}/like/', {'username': f'fan{i}'}, secure=True)
+        response = self.client.get('/api/leaderboard/top_users/', secure=True)
+        self.assertEqual((response.data[0]['username'], response.data[0]['karma']), ('user1', 16))
+    
+    def test_leaderboard_windows_and_limits(self):
+        """
+        Test that the 1h/24h/7d boards and limits all come from one ranking pass.
+        """
+        Like.objects.create(user=self.liker, post=self.post1)
+        day_old = Like.objects.create(user=self.liker, post=self.post2)
+        day_old.created_at = timezone.now() - timedelta(hours=3)
+        day_old.save(update_fields=['created_at'])
+        week_old = Like.objects.create(user=self.user3, post=self.post2)
+        week_old.created_at = timezone.now() - timedelta(days=3)
+        week_old.save(update_fields=['created_at'])
+        Like.objects.create(user=self.liker, comment=self.comment2)
+        
+        def board(query):
+            response = self.client.get(f'/api/leaderboard/top_users/{query}', secure=True)
+            return [(row['username'], row['karma']) for row in response.data]
+        
+        self.assertEqual(board('?window=1h'), [('user1', 5), ('user2', 1)])
+        # Every window was ranked and cached by the first request (one version stamp lookup each)
+        with self.assertNumQueries(2):
+            self.assertEqual(board('?window=24h'), [('user2', 6), ('user1', 5)])
+            self.assertEqual(board('?window=7d&limit=1'), [('user2', 11)])
+        
+        self.assertEqual(self.client.get('/api/leaderboard/top_users/?window=1y', secure=True).status_code, 400)
+        self.assertEqual(self.client.get('/api/leaderboard/top_users/?limit=0', secure=True).status_code, 400)
+    
     def test_no_double_like_on_post(self):
         """
         Test that a user cannot double-like a post (race condition prevention).
@@ -109,7 +298,8 @@ class LeaderboardTestCase(TestCase):
         
         # Second like should fail due to unique constraint
         with self.assertRaises(Exception):
-            Like.objects.create(user=self.liker, post=self.post1)
+            with transaction.atomic():
+                Like.objects.create(user=self.liker, post=self.post1)
         
         # Verify only one like exists
         like_count = Like.objects.filter(user=self.liker, post=self.post1).count()
@@ -125,12 +315,117 @@ class LeaderboardTestCase(TestCase):
         
         # Second like should fail due to unique constraint
         with self.assertRaises(Exception):
-            Like.objects.create(user=self.liker, comment=self.comment1)
+            with transaction.atomic():
+                Like.objects.create(user=self.liker, comment=self.comment1)
         
         # Verify only one like exists
         like_count = Like.objects.filter(user=self.liker, comment=self.comment1).count()
         self.assertEqual(like_count, 1)
     
+    def test_like_endpoints_reject_double_likes(self):
+        """
+        Test that the single-statement like/unlike path keeps the double-like
+        guarantees and keeps counters and karma in step.
+        """
+        url = f'/api/posts/{self.post1.pk}'
+        
+        with self.assertNumQueries(7):
+            response = self.client.post(f'{url}/like/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['like_count'], 1)
+        
+        response = self.client.post(f'{url}/like/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Like.objects.filter(user=self.liker, post=self.post1).count(), 1)
+        self.assertEqual(self.user1.karma_events.get().points, 5)
+        
+        response = self.client.post(f'/api/comments/{self.comment1.pk}/like/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.data['like_count'], 1)
+        self.assertEqual(self.user1.karma_buckets.get().karma, 6)
+        
+        response = self.client.post(f'{url}/unlike/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['like_count'], 0)
+        self.assertFalse(Like.objects.filter(post=self.post1).exists())
+        self.assertEqual(self.user1.karma_events.get().points, 1)
+        self.assertEqual(self.user1.karma_buckets.get().karma, 1)
+        
+        response = self.client.post(f'{url}/unlike/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.client.post('/api/posts/999999/like/', {'username': 'liker'}, secure=True)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Like.objects.filter(post_id=999999).exists())
+        for url in ('/api/posts/999999/unlike/', '/api/comments/999999/unlike/'):
+            self.assertEqual(self.client.post(url, {'username': 'liker'}, secure=True).status_code, 404)
+    
+    def test_like_batch_applies_operations_in_bulk(self):
+        """
+        Test that a burst of queued likes is applied in one request with
+        per-item results and counters and karma kept in step.
+        """
+        Like.objects.create(user=self.liker, post=self.post2)
+        operations = [
+            {'username': 'liker', 'post': self.post1.pk},
+            {'username': 'newcomer', 'post': self.post1.pk},
+            {'username': 'liker', 'comment': self.comment1.pk},
+            {'username': 'liker', 'post': self.post2.pk},
+            {'username': 'liker', 'action': 'unlike', 'post': self.post2.pk},
+            {'username': 'user3', 'action': 'unlike', 'post': self.post1.pk},
+            {'username': 'liker', 'post': 999999},
+            {'username': 'user3', 'comment': self.comment2.pk},
+            {'username': 'user3', 'action': 'unlike', 'comment': self.comment2.pk},
+        ]
+        
+        response = self.client.post(
+            '/api/likes/batch/', {'operations': operations}, content_type='application/json', secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'status': 'liked', 'like_count': 2},
+            {'status': 'liked', 'like_count': 2},
+            {'status': 'liked', 'like_count': 1},
+            {'status': 'superseded'},
+            {'status': 'unliked', 'like_count': 0},
+            {'status': 'not_liked'},
+            {'status': 'not_found'},
+            {'status': 'superseded'},
+            {'status': 'not_liked'},
+        ])
+        
+        self.assertTrue(User.objects.filter(username='newcomer').exists())
+        self.assertEqual(Like.objects.count(), 3)
+        self.assertEqual(self.user1.karma_buckets.get().karma, 11)
+        self.assertEqual(self.user2.karma_buckets.get().karma, 0)
+        self.assertEqual(self.user1.karma_events.count(), 3)
+        
+        # Replaying the same burst changes nothing
+        response = self.client.post(
+            '/api/likes/batch/', {'operations': operations[:3]}, content_type='application/json', secure=True
+        )
+        self.assertEqual([r['status'] for r in response.data['results']], ['already_liked'] * 3)
+    
+    def test_like_batch_of_max_size(self):
+        """
+        Test that a full batch of likes, then of unlikes, goes through (the
+        unlikes used to overflow SQLite's expression depth in one statement).
+        """
+        from .likes import LIKE_BATCH_MAX_SIZE
+        
+        for action in ('like', 'unlike'):
+            operations = [
+                {'username': f'fan{i}', 'action': action, 'post': self.post1.pk} for i in range(LIKE_BATCH_MAX_SIZE)
+            ]
+            response = self.client.post(
+                '/api/likes/batch/', {'operations': operations}, content_type='application/json', secure=True
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual({r['status'] for r in response.data['results']}, {f'{action}d'})
+        
+        self.assertFalse(Like.objects.filter(post=self.post1).exists())
+        self.assertEqual(Post.objects.get(pk=self.post1.pk).like_count, 0)
+        self.assertEqual(self.user1.karma_buckets.get().karma, 0)
+    
     def test_comment_tree_structure(self):
         """
         Test that nested comments are properly structured with tree_path.
@@ -167,6 +462,7 @@ class NPlusOnePreventionTestCase(TestCase):
     
     def setUp(self):
         """Create test data with nested comments."""
+        cache.clear()
         self.user = User.objects.create_user(username='testuser', password='testpass123')
         self.post = Post.objects.create(author=self.user, content='Test post with many comments')
         
@@ -243,3 +539,1368 @@ class NPlusOnePreventionTestCase(TestCase):
         self.assertEqual(len(data['comments']), 10, "Should have 10 top-level comments")
         self.assertEqual(len(data['comments'][0]['replies']), 3, "Should have 3 replies")
         self.assertEqual(len(data['comments'][0]['replies'][0]['replies']), 2, "Should have 2 nested replies")
+    
+    def test_deep_thread_loads_in_constant_queries(self):
+        """
+        Test that a thread deeper than any fixed prefetch chain is still
+        serialized from a single comment query.
+        """
+        from .serializers import PostSerializer
+        
+        # Build a 10-level deep chain under the first top-level comment
+        parent = self.top_comments[0]
+        for depth in range(10):
+            parent = Comment.objects.create(
+                post=self.post,
+                author=self.user,
+                parent=parent,
+                content=f'Deep reply at level {depth + 1}'
+            )
+        
+        post = Post.objects.select_related('author').get(pk=self.post.pk)
+        
+        # One query for the comment tree, the count comes from the post row
+        with self.assertNumQueries(1):
+            data = PostSerializer(post).data
+        
+        # Walk down to the deepest reply
+        node = next(c for c in data['comments'] if c['id'] == self.top_comments[0].id)
+        levels = 0
+        while True:
+            deeper = [r for r in node['replies'] if r['content'].startswith('Deep reply')]
+            if not deeper:
+                break
+            node = deeper[0]
+            levels += 1
+        self.assertEqual(levels, 10)
+        self.assertEqual(node['depth'], 10)
+    
+    def test_feed_page_uses_constant_queries(self):
+        """
+        Test that the feed list costs the same number of queries no matter
+        how many posts (and comment trees) are on the page.
+        """
+        # Version stamp, page COUNT, the posts themselves, and one query for every comment tree
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/posts/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['comment_count'], 100)
+        
+        for i in range(5):
+            post = Post.objects.create(author=self.user, content=f'Extra post {i}')
+            top = Comment.objects.create(post=post, author=self.user, content='Top')
+            Comment.objects.create(post=post, author=self.user, parent=top, content='Reply')
+        
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/posts/', secure=True)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(response.data['results'][0]['comment_count'], 2)
+        self.assertEqual(len(response.data['results'][0]['comments'][0]['replies']), 1)
+
+
+class DenormalizedCounterTestCase(TestCase):
+    """
+    Test case for the comment_count and reply_count counters.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='counter', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content='Counted post')
+        self.top = Comment.objects.create(post=self.post, author=self.user, content='Top')
+        self.reply = Comment.objects.create(post=self.post, author=self.user, parent=self.top, content='Reply')
+        Comment.objects.create(post=self.post, author=self.user, parent=self.reply, content='Nested')
+    
+    def test_counters_follow_create_and_delete(self):
+        """
+        Test that creating and deleting comments keeps the counters in sync,
+        including replies removed by the cascade.
+        """
+        self.post.refresh_from_db()
+        self.top.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 3)
+        self.assertEqual(self.top.reply_count, 1)
+        
+        # Deleting the reply also removes its nested reply
+        self.reply.delete()
+        self.post.refresh_from_db()
+        self.top.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(self.top.reply_count, 0)
+    
+    def test_recompute_counters_command_fixes_drift(self):
+        """
+        Test that the management command repairs counters that drifted.
+        """
+        from django.core.management import call_command
+        from io import StringIO
+        
+        Like.objects.create(user=self.user, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(comment_count=42, like_count=7)
+        Comment.objects.filter(pk=self.top.pk).update(reply_count=9)
+        
+        call_command('recompute_counters', stdout=StringIO())
+        
+        self.post.refresh_from_db()
+        self.top.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 3)
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(self.top.reply_count, 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """
+    Test case for the cursor (keyset) pagination mode of the feed.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='scroller', password='testpass123')
+        for i in range(25):
+            Post.objects.create(author=self.user, content=f'Post {i}')
+        # Give a few posts identical timestamps so ties are broken by id
+        tied = list(Post.objects.order_by('id').values_list('id', flat=True)[:4])
+        Post.objects.filter(id__in=tied).update(created_at=timezone.now() - timedelta(hours=1))
+    
+    def test_cursor_pages_cover_feed_without_count(self):
+        """
+        Test that following the next cursors walks the whole feed exactly once,
+        with no COUNT query on any page.
+        """
+        expected = list(Post.objects.order_by('-created_at', 'id').values_list('id', flat=True))
+        
+        url = '/api/posts/?pagination=cursor'
+        seen = []
+        while url:
+            # Version stamp, the page of posts and one query for all of their comment trees
+            with self.assertNumQueries(3):
+                response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        
+        self.assertEqual(seen, expected)
+    
+    def test_invalid_cursor_is_rejected(self):
+        """Test that a tampered cursor returns 404 instead of a server error."""
+        response = self.client.get('/api/posts/?cursor=not-a-cursor', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+
+@override_settings(LIKE_COUNT_WRITE_BEHIND=True, LIKE_COUNT_FLUSH_INTERVAL_MS=0)
+class WriteBehindLikeCountTestCase(TestCase):
+    """
+    Test case for buffered (write-behind) like counters.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='hot', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Viral post')
+    
+    def test_buffered_likes_are_visible_and_flushed(self):
+        """
+        Test that likes are stored right away, their counts are merged into
+        reads before the flush, and one flush writes the whole burst.
+        """
+        from .counters import like_counts
+        
+        for i in range(5):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+            self.assertEqual(response.data['like_count'], i + 1)
+        
+        # Like rows are written synchronously, the counter column is not
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 5)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+        response = self.client.get(f'/api/posts/{self.post.pk}/', secure=True)
+        self.assertEqual(response.data['like_count'], 5)
+        
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(3):
+            # Savepoint, one UPDATE for every buffered post, release
+            self.assertEqual(like_counts.flush(), 1)
+            # Still counted until the UPDATE commits
+            self.assertEqual(like_counts.pending(Post, self.post.pk), 5)
+        self.assertEqual(like_counts.pending(Post, self.post.pk), 0)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 5)
+        response = self.client.get(f'/api/posts/{self.post.pk}/', secure=True)
+        self.assertEqual(response.data['like_count'], 5)
+
+
+
+@override_settings(LIKE_SHARDING_THRESHOLD=3, LIKE_COUNTER_SHARDS=4, LIKE_SHARD_SUM_TTL=0)
+class ShardedLikeCountTestCase(TestCase):
+    """
+    Test case for promoting hot posts to sharded like counters.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='star', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Hot post')
+        self.cold = Post.objects.create(author=self.author, content='Cold post')
+    
+    def tearDown(self):
+        # Like rates live in the cache, don't leak them into other tests
+        cache.clear()
+    
+    def test_hot_post_is_promoted_to_shards(self):
+        """
+        Test that a post crossing the like-rate threshold counts further likes
+        in shard rows, while reads and responses still see the full count.
+        """
+        from .models import LikeCountShard
+        
+        for i in range(8):
+            response = self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+            self.assertEqual(response.data['like_count'], i + 1)
+        Like.objects.create(user=User.objects.get(username='fan0'), post=self.cold)
+        
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_shards, 4)
+        self.assertEqual(self.post.like_count, 3)
+        self.assertEqual(sum(LikeCountShard.objects.filter(post=self.post).values_list('count', flat=True)), 5)
+        self.assertFalse(LikeCountShard.objects.filter(post=self.cold).exists())
+        
+        response = self.client.post(f'/api/posts/{self.post.pk}/unlike/', {'username': 'fan0'}, secure=True)
+        self.assertEqual(response.data['like_count'], 7)
+        response = self.client.get(f'/api/posts/{self.post.pk}/', secure=True)
+        self.assertEqual(response.data['like_count'], 7)
+        
+        # Recomputing folds the shards back into the post row
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('recompute_counters', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.like_shards), (7, 0))
+        self.assertFalse(LikeCountShard.objects.exists())
+    
+    def test_demotion_seen_by_every_process(self):
+        """
+        Test that likes follow the row's like_shards, so a target folded back
+        by another process (with its own cache) gets written to its row again.
+        """
+        from .models import LikeCountShard
+        
+        for i in range(5):
+            self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+        self.assertTrue(LikeCountShard.objects.filter(post=self.post).exists())
+        
+        # recompute_counters as run by cron, without touching this process's cache
+        LikeCountShard.objects.all().delete()
+        Post.objects.filter(pk=self.post.pk).update(like_count=5, like_shards=0)
+        
+        for i in range(5, 7):
+            response = self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+            self.assertEqual(response.data['like_count'], i + 1)
+        Like.objects.create(user=User.objects.create_user(username='ormfan'), post=self.post)
+        self.assertFalse(LikeCountShard.objects.exists())
+        response = self.client.get(f'/api/posts/{self.post.pk}/', secure=True)
+        self.assertEqual(response.data['like_count'], 8)
+
+
+class UserIdCacheTestCase(TestCase):
+    """
+    Test case for resolving usernames on the write endpoints without a user lookup.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        self.user_ids = user_ids
+        self.user_ids.clear()
+        self.author = User.objects.create_user(username='poster', password='testpass123')
+        self.posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(3)]
+    
+    def tearDown(self):
+        self.user_ids.clear()
+    
+    def _user_queries(self, queries):
+        return [query['sql'] for query in queries if 'auth_user' in query['sql']]
+    
+    def test_repeat_writes_skip_user_lookup(self):
+        """
+        Test that only the first write of a user looks it up, and that posts and
+        comments are credited to the cached user.
+        """
+        from django.test.utils import CaptureQueriesContext
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.posts[0].pk}/like/', {'username': 'regular'}, secure=True)
+        regular = User.objects.get(username='regular')
+        
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'/api/posts/{self.posts[1].pk}/like/', {'username': 'regular'}, secure=True)
+            self.assertEqual(response.status_code, 201)
+            self.client.post(f'/api/posts/{self.posts[0].pk}/unlike/', {'username': 'regular'}, secure=True)
+            self.client.post('/api/posts/', {'content': 'Hello', 'username': 'regular'}, secure=True)
+            self.client.post(
+                '/api/comments/', {'post': self.posts[2].pk, 'content': 'Hi', 'username': 'regular'}, secure=True
+            )
+        self.assertEqual(self._user_queries(queries.captured_queries), [])
+        self.assertEqual(Like.objects.get(user=regular).post, self.posts[1])
+        self.assertTrue(Post.objects.filter(author=regular, content='Hello').exists())
+        self.assertTrue(Comment.objects.filter(author=regular, content='Hi').exists())
+    
+    def test_deleted_user_is_forgotten(self):
+        """
+        Test that deleting a user evicts it, so the next write recreates it.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.posts[0].pk}/like/', {'username': 'leaver'}, secure=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(username='leaver').delete()
+        self.assertIsNone(self.user_ids.get('leaver'))
+        
+        response = self.client.post(f'/api/posts/{self.posts[0].pk}/like/', {'username': 'leaver'}, secure=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Like.objects.get(post=self.posts[0]).user.username, 'leaver')
+    
+    @override_settings(USER_ID_CACHE_SIZE=2)
+    def test_cache_is_bounded(self):
+        """
+        Test that the least recently used username is evicted first.
+        """
+        for username, user_id in (('a', 1), ('b', 2)):
+            self.user_ids.set(username, user_id)
+        self.user_ids.get('a')
+        self.user_ids.set('c', 3)
+        self.assertEqual(len(self.user_ids), 2)
+        self.assertIsNone(self.user_ids.get('b'))
+        self.assertEqual(self.user_ids.get('a'), 1)
+
+
+class UserDeletedElsewhereTestCase(TransactionTestCase):
+    """
+    Test case for cached user ids of users deleted through another process,
+    whose foreign keys only fail once a write commits.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        self.user_ids = user_ids
+        self.user_ids.clear()
+        cache.clear()
+        self.author = User.objects.create_user(username='host', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Post')
+    
+    def tearDown(self):
+        self.user_ids.clear()
+    
+    def test_writes_recover_from_stale_id(self):
+        """Test that likes, posts, comments, follows and batches re-create a user deleted elsewhere."""
+        from unittest import mock
+        
+        for i, write in enumerate((
+            lambda: self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': 'ghost'}, secure=True),
+            lambda: self.client.post('/api/posts/', {'content': 'Back', 'username': 'ghost'}, secure=True),
+            lambda: self.client.post(
+                '/api/comments/', {'post': self.post.pk, 'content': 'Hi', 'username': 'ghost'}, secure=True
+            ),
+            lambda: self.client.post(f'/api/users/{self.author.pk}/follow/', {'username': 'ghost'}, secure=True),
+            lambda: self.client.post('/api/likes/batch/', {'operations': [
+                {'username': 'ghost', 'action': 'like', 'post': self.post.pk}
+            ]}, content_type='application/json', secure=True),
+        )):
+            stale_id = User.objects.create_user(username='ghost').pk
+            self.user_ids.set('ghost', stale_id)
+            # Deleted through another process: this one's signal never fires
+            with mock.patch('feed.users.forget_user'):
+                User.objects.get(pk=stale_id).delete()
+            
+            response = write()
+            self.assertIn(response.status_code, (200, 201), i)
+            ghost = User.objects.get(username='ghost')
+            self.assertNotEqual(ghost.pk, stale_id)
+            self.assertEqual(self.user_ids.get('ghost'), ghost.pk)
+            ghost.delete()
+
+
+class FeedCommentModesTestCase(TestCase):
+    """
+    Test case for the comments=none|top:N|full feed modes and the per-post tree endpoint.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='reader', password='testpass123')
+        self.posts = []
+        base = timezone.now() - timedelta(hours=1)
+        for i in range(3):
+            post = Post.objects.create(author=self.user, content=f'Post {i}')
+            for j in range(4):
+                top = Comment.objects.create(post=post, author=self.user, content=f'Top {j}')
+                Comment.objects.filter(pk=top.pk).update(created_at=base + timedelta(minutes=j))
+                Comment.objects.create(post=post, author=self.user, parent=top, content=f'Reply {j}')
+            self.posts.append(post)
+    
+    def test_top_comments_preview(self):
+        """
+        Test that top:N returns the N newest top-level comments per post,
+        without replies, in one comment query for the whole page.
+        """
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/posts/?comments=top:2', secure=True)
+        self.assertEqual(response.status_code, 200)
+        for post in response.data['results']:
+            self.assertEqual([c['content'] for c in post['comments']], ['Top 3', 'Top 2'])
+            self.assertEqual([c['replies'] for c in post['comments']], [[], []])
+            self.assertEqual([c['reply_count'] for c in post['comments']], [1, 1])
+            self.assertEqual(post['comment_count'], 8)
+    
+    def test_no_comments(self):
+        """
+        Test that comments=none skips comments entirely but keeps the count.
+        """
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/posts/?comments=none', secure=True)
+        for post in response.data['results']:
+            self.assertEqual(post['comments'], [])
+            self.assertEqual(post['comment_count'], 8)
+        
+        response = self.client.get(f'/api/posts/{self.posts[0].pk}/?comments=none', secure=True)
+        self.assertEqual(response.data['comments'], [])
+    
+    def test_invalid_mode(self):
+        """
+        Test that unknown modes and out of range sizes are rejected.
+        """
+        for mode in ('some', 'top:0', 'top:x', 'top:21'):
+            response = self.client.get(f'/api/posts/?comments={mode}', secure=True)
+            self.assertEqual(response.status_code, 400)
+    
+    def test_full_tree_endpoint(self):
+        """
+        Test that the per-post endpoint returns the whole tree.
+        """
+        response = self.client.get(f'/api/posts/{self.posts[0].pk}/comments/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual([len(c['replies']) for c in response.data], [1, 1, 1, 1])
+        
+        response = self.client.get('/api/posts/999999/comments/', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentSubtreeTestCase(TestCase):
+    """
+    Test case for expanding one branch of a thread with /comments/{id}/subtree/.
+    """
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='threader', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content='Thread')
+        self.root = Comment.objects.create(post=self.post, author=self.user, content='Root')
+        base = timezone.now() - timedelta(hours=1)
+        self.replies = []
+        for i in range(5):
+            reply = Comment.objects.create(post=self.post, author=self.user, parent=self.root, content=f'Reply {i}')
+            Comment.objects.filter(pk=reply.pk).update(created_at=base + timedelta(minutes=i))
+            self.replies.append(reply)
+        # A chain hanging off the newest reply
+        parent = self.replies[4]
+        for i in range(4):
+            parent = Comment.objects.create(post=self.post, author=self.user, parent=parent, content=f'Deep {i}')
+        # Another branch of the post that must not be read
+        other = Comment.objects.create(post=self.post, author=self.user, content='Other')
+        Comment.objects.create(post=self.post, author=self.user, parent=other, content='Other reply')
+    
+    def test_depth_and_limit(self):
+        """
+        Test that replies are cut at the depth limit and per-level limit,
+        with links to load the rest.
+        """
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/comments/{self.root.pk}/subtree/?depth=2&limit=2', secure=True)
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual([c['content'] for c in results], ['Reply 4', 'Reply 3'])
+        self.assertEqual([c['content'] for c in results[0]['replies']], ['Deep 0'])
+        self.assertIsNone(results[1]['more_replies'])
+        
+        # Deep 0 sits at the depth limit, so its replies are one link away
+        deep = results[0]['replies'][0]
+        self.assertEqual(deep['replies'], [])
+        response = self.client.get(deep['more_replies'], secure=True)
+        self.assertEqual([c['content'] for c in response.data['results']], ['Deep 1'])
+        
+        # Paging through the root's own replies
+        response = self.client.get(f'/api/comments/{self.root.pk}/subtree/?depth=1&limit=2', secure=True)
+        self.assertIsNotNone(response.data['next'])
+        response = self.client.get(response.data['next'], secure=True)
+        self.assertEqual([c['content'] for c in response.data['results']], ['Reply 2', 'Reply 1'])
+        response = self.client.get(response.data['next'], secure=True)
+        self.assertEqual([c['content'] for c in response.data['results']], ['Reply 0'])
+        self.assertIsNone(response.data['next'])
+    
+    def test_invalid_params(self):
+        """
+        Test that bad params and unknown comments are rejected.
+        """
+        for query in ('depth=0', 'depth=11', 'limit=x', 'limit=101'):
+            response = self.client.get(f'/api/comments/{self.root.pk}/subtree/?{query}', secure=True)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(f'/api/comments/{self.root.pk}/subtree/?cursor=bogus', secure=True)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/api/comments/999999/subtree/', secure=True)
+        self.assertEqual(response.status_code, 404)
+
+
+class FastReadRenderingTestCase(TestCase):
+    """
+    Test case for rendering post reads from plain rows instead of the serializers.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'writer{i}', password='testpass123') for i in range(3)]
+        self.posts = []
+        for i in range(4):
+            post = Post.objects.create(author=self.users[i % 3], content=f'Post {i}')
+            parent = None
+            for j in range(6):
+                parent = Comment.objects.create(
+                    post=post, author=self.users[j % 3], parent=parent if j % 2 else None, content=f'Comment {i}.{j}'
+                )
+            Like.objects.create(user=self.users[0], post=post)
+            Like.objects.create(user=self.users[1], comment=parent)
+            self.posts.append(post)
+    
+    def test_same_json_as_serializers(self):
+        """
+        Test that every read the fast path serves returns byte-for-byte the
+        same JSON as the serializer path.
+        """
+        urls = [
+            '/api/posts/',
+            '/api/posts/?comments=none',
+            '/api/posts/?comments=top:2',
+            '/api/posts/?pagination=cursor',
+            f'/api/posts/{self.posts[0].pk}/',
+            f'/api/posts/{self.posts[1].pk}/?comments=top:1',
+            f'/api/posts/{self.posts[2].pk}/comments/',
+            '/api/posts/999999/',
+        ]
+        for url in urls:
+            with override_settings(FAST_READ_RENDERING=False):
+                expected = self.client.get(url, secure=True)
+            with override_settings(FAST_READ_RENDERING=True):
+                actual = self.client.get(url, secure=True)
+            self.assertEqual(actual.status_code, expected.status_code, url)
+            self.assertEqual(actual.content, expected.content, url)
+    
+    def test_fast_path_skips_serializers(self):
+        """
+        Test that the fast path doesn't go through PostSerializer at all.
+        """
+        from unittest import mock
+        from .serializers import PostSerializer
+        
+        with mock.patch.object(PostSerializer, 'to_representation') as to_representation:
+            response = self.client.get('/api/posts/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 4)
+        to_representation.assert_not_called()
+
+
+class FastJSONRendererTestCase(TestCase):
+    """
+    Test case for the orjson-backed renderer and streamed responses.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='streamer', password='testpass123')
+        for i in range(5):
+            post = Post.objects.create(author=self.user, content=f'Post {i} \u2028 café')
+            for j in range(3):
+                Comment.objects.create(post=post, author=self.user, content=f'Comment {j}')
+    
+    def test_same_output_as_json_renderer(self):
+        """
+        Test that the renderer matches JSONRenderer with and without orjson,
+        and that the streamed chunks add up to the same bytes.
+        """
+        from decimal import Decimal
+        from unittest import mock
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        
+        data = {
+            'text': 'café \u2028\u2029 "quoted"',
+            'when': timezone.now(),
+            'amount': Decimal('1.50'),
+            'nothing': None,
+            'items': [{'id': i, 'nested': {'ok': True, 'ratio': 0.5}} for i in range(50)],
+            3: 'int key',
+        }
+        expected = JSONRenderer().render(data)
+        renderer = FastJSONRenderer()
+        self.assertEqual(renderer.render(data), expected)
+        self.assertEqual(b''.join(renderer.iter_render(data, chunk_size=64)), expected)
+        with mock.patch('feed.renderers.orjson', None):
+            self.assertEqual(renderer.render(data), expected)
+            self.assertEqual(b''.join(renderer.iter_render(data, chunk_size=64)), expected)
+    
+    def test_large_responses_are_streamed(self):
+        """
+        Test that responses over the size threshold are streamed in chunks
+        with the same body, and small ones are not.
+        """
+        with override_settings(STREAMING_JSON_MIN_ITEMS=0):
+            expected = self.client.get('/api/posts/', secure=True)
+        self.assertFalse(expected.streaming)
+        
+        with override_settings(STREAMING_JSON_MIN_ITEMS=20, STREAMING_JSON_CHUNK_SIZE=256):
+            response = self.client.get('/api/posts/', secure=True)
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            chunks = list(response.streaming_content)
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(b''.join(chunks), expected.content)
+            
+            small = self.client.get('/api/posts/?comments=none', secure=True)
+            self.assertFalse(small.streaming)
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalGetTestCase(TestCase):
+    """
+    Test case for ETag/Last-Modified handling on the polled read endpoints.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        # Ids cached by an earlier test's on_commit callbacks were rolled back
+        user_ids.clear()
+        self.user = User.objects.create_user(username='poller', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content='Polled post')
+        self.other = Post.objects.create(author=self.user, content='Other post')
+        self.comment = Comment.objects.create(post=self.post, author=self.user, content='Comment')
+    
+    def _revalidate(self, url, response):
+        return self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=response['ETag'])
+    
+    def test_post_not_modified_without_queries(self):
+        """
+        Test that an unchanged post is answered with a 304 and no queries,
+        and that comments and likes in its thread invalidate it.
+        """
+        url = f'/api/posts/{self.post.pk}/'
+        response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        
+        with self.assertNumQueries(0):
+            not_modified = self._revalidate(url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        
+        changes = [
+            lambda: self.client.post(f'/api/comments/{self.comment.pk}/like/', {'username': 'fan'}, secure=True),
+            lambda: self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': 'fan'}, secure=True),
+            lambda: Comment.objects.create(post=self.post, author=self.user, content='New'),
+            lambda: Like.objects.get(post=self.post).delete(),
+        ]
+        for change in changes:
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            refreshed = self._revalidate(url, response)
+            self.assertEqual(refreshed.status_code, 200)
+            self.assertNotEqual(refreshed['ETag'], response['ETag'])
+            response = refreshed
+        
+        # Query params are part of the version
+        self.assertEqual(self._revalidate(f'{url}?comments=none', response).status_code, 200)
+        # Activity on another post leaves this one alone
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/posts/{self.other.pk}/like/', {'username': 'fan'}, secure=True)
+        self.assertEqual(self._revalidate(url, response).status_code, 304)
+    
+    def test_feed_and_leaderboard(self):
+        """
+        Test that the feed and the leaderboard revalidate until something changes.
+        """
+        for url in ('/api/posts/', '/api/leaderboard/top_users/'):
+            response = self.client.get(url, secure=True)
+            self.assertEqual(self._revalidate(url, response).status_code, 304)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/posts/{self.other.pk}/unlike/', {'username': 'fan'}, secure=True)
+                self.client.post(f'/api/posts/{self.other.pk}/like/', {'username': 'fan'}, secure=True)
+            self.assertEqual(self._revalidate(url, response).status_code, 200)
+    
+    @override_settings(CACHE_SHARED=False)
+    def test_database_stamps_without_shared_cache(self):
+        """
+        Test that with a per-process cache the stamps come from the database:
+        a 304 costs one lookup, and a change seen by another worker (whose
+        cache is empty) still moves the ETag.
+        """
+        for url in ('/api/posts/', f'/api/posts/{self.post.pk}/', '/api/leaderboard/top_users/'):
+            response = self.client.get(url, secure=True)
+            with self.assertNumQueries(1):
+                self.assertEqual(self._revalidate(url, response).status_code, 304)
+            cache.clear()
+            self.assertEqual(self._revalidate(url, response).status_code, 304)
+            
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/posts/{self.post.pk}/unlike/', {'username': 'fan'}, secure=True)
+                self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': 'fan'}, secure=True)
+            cache.clear()
+            self.assertEqual(self._revalidate(url, response).status_code, 200)
+
+
+@override_settings(CACHE_SHARED=True)
+class CommentTreeCacheTestCase(TestCase):
+    """
+    Test case for serving full threads from the per-post rendered tree cache.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        user_ids.clear()
+        self.user = User.objects.create_user(username='hotthread', password='testpass123')
+        self.post = Post.objects.create(author=self.user, content='Hot thread')
+        self.comments = []
+        parent = None
+        for i in range(10):
+            parent = Comment.objects.create(post=self.post, author=self.user, parent=parent, content=f'Comment {i}')
+            self.comments.append(parent)
+        self.url = f'/api/posts/{self.post.pk}/'
+    
+    def _find(self, comments, pk):
+        for comment in comments:
+            if comment['id'] == pk:
+                return comment
+            found = self._find(comment['replies'], pk)
+            if found:
+                return found
+    
+    def test_hot_thread_served_from_cache(self):
+        """
+        Test that repeat reads don't query comments, likes are patched in
+        without re-rendering, and comment changes re-render the tree.
+        """
+        self.client.get(self.url, secure=True)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.data['comment_count'], 10)
+        
+        deep = self.comments[7]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/comments/{deep.pk}/like/', {'username': 'fan'}, secure=True)
+        # The post row, plus the like counts of the post's comments
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, secure=True)
+        self.assertEqual(self._find(response.data['comments'], deep.pk)['like_count'], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/api/posts/{self.post.pk}/comments/', secure=True)
+        self.assertEqual(self._find(response.data, deep.pk)['like_count'], 1)
+        
+        deep.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            deep.content = 'Edited'
+            deep.save()
+            Comment.objects.create(post=self.post, author=self.user, parent=deep, content='New reply')
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.data['comment_count'], 11)
+        edited = self._find(response.data['comments'], deep.pk)
+        self.assertEqual(edited['content'], 'Edited')
+        self.assertEqual(edited['like_count'], 1)
+        self.assertEqual([reply['content'] for reply in edited['replies']], ['New reply', 'Comment 8'])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/comments/{deep.pk}/unlike/', {'username': 'fan'}, secure=True)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(self._find(response.data['comments'], deep.pk)['like_count'], 0)
+    
+    def test_large_thread_stays_cached(self):
+        """Test that a thread with more comments than the cache has entries keeps its cached tree."""
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'large-thread',
+            'OPTIONS': {'MAX_ENTRIES': 50},
+        }}
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user, content=f'Reply {i}', tree_path=f'{i:06d}') for i in range(200)
+        )
+        with override_settings(CACHES=caches):
+            self.client.get(self.url, secure=True)
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.data['comment_count'], 210)
+    
+    @override_settings(CACHE_SHARED=False)
+    def test_cached_per_worker_without_shared_cache(self):
+        """
+        Test that with a per-process cache the tree is still cached, and that
+        comments and likes written through another worker, with a cache of
+        its own, retire it.
+        """
+        other_worker = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'other-worker',
+        }}
+        self.client.get(self.url, secure=True)
+        # Version stamps of the post and of its comments, and the post row
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.data['comment_count'], 10)
+        
+        deep = self.comments[7]
+        with override_settings(CACHES=other_worker), self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/comments/{deep.pk}/like/', {'username': 'fan'}, secure=True)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(self._find(response.data['comments'], deep.pk)['like_count'], 1)
+        
+        with override_settings(CACHES=other_worker), self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(post=self.post, author=self.user, parent=deep, content='New reply')
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.data['comment_count'], 11)
+        self.assertEqual(self._find(response.data['comments'], deep.pk)['like_count'], 1)
+
+
+class LiveEventsTestCase(TestCase):
+    """
+    Test case for the Server-Sent Events stream fed by the in-process broker.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        user_ids.clear()
+        self.author = User.objects.create_user(username='live', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Live post')
+        self.other = Post.objects.create(author=self.author, content='Quiet post')
+        self.comment = Comment.objects.create(post=self.post, author=self.author, content='Live comment')
+    
+    def _activity(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                self.client.post(f'/api/posts/{self.post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+            self.client.post(f'/api/comments/{self.comment.pk}/like/', {'username': 'fan0'}, secure=True)
+            Like.objects.create(user=self.author, post=self.other)
+            self.client.post('/api/comments/', {
+                'post': self.post.pk, 'parent': self.comment.pk, 'content': 'Reply', 'username': 'fan1'
+            }, secure=True)
+    
+    async def _next_event(self, stream):
+        import json
+        chunk = await asyncio.wait_for(anext(stream), 5)
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+    
+    @override_settings(EVENTS_COALESCE_MS=100)
+    async def test_coalesced_updates_and_leaderboard_diffs(self):
+        """
+        Test that a burst of activity arrives as one update per followed post
+        and one leaderboard diff.
+        """
+        from asgiref.sync import sync_to_async
+        
+        response = await self.async_client.get(f'/api/events/?posts={self.post.pk}&window=24h', secure=True)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        self.assertEqual(await anext(stream), b'retry: 3000\n\n')
+        self.assertEqual(await self._next_event(stream), ('leaderboard', {'changed': [], 'removed': []}))
+        
+        await sync_to_async(self._activity)()
+        
+        event, update = await self._next_event(stream)
+        self.assertEqual(event, 'post')
+        reply = await Comment.objects.aget(content='Reply')
+        self.assertEqual(update, {
+            'post_id': self.post.pk,
+            'like_count': 3,
+            'comment_like_counts': {str(self.comment.pk): 1},
+            'new_comments': [{'id': reply.pk, 'parent': self.comment.pk}],
+        })
+        
+        event, diff = await self._next_event(stream)
+        self.assertEqual(event, 'leaderboard')
+        self.assertEqual(diff['removed'], [])
+        self.assertEqual([(row['rank'], row['username'], row['karma']) for row in diff['changed']], [(1, 'live', 21)])
+        await stream.aclose()
+    
+    async def test_invalid_params(self):
+        """
+        Test that bad params are rejected before streaming starts.
+        """
+        for query in ('posts=a', 'window=2d', 'limit=0'):
+            response = await self.async_client.get(f'/api/events/?{query}', secure=True)
+            self.assertEqual(response.status_code, 400)
+    
+    def test_not_served_under_wsgi(self):
+        """
+        Test that the stream is refused under WSGI, which can't serve it without holding a worker.
+        """
+        response = self.client.get('/api/events/', secure=True)
+        self.assertEqual(response.status_code, 501)
+
+
+@override_settings(ASYNC_READ_CONCURRENT_QUERIES=False, CACHE_SHARED=True)
+class AsyncReadViewsTestCase(TestCase):
+    """
+    Test case for the async read views, which must answer exactly like the viewsets.
+    (The test transaction is only visible on its own connection, so queries
+    stay on Django's async ORM thread here.)
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        user_ids.clear()
+        self.author = User.objects.create_user(username='async', password='testpass123')
+        self.posts = [Post.objects.create(author=self.author, content=f'Post {i}') for i in range(25)]
+        self.post = self.posts[-1]
+        top = Comment.objects.create(post=self.post, author=self.author, content='Top')
+        Comment.objects.create(post=self.post, author=self.author, parent=top, content='Reply')
+        Like.objects.create(user=self.author, post=self.post)
+    
+    async def _compare(self, view, url, **kwargs):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory
+        
+        expected = await sync_to_async(self.client.get)(url, secure=True)
+        response = await view(AsyncRequestFactory().get(url, secure=True), **kwargs)
+        self.assertEqual(response.status_code, expected.status_code, url)
+        self.assertEqual(response.content, expected.content, url)
+        self.assertEqual(response.get('ETag'), expected.get('ETag'), url)
+        return response
+    
+    async def test_matches_viewsets(self):
+        """
+        Test that the feed, posts and leaderboard, including their errors,
+        come out byte for byte as the viewsets send them.
+        """
+        from . import async_views
+        
+        for query in ('', '?page=2', '?page=last', '?page=9', '?page=x', '?comments=top:1', '?pagination=cursor', '?comments=bad'):
+            await self._compare(async_views.post_list, f'/api/posts/{query}')
+        for query in ('', '?comments=top:1', '?comments=none'):
+            await self._compare(async_views.post_detail, f'/api/posts/{self.post.pk}/{query}', pk=str(self.post.pk))
+        await self._compare(async_views.post_detail, '/api/posts/0/', pk='0')
+        for query in ('', '?window=7d&limit=3', '?window=2y'):
+            await self._compare(async_views.top_users, f'/api/leaderboard/top_users/{query}')
+    
+    async def test_not_modified(self):
+        """Test that a current ETag gets a 304 without rendering anything."""
+        from django.test import AsyncRequestFactory
+        from . import async_views
+        
+        url = f'/api/posts/{self.post.pk}/'
+        response = await self._compare(async_views.post_detail, url, pk=str(self.post.pk))
+        request = AsyncRequestFactory().get(url, secure=True, headers={'If-None-Match': response['ETag']})
+        not_modified = await async_views.post_detail(request, pk=str(self.post.pk))
+        self.assertEqual(not_modified.status_code, 304)
+    
+    async def test_writes_go_to_viewset(self):
+        """Test that read_or_write hands everything but GET to the viewset."""
+        from django.test import AsyncRequestFactory
+        from . import async_views
+        from .views import PostViewSet
+        
+        view = async_views.read_or_write(
+            async_views.post_list, PostViewSet.as_view({'get': 'list', 'post': 'create'})
+        )
+        request = AsyncRequestFactory().post(
+            '/api/posts/', {'content': 'Written', 'username': 'async'}, content_type='application/json', secure=True
+        )
+        response = await view(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(await Post.objects.filter(content='Written').aexists())
+
+
+@override_settings(ASYNC_READ_CONCURRENT_QUERIES=True)
+class ConcurrentAsyncReadsTestCase(TransactionTestCase):
+    """
+    Test case for async reads whose independent queries run on their own
+    connections, which only see committed rows.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='concurrent', password='testpass123')
+        self.post = Post.objects.create(author=self.author, content='Concurrent post')
+        Comment.objects.create(post=self.post, author=self.author, content='Comment')
+    
+    async def test_concurrent_queries(self):
+        """Test that the feed and a thread read concurrently match the viewsets."""
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncRequestFactory
+        from . import async_views
+        
+        for view, url, kwargs in (
+            (async_views.post_list, '/api/posts/', {}),
+            (async_views.post_detail, f'/api/posts/{self.post.pk}/', {'pk': str(self.post.pk)}),
+        ):
+            response = await view(AsyncRequestFactory().get(url, secure=True), **kwargs)
+            expected = await sync_to_async(self.client.get)(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content)
+
+
+class SearchTestCase(TestCase):
+    """
+    Test case for full-text search over posts and comments.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='searcher', password='testpass123')
+        self.exact = Post.objects.create(author=self.user, content='Sourdough baking: sourdough starter tips')
+        self.passing = Post.objects.create(author=self.user, content='Weekend plans, maybe some sourdough')
+        self.other = Post.objects.create(author=self.user, content='Cycling routes near the river')
+        self.comment = Comment.objects.create(post=self.other, author=self.user, content='Great river views')
+    
+    def _search(self, path, q, **params):
+        return self.client.get(path, {'q': q, **params}, secure=True)
+    
+    def test_ranked_matches(self):
+        """Test that searches match whole words, stemmed, with the best match first."""
+        response = self._search('/api/posts/search/', 'sourdough')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.exact.pk, self.passing.pk])
+        self.assertEqual(response.data['results'][0]['comments'], [])
+        
+        # Every word must match, and query syntax is taken literally
+        self.assertEqual(self._search('/api/posts/search/', 'sourdough tips').data['count'], 1)
+        self.assertEqual(self._search('/api/posts/search/', 'route* (cycling').data['count'], 1)
+        
+        response = self._search('/api/comments/search/', 'view')
+        self.assertEqual([comment['id'] for comment in response.data['results']], [self.comment.pk])
+        self.assertEqual(self._search('/api/posts/search/', '?!').status_code, 400)
+    
+    def test_index_follows_writes(self):
+        """Test that creating, editing and deleting rows updates the index."""
+        self.other.content = 'Baking bread by the river'
+        self.other.save()
+        self.assertEqual(self._search('/api/posts/search/', 'baking').data['count'], 2)
+        self.assertEqual(self._search('/api/posts/search/', 'cycling').data['count'], 0)
+        
+        reply = Comment.objects.create(post=self.other, author=self.user, parent=self.comment, content='River walk')
+        self.assertEqual(self._search('/api/comments/search/', 'river').data['count'], 2)
+        
+        self.other.delete()
+        self.assertEqual(self._search('/api/posts/search/', 'river').data['count'], 0)
+        self.assertEqual(self._search('/api/comments/search/', 'river').data['count'], 0)
+        self.assertFalse(Comment.objects.filter(pk=reply.pk).exists())
+    
+    def test_paginated(self):
+        """Test that results are paged by the index, reading only the page's rows."""
+        for i in range(25):
+            Post.objects.create(author=self.user, content=f'Sourdough loaf number {i}')
+        
+        response = self._search('/api/posts/search/', 'sourdough')
+        self.assertEqual(response.data['count'], 27)
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertIsNotNone(response.data['next'])
+        
+        # Count, page of ids and page of rows
+        with self.assertNumQueries(3):
+            second = self._search('/api/posts/search/', 'sourdough', page=2)
+        self.assertEqual(len(second.data['results']), 7)
+        ids = {post['id'] for post in response.data['results']} | {post['id'] for post in second.data['results']}
+        self.assertEqual(len(ids), 27)
+
+
+@override_settings(HOT_SCORE_MIN_INTERVAL=0)
+class FeedSortTestCase(TestCase):
+    """
+    Test case for the hot and top feed orders and the stored hot scores.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        user_ids.clear()
+        self.author = User.objects.create_user(username='ranked', password='testpass123')
+        now = timezone.now()
+        # (age in hours, likes): the fresh post with fewer likes is hotter than the old favourite
+        self.posts = {}
+        for name, age, likes in (('old', 48, 6), ('fresh', 1, 3), ('stale', 24 * 30, 9), ('quiet', 2, 0)):
+            post = Post.objects.create(author=self.author, content=name)
+            Post.objects.filter(pk=post.pk).update(created_at=now - timedelta(hours=age))
+            self.posts[name] = post
+            with self.captureOnCommitCallbacks(execute=True):
+                for i in range(likes):
+                    self.client.post(f'/api/posts/{post.pk}/like/', {'username': f'fan{i}'}, secure=True)
+    
+    def _order(self, query):
+        response = self.client.get(f'/api/posts/?comments=none&{query}', secure=True)
+        self.assertEqual(response.status_code, 200)
+        names = {post.pk: name for name, post in self.posts.items()}
+        return [names[post['id']] for post in response.data['results']]
+    
+    def test_hot_and_top(self):
+        """Test that likes rescore posts, and each sort orders by its column."""
+        self.assertEqual(self._order('sort=hot'), ['fresh', 'old', 'stale', 'quiet'])
+        self.assertEqual(self._order('sort=top'), ['stale', 'old', 'fresh', 'quiet'])
+        self.assertEqual(self._order(''), ['fresh', 'quiet', 'old', 'stale'])
+        self.assertEqual(self.client.get('/api/posts/?sort=best', secure=True).status_code, 400)
+        
+        # Likes through the ORM rescore too
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(6):
+                Like.objects.create(user=User.objects.create_user(username=f'orm{i}'), post=self.posts['quiet'])
+        self.assertEqual(self._order('sort=hot')[0], 'quiet')
+    
+    def test_sweep_decays_scores(self):
+        """Test that the sweep rescores recent posts and zeroes old ones."""
+        from .ranking import sweep_hot_scores
+        
+        self.assertGreater(Post.objects.get(pk=self.posts['stale'].pk).hot_score, 0)
+        fresh = Post.objects.get(pk=self.posts['fresh'].pk).hot_score
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_hot_scores(now=timezone.now() + timedelta(hours=10)), 3)
+        self.assertEqual(Post.objects.get(pk=self.posts['stale'].pk).hot_score, 0)
+        self.assertLess(Post.objects.get(pk=self.posts['fresh'].pk).hot_score, fresh)
+    
+    @override_settings(HOT_SCORE_MIN_INTERVAL=60)
+    def test_throttled_rescores_trail_the_burst(self):
+        """Test that a burst keeps total_likes exact and the rescores it skipped run on the next flush."""
+        from unittest import mock
+        from .ranking import pending_rescores
+        
+        quiet = self.posts['quiet']
+        with mock.patch.object(pending_rescores, '_start_flusher'):
+            for i in range(30):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.client.post(f'/api/posts/{quiet.pk}/like/', {'username': f'burst{i}'}, secure=True)
+        quiet.refresh_from_db()
+        self.assertEqual((quiet.like_count, quiet.total_likes), (30, 30))
+        self.assertEqual(self._order('sort=top')[0], 'quiet')
+        self.assertIn(quiet.pk, pending_rescores)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(pending_rescores.flush(), 1)
+        self.assertNotIn(quiet.pk, pending_rescores)
+        self.assertEqual(self._order('sort=hot')[0], 'quiet')
+    
+    @override_settings(LIKE_SHARDING_THRESHOLD=3, LIKE_COUNTER_SHARDS=4)
+    def test_sharded_likes_count_towards_sorts(self):
+        """Test that likes counted in shards still rank a post in the top and hot feeds."""
+        from .ranking import sweep_hot_scores
+        
+        big = Post.objects.create(author=self.author, content='big')
+        self.posts['big'] = big
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(12):
+                self.client.post(f'/api/posts/{big.pk}/like/', {'username': f'crowd{i}'}, secure=True)
+        big.refresh_from_db()
+        self.assertEqual((big.like_shards, big.like_count, big.total_likes), (4, 3, 12))
+        self.assertEqual(self._order('sort=top')[:2], ['big', 'stale'])
+        self.assertEqual(self._order('sort=hot')[0], 'big')
+        
+        # The sweep folds in shard likes whose rescore was skipped, whatever the post's age
+        Post.objects.filter(pk=big.pk).update(total_likes=3, created_at=timezone.now() - timedelta(days=60))
+        with self.captureOnCommitCallbacks(execute=True):
+            sweep_hot_scores()
+        self.assertEqual(Post.objects.get(pk=big.pk).total_likes, 12)
+        self.assertEqual(self._order('sort=top')[0], 'big')
+    
+    def test_cursor_pages_follow_sort(self):
+        """Test that keyset pages walk the hot and top orders, one query per page (and the version stamp)."""
+        from unittest import mock
+        from .pagination import FeedPagination
+        
+        for sort in ('hot', 'top'):
+            expected = [self.posts[name].pk for name in self._order(f'sort={sort}')]
+            url = f'/api/posts/?comments=none&sort={sort}&pagination=cursor'
+            seen = []
+            with mock.patch.object(FeedPagination, 'page_size', 1):
+                while url:
+                    with self.assertNumQueries(2):
+                        response = self.client.get(url, secure=True)
+                    seen.extend(post['id'] for post in response.data['results'])
+                    url = response.data['next']
+            self.assertEqual(seen, expected)
+
+
+class FollowingFeedTestCase(TestCase):
+    """
+    Test case for the following feed, fanned out to inboxes on write.
+    """
+    
+    def setUp(self):
+        from .users import user_ids
+        cache.clear()
+        user_ids.clear()
+        self.reader = User.objects.create_user(username='reader', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        self.early = Post.objects.create(author=self.friend, content='Before the follow')
+    
+    def _follow(self, user, action='follow', username='reader'):
+        return self.client.post(f'/api/users/{user.pk}/{action}/', {'username': username}, secure=True)
+    
+    def _feed(self, url='/api/posts/following/?username=reader&comments=none'):
+        ids = []
+        while url:
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        return ids
+    
+    def test_posts_are_pushed_to_followers(self):
+        """Test that following backfills, new posts are pushed, and unfollowing removes them."""
+        from .models import InboxEntry
+        
+        self.assertEqual(self._follow(self.friend).status_code, 201)
+        self.assertEqual(self._follow(self.friend).status_code, 400)
+        self.assertEqual(self._follow(self.reader).status_code, 400)
+        
+        post = Post.objects.create(author=self.friend, content='After the follow')
+        Post.objects.create(author=self.stranger, content='Not followed')
+        self.assertEqual(self._feed(), [post.pk, self.early.pk])
+        self.assertEqual(InboxEntry.objects.filter(user=self.reader).count(), 2)
+        
+        self.assertEqual(self._follow(self.friend, 'unfollow').status_code, 200)
+        self.assertEqual(self._feed(), [])
+        self.assertEqual(self.client.get('/api/posts/following/?username=nobody', secure=True).status_code, 404)
+    
+    def test_page_is_one_inbox_read(self):
+        """Test that a page of the feed is read from the inbox, whoever the user follows."""
+        from unittest import mock
+        from .models import InboxEntry
+        from .pagination import FeedPagination
+        
+        authors = [User.objects.create_user(username=f'author{i}') for i in range(5)]
+        for author in authors:
+            self._follow(author)
+        posts = [Post.objects.create(author=authors[i % 5], content=f'Post {i}') for i in range(12)]
+        # Posts from the same instant are ordered by id
+        tied = [post.pk for post in posts[-4:]]
+        Post.objects.filter(pk__in=tied).update(created_at=posts[-1].created_at)
+        InboxEntry.objects.filter(post_id__in=tied).update(created_at=posts[-1].created_at)
+        expected = tied + [post.pk for post in posts[:-4]][::-1]
+        
+        with mock.patch.object(FeedPagination, 'page_size', 5):
+            # The user, the inbox range read, and the check for pulled authors
+            with self.assertNumQueries(3):
+                self.client.get('/api/posts/following/?username=reader&comments=none', secure=True)
+            self.assertEqual(self._feed(), expected)
+    
+    def test_later_pages_with_many_followers(self):
+        """Test that pages after the first list each post once, whoever else follows its author."""
+        from unittest import mock
+        from .pagination import FeedPagination
+        
+        for username in ('reader', 'fan', 'other'):
+            self._follow(self.friend, username=username)
+        posts = [Post.objects.create(author=self.friend, content=f'Post {i}') for i in range(12)]
+        expected = [post.pk for post in reversed(posts)] + [self.early.pk]
+        
+        with mock.patch.object(FeedPagination, 'page_size', 5):
+            self.assertEqual(self._feed(), expected)
+    
+    @override_settings(INBOX_SIZE=3, INBOX_TRIM_INTERVAL=0)
+    def test_fan_out_keeps_inboxes_bounded(self):
+        """Test that posting trims the followers' inboxes to INBOX_SIZE, leaving other inboxes alone."""
+        from .models import InboxEntry
+        
+        self._follow(self.friend)
+        self._follow(self.stranger, username='other')
+        for i in range(5):
+            self.client.post('/api/posts/', {'content': f'Stranger {i}', 'username': 'stranger'}, secure=True)
+        posts = []
+        for i in range(5):
+            response = self.client.post('/api/posts/', {'content': f'Friend {i}', 'username': 'friend'}, secure=True)
+            self.assertEqual(response.status_code, 201)
+            posts.append(Post.objects.get(content=f'Friend {i}').pk)
+        
+        self.assertEqual(InboxEntry.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(self._feed(), posts[:-4:-1])
+        self.assertEqual(InboxEntry.objects.filter(user__username='other').count(), 3)
+    
+    @override_settings(FANOUT_MAX_FOLLOWERS=2)
+    def test_popular_authors_are_pulled(self):
+        """Test that followers of authors past the fan-out limit pull their posts instead."""
+        from .following import trim_inboxes
+        from .models import Follow, InboxEntry
+        
+        self._follow(self.friend)
+        self._follow(self.stranger)
+        self._follow(self.friend, username='fan')
+        self.assertTrue(all(Follow.objects.filter(followee=self.friend).values_list('pull', flat=True)))
+        
+        pulled = Post.objects.create(author=self.friend, content='Pulled')
+        pushed = Post.objects.create(author=self.stranger, content='Pushed')
+        self.assertFalse(InboxEntry.objects.filter(post=pulled).exists())
+        self.assertEqual(self._feed(), [pushed.pk, pulled.pk, self.early.pk])
+        
+        self.assertEqual(trim_inboxes(size=1), 1)
+        self.assertEqual(InboxEntry.objects.filter(user=self.reader).get().post_id, pushed.pk)
+
+
+@override_settings(CACHE_SHARED=True)
+class CommentNodeTreeTestCase(TestCase):
+    """
+    Test case for the compact comment tree shared by rendering, the serializers and the cache.
+    """
+    
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'threader{i}', password='testpass123') for i in range(2)]
+        self.post = Post.objects.create(author=self.users[0], content='Threaded')
+        self.first = Comment.objects.create(post=self.post, author=self.users[0], content='First')
+        self.second = Comment.objects.create(post=self.post, author=self.users[1], content='Second')
+        self.reply = Comment.objects.create(post=self.post, author=self.users[1], parent=self.first, content='Reply')
+        self.deep = Comment.objects.create(post=self.post, author=self.users[0], parent=self.reply, content='Deep')
+        Like.objects.create(user=self.users[1], comment=self.first)
+        self.url = f'/api/posts/{self.post.pk}/comments/'
+    
+    def test_tree_is_compact_and_pickles_flat(self):
+        """Test that nodes have no __dict__, authors are shared, and a tree survives the cache."""
+        import pickle
+        from .comment_nodes import CommentTree
+        from .rendering import load_comment_trees, render_comment_tree
+        
+        tree = load_comment_trees([self.post.pk])[self.post.pk]
+        self.assertEqual(len(tree), 4)
+        self.assertEqual([node.id for node in tree.roots], [self.second.pk, self.first.pk])
+        self.assertFalse(hasattr(tree.roots[0], '__dict__'))
+        self.assertIs(tree.nodes[self.first.pk].author, tree.nodes[self.deep.pk].author)
+        self.assertEqual(tree.nodes[self.first.pk].like_count, 1)
+        
+        copy = pickle.loads(pickle.dumps(tree))
+        self.assertIsInstance(copy, CommentTree)
+        self.assertEqual(render_comment_tree(copy), render_comment_tree(tree))
+        
+        subtree = tree.subtree(self.reply.pk)
+        self.assertEqual(
+            [comment['id'] for comment in render_comment_tree(tree, subtree.replies)], [self.deep.pk]
+        )
+        self.assertIsNone(tree.subtree(999999))
+    
+    def test_sort_and_depth(self):
+        """Test ?sort=top and ?depth= on a post's comments, served from the cached tree."""
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual([c['id'] for c in response.data], [self.second.pk, self.first.pk])
+        
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.url}?sort=top', secure=True)
+        self.assertEqual([c['id'] for c in response.data], [self.first.pk, self.second.pk])
+        self.assertEqual(response.data[0]['replies'][0]['replies'][0]['id'], self.deep.pk)
+        
+        response = self.client.get(f'{self.url}?depth=2', secure=True)
+        first = next(c for c in response.data if c['id'] == self.first.pk)
+        self.assertEqual(first['replies'][0]['replies'], [])
+        self.assertEqual(first['replies'][0]['reply_count'], 1)
+        
+        # A like that reorders siblings is picked up from the overlay
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in self.users:
+                self.client.post(f'/api/comments/{self.second.pk}/like/', {'username': user.username}, secure=True)
+        response = self.client.get(f'{self.url}?sort=top', secure=True)
+        self.assertEqual([c['id'] for c in response.data], [self.second.pk, self.first.pk])
+        
+        self.assertEqual(self.client.get(f'{self.url}?sort=old', secure=True).status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}?depth=0', secure=True).status_code, 400)
@@ -1,13 +1,31 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet, LeaderboardViewSet, UserViewSet
+from . import async_views
+from .views import PostViewSet, CommentViewSet, LikeViewSet, LeaderboardViewSet, UserViewSet, live_events
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet, basename='post')
 router.register(r'comments', CommentViewSet, basename='comment')
+router.register(r'likes', LikeViewSet, basename='like')
 router.register(r'leaderboard', LeaderboardViewSet, basename='leaderboard')
 router.register(r'users', UserViewSet, basename='user')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('events/', live_events, name='live-events'),
 ]
+
+if getattr(settings, 'ASYNC_READ_VIEWS', False):
+    # Reads of the feed, posts and leaderboard go to the async views, ahead of the router
+    urlpatterns = [
+        path('posts/', async_views.read_or_write(
+            async_views.post_list, PostViewSet.as_view({'get': 'list', 'post': 'create'})
+        ), name='post-list'),
+        re_path(r'^posts/(?P<pk>[0-9]+)/$', async_views.read_or_write(
+            async_views.post_detail, PostViewSet.as_view({
+                'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+            })
+        ), name='post-detail'),
+        path('leaderboard/top_users/', async_views.top_users, name='leaderboard-top-users'),
+    ] + urlpatterns
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+
+USER_ID_CACHE_KEY = 'user_id'
+
+
+class UserIdCache:
+    """
+    Bounded in-process LRU of username -> user id.
+
+    The write endpoints identify users by username alone, so without this
+    every like, unlike, post and comment starts with a SELECT on auth_user.
+    Holds at most USER_ID_CACHE_SIZE usernames (0 disables it).
+
+    Deleting a user only forgets it here in the process that deleted it;
+    writes go through with_user_ids, which forgets and retries ids that
+    turn out to be gone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, username):
+        with self._lock:
+            user_id = self._entries.get(username)
+            if user_id is not None:
+                self._entries.move_to_end(username)
+            return user_id
+
+    def set(self, username, user_id):
+        size = getattr(settings, 'USER_ID_CACHE_SIZE', 10000)
+        if not size:
+            return
+        with self._lock:
+            self._entries[username] = user_id
+            self._entries.move_to_end(username)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def discard(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+user_ids = UserIdCache()
+
+
+def resolve_user_id(username):
+    """
+    The id of the user called `username`, creating it the way the write
+    endpoints always have. Repeat users are answered from the LRU (and, with
+    USER_ID_CACHE_SHARED, the shared cache) without touching the database.
+    """
+    return resolve_user_ids({username})[username]
+
+
+def resolve_user_ids(usernames):
+    """Map a set of usernames to user ids, with one query for all that aren't cached."""
+    resolved = {}
+    for username in usernames:
+        user_id = user_ids.get(username)
+        if user_id is not None:
+            resolved[username] = user_id
+
+    shared = getattr(settings, 'USER_ID_CACHE_SHARED', False)
+    missing = set(usernames) - resolved.keys()
+    if missing and shared:
+        found = cache.get_many([_shared_key(username) for username in missing])
+        for username in missing:
+            user_id = found.get(_shared_key(username))
+            if user_id is not None:
+                resolved[username] = user_id
+                user_ids.set(username, user_id)
+        missing -= resolved.keys()
+
+    if missing:
+        found = dict(User.objects.filter(username__in=missing).values_list('username', 'pk'))
+        created = missing - found.keys()
+        if created:
+            User.objects.bulk_create(
+                [User(username=username, email=f'{username}@example.com') for username in created],
+                ignore_conflicts=True
+            )
+            found.update(User.objects.filter(username__in=created).values_list('username', 'pk'))
+        resolved.update(found)
+        # Only remember ids once they are committed, a rollback would leave them dangling
+        transaction.on_commit(lambda: _remember(found, shared))
+
+    return resolved
+
+
+def with_user_id(username, write):
+    """Call write(user_id) for `username` through with_user_ids, and return what it returns."""
+    return with_user_ids({username}, lambda resolved: write(resolved[username]))
+
+
+def with_user_ids(usernames, write):
+    """
+    Call write(ids), `ids` mapping `usernames` to user ids as from
+    resolve_user_ids, and return what it returns.
+
+    An id cached by this process may belong to a user deleted through
+    another one. If the write fails on an IntegrityError, the usernames are
+    forgotten, resolved again (re-creating deleted users) and the write is
+    retried once. Must not be called inside an atomic block, which the
+    failed write would leave unusable.
+    """
+    try:
+        return write(resolve_user_ids(usernames))
+    except IntegrityError:
+        for username in usernames:
+            forget_user(username)
+        return write(resolve_user_ids(usernames))
+
+
+def forget_user(username):
+    """Drop `username` from the LRU and the shared cache."""
+    user_ids.discard(username)
+    cache.delete(_shared_key(username))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_user(instance.username))
+
+
+def _remember(found, shared):
+    for username, user_id in found.items():
+        user_ids.set(username, user_id)
+    if shared:
+        cache.set_many(
+            {_shared_key(username): user_id for username, user_id in found.items()},
+            getattr(settings, 'USER_ID_CACHE_TTL', 24 * 60 * 60)
+        )
+
+
+def _shared_key(username):
+    # Usernames may hold characters memcached-style keys don't allow
+    return f'{USER_ID_CACHE_KEY}:{username.encode("utf-8").hex()}'
@@ -0,0 +1,110 @@
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+FEED_VERSION_KEY = 'feed:version'
+POST_VERSION_KEY = 'post:version'
+COMMENT_TREE_VERSION_KEY = 'comment_tree:version'
+LEADERBOARD_VERSION_KEY = 'leaderboard:version'
+
+
+def stamps_shared():
+    """
+    Whether version stamps live in the cache, shared by every worker
+    (settings.CACHE_SHARED). Otherwise they are VersionStamp rows: a stamp
+    bumped in one worker's local cache would leave the others' alone.
+    """
+    return getattr(settings, 'CACHE_SHARED', False)
+
+
+def post_changed(post_id):
+    """
+    Record, once the current transaction commits, that what a post renders as
+    has changed: the post itself, any of its comments, or a like on either.
+    The feed changes with it.
+    """
+    _bump(f'{POST_VERSION_KEY}:{post_id}', FEED_VERSION_KEY)
+
+
+def feed_changed():
+    """
+    Record, once the current transaction commits, that the feed changed
+    without any one post changing, e.g. posts were reranked.
+    """
+    _bump(FEED_VERSION_KEY)
+
+
+def comments_changed(post_id):
+    """
+    Record, once the current transaction commits, that a comment on the post
+    was created, edited or deleted. Retires its cached comment tree, and
+    counts as a post_changed. Likes don't go through here, cached trees
+    get their like counts from an overlay instead.
+    """
+    _bump(f'{COMMENT_TREE_VERSION_KEY}:{post_id}')
+    post_changed(post_id)
+
+
+def leaderboards_changed():
+    """Record, once the current transaction commits, that the leaderboards need ranking again."""
+    _bump(LEADERBOARD_VERSION_KEY)
+
+
+def comment_tree_version(post_id):
+    """Version stamp of the comments on a post, leaving out their like counts."""
+    return _version(f'{COMMENT_TREE_VERSION_KEY}:{post_id}')
+
+
+def post_version(post_id):
+    """
+    Version stamp of a post and its comment tree: the time in nanoseconds of
+    its last change, or of the first time it was asked for.
+    """
+    return _version(f'{POST_VERSION_KEY}:{post_id}')
+
+
+def feed_version():
+    """Version stamp of the feed as a whole, like post_version."""
+    return _version(FEED_VERSION_KEY)
+
+
+def leaderboard_version():
+    """Version stamp of the leaderboards, moved on by leaderboards_changed."""
+    return _version(LEADERBOARD_VERSION_KEY)
+
+
+def _bump(*keys):
+    def bump():
+        now = time.time_ns()
+        if stamps_shared():
+            cache.set_many({key: now for key in keys}, None)
+            return
+        stamp_model = apps.get_model('feed', 'VersionStamp')
+        stamp_model.objects.bulk_create(
+            [stamp_model(key=key, value=now) for key in keys],
+            update_conflicts=True, unique_fields=['key'], update_fields=['value']
+        )
+
+    transaction.on_commit(bump)
+
+
+def _version(key):
+    if stamps_shared():
+        version = cache.get(key)
+        if version is None:
+            # A lost stamp restarts from now, so it can't repeat a version a client holds
+            cache.add(key, time.time_ns(), None)
+            version = cache.get(key)
+        return version
+
+    # One primary key lookup
+    stamps = apps.get_model('feed', 'VersionStamp').objects.filter(key=key).values_list('value', flat=True)
+    version = stamps.first()
+    if version is None:
+        stamps.model.objects.bulk_create([stamps.model(key=key, value=time.time_ns())], ignore_conflicts=True)
+        version = stamps.first()
+    return version
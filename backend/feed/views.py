@@ -1,29 +1,164 @@
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, AllowAny
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import AllowAny
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.db.models import Q, Count, Sum, Case, When, IntegerField, F, Prefetch
-from django.db import IntegrityError, transaction
-from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from datetime import timedelta
-from .models import Post, Comment, Like
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from urllib.parse import urlencode
+import hashlib
+from .models import Post, Comment
+from . import events, following, karma, likes, ranking, search, users, versions
+from .comment_nodes import COMMENT_SORTS, DEFAULT_COMMENT_SORT
+from .comment_tree import (
+    COMMENT_PREVIEW_MAX_SIZE, SUBTREE_DEPTH, SUBTREE_MAX_DEPTH, SUBTREE_PAGE_SIZE, SUBTREE_MAX_PAGE_SIZE,
+    attach_comment_previews, load_subtree
+)
+from .pagination import FeedPagination
+from .renderers import StreamingJSONMixin
+from .rendering import (
+    attach_comment_trees, cached_comment_tree, comment_rows, post_rows, render_comments, render_posts,
+    render_thread
+)
 from .serializers import (
     PostSerializer, PostCreateSerializer, CommentSerializer, 
-    CommentCreateSerializer, LikeSerializer, UserSerializer,
-    LeaderboardSerializer
+    CommentCreateSerializer, UserSerializer,
+    LeaderboardSerializer, LikeBatchSerializer, SubtreeCommentSerializer
 )
 
 
+def _object_id(pk):
+    """Parse the pk from the URL, treating anything that isn't an id as not found."""
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        raise Http404
+
+
+def _fast_read_rendering():
+    """Whether post reads are rendered from plain rows by feed.rendering (settings.FAST_READ_RENDERING)."""
+    return getattr(settings, 'FAST_READ_RENDERING', True)
+
+
+def _conditional_get(request, version, last_modified=None):
+    """
+    ETag (and Last-Modified) headers for a GET whose body only changes with
+    `version`, and a 304 response if the client's copy is still current.
+    Lets polling clients be answered without loading or rendering anything
+    beyond the version stamp (see feed.versions).
+    """
+    digest = hashlib.md5(f'{version}|{request.get_full_path()}'.encode(), usedforsecurity=False)
+    etag = quote_etag(digest.hexdigest())
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        _add_headers(not_modified, headers)
+    return headers, not_modified
+
+
+def _add_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _bounded_int_param(request, name, default, maximum):
+    """Read an integer query param between 1 and `maximum`, rejecting anything else."""
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        value = 0
+    if not 1 <= value <= maximum:
+        raise ParseError(f'{name} must be a number between 1 and {maximum}.')
+    return value
+
+
+def _comment_limit(params):
+    """
+    How many comments to attach per post, from the `comments` query param:
+    None for the full tree, 0 for none, N for the newest N top-level comments.
+    """
+    mode = params.get('comments', 'full')
+    if mode == 'full':
+        return None
+    if mode == 'none':
+        return 0
+    
+    kind, _, size = mode.partition(':')
+    try:
+        limit = int(size)
+    except ValueError:
+        limit = 0
+    if kind != 'top' or not 1 <= limit <= COMMENT_PREVIEW_MAX_SIZE:
+        raise ParseError(f'comments must be full, none or top:N with N between 1 and {COMMENT_PREVIEW_MAX_SIZE}.')
+    return limit
+
+
+def _feed_ordering(params):
+    """The feed's ordering for the `sort` query param: new (default), hot or top."""
+    sort = params.get('sort', ranking.DEFAULT_FEED_SORT)
+    if sort not in ranking.FEED_SORTS:
+        raise ParseError(f"sort must be one of: {', '.join(ranking.FEED_SORTS)}.")
+    return ranking.FEED_SORTS[sort]
+
+
+def _comment_sort(params):
+    """The sibling order of a comment tree for the `sort` query param: new (default) or top."""
+    sort = params.get('sort', DEFAULT_COMMENT_SORT)
+    if sort not in COMMENT_SORTS:
+        raise ParseError(f"sort must be one of: {', '.join(COMMENT_SORTS)}.")
+    return sort
+
+
+def _leaderboard_params(params):
+    """The leaderboard window and limit from the query params, rejecting anything else."""
+    window = params.get('window', karma.DEFAULT_LEADERBOARD_WINDOW)
+    if window not in karma.LEADERBOARD_WINDOWS:
+        raise ParseError(f"window must be one of: {', '.join(karma.LEADERBOARD_WINDOWS)}.")
+    
+    try:
+        limit = int(params.get('limit', karma.LEADERBOARD_SIZE))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= karma.LEADERBOARD_MAX_SIZE:
+        raise ParseError(f'limit must be a number between 1 and {karma.LEADERBOARD_MAX_SIZE}.')
+    return window, limit
+
+
+def _search_page(request, model, rows, render):
+    """
+    A page of the `model` rows whose content matches the `q` query param,
+    best matches first. Ids come from the full-text index in feed.search,
+    then one query reads the page through `rows` for `render`.
+    """
+    results = search.SearchResults(model, request.query_params.get('q', ''))
+    if not results.terms:
+        raise ParseError('q must contain at least one word.')
+    
+    paginator = PageNumberPagination()
+    ids = paginator.paginate_queryset(results, request)
+    found = {row['id']: row for row in rows(model.objects.filter(pk__in=ids))}
+    return paginator.get_paginated_response(render([found[pk] for pk in ids if pk in found]))
+
+
 @method_decorator(csrf_exempt, name='dispatch')
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(StreamingJSONMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing posts.
     """
     queryset = Post.objects.all()
     permission_classes = [AllowAny]
+    pagination_class = FeedPagination
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -32,104 +167,206 @@ class PostViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """
-        Optimize queryset with select_related and prefetch_related to avoid N+1 queries.
+        Optimize queryset with select_related to avoid N+1 queries.
+        Comment trees are loaded separately by the serializer in one query per post.
         """
-        return Post.objects.select_related('author').prefetch_related(
-            Prefetch(
-                'comments',
-                queryset=Comment.objects.select_related('author').filter(parent__isnull=True)
-            )
-        ).order_by('-created_at')
+        return Post.objects.select_related('author').order_by('-created_at')
+    
+    def list(self, request, *args, **kwargs):
+        """
+        List posts with their comment trees.
+        Comments for every post on the page are fetched in a single query,
+        so the query count stays constant regardless of page size.
+        
+        Query params:
+        - comments: full (default), top:N for the N newest top-level comments
+          without replies, or none
+        - sort: new (default), hot (likes decayed by age, see feed.ranking)
+          or top (most liked)
+        """
+        comment_limit = _comment_limit(request.query_params)
+        ordering = _feed_ordering(request.query_params)
+        version = versions.feed_version()
+        headers, not_modified = _conditional_get(request, version, version // 10 ** 9)
+        if not_modified is not None:
+            return not_modified
+        
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*ordering)
+        self.paginator.ordering = ordering
+        if _fast_read_rendering():
+            queryset = post_rows(queryset)
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return _add_headers(self.get_paginated_response(self._render_posts(page, comment_limit)), headers)
+        
+        return Response(self._render_posts(queryset, comment_limit), headers=headers)
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Get a single post with its full comment tree and count from one comment query.
+        Takes the same `comments` param as the list.
+        """
+        comment_limit = _comment_limit(request.query_params)
+        post_id = _object_id(kwargs['pk'])
+        version = versions.post_version(post_id)
+        headers, not_modified = _conditional_get(request, version, version // 10 ** 9)
+        if not_modified is not None:
+            return not_modified
+        
+        if _fast_read_rendering():
+            rows = post_rows(self.get_queryset().filter(pk=post_id))
+            if comment_limit is None:
+                # Full threads come from the per-post tree cache
+                post = render_thread(rows)
+            else:
+                post = next(iter(render_posts(rows, comment_limit)), None)
+            if post is None:
+                raise Http404
+            return Response(post, headers=headers)
+        
+        post = self.get_object()
+        return Response(self._render_posts([post], comment_limit)[0], headers=headers)
+    
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        """
+        Get the full comment tree of a post, for clients that listed the
+        feed with `comments=top:N` or `comments=none`.
+        
+        Query params:
+        - sort: new (default) or top (most liked first), at every level
+        - depth: only this many levels of comments (1 for top-level only)
+        """
+        sort = _comment_sort(request.query_params)
+        depth = None
+        if 'depth' in request.query_params:
+            depth = _bounded_int_param(request, 'depth', SUBTREE_DEPTH, SUBTREE_MAX_DEPTH)
+        post_id = _object_id(pk)
+        version = versions.post_version(post_id)
+        headers, not_modified = _conditional_get(request, version, version // 10 ** 9)
+        if not_modified is not None:
+            return not_modified
+        
+        tree, _ = cached_comment_tree(post_id, sort, depth)
+        if not tree and not Post.objects.filter(pk=post_id).exists():
+            raise Http404
+        return Response(tree, headers=headers)
+    
+    @action(detail=False, methods=['get'])
+    def following(self, request):
+        """
+        The following feed of a user: posts by the users they follow, newest
+        first, in pages of the feed's cursor (keyset) pagination.
+        
+        Query params:
+        - username: whose feed to read
+        - comments: as for the list
+        
+        Served from the user's inbox, which new posts are pushed into (see
+        feed.following), so a page doesn't depend on how many users they follow.
+        """
+        comment_limit = _comment_limit(request.query_params)
+        user_id = User.objects.filter(username=request.query_params.get('username', '')).values_list('pk', flat=True).first()
+        if user_id is None:
+            raise Http404
+        
+        paginator = FeedPagination()
+        rows = paginator.paginate_fetched(
+            lambda after, limit: following.following_page(user_id, after, limit, post_rows), request
+        )
+        return paginator.get_paginated_response(render_posts(rows, comment_limit))
+    
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Search posts by content, best matches first, paginated like the feed.
+        
+        Query params:
+        - q: the words to look for (all of them must match)
+        
+        Posts come without their comments, see `comments`.
+        """
+        return _search_page(request, Post, post_rows, lambda rows: render_posts(rows, comment_limit=0))
+    
+    def _render_posts(self, posts, comment_limit):
+        """Render post rows from post_rows directly, or Post instances through PostSerializer."""
+        if _fast_read_rendering():
+            return render_posts(posts, comment_limit)
+        if comment_limit is None:
+            posts = attach_comment_trees(posts)
+        else:
+            posts = attach_comment_previews(posts, comment_limit)
+        return self.get_serializer(posts, many=True).data
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def like(self, request, pk=None):
         """
         Like a post. Handles race conditions with database constraints.
+        The like is a single INSERT ... ON CONFLICT DO NOTHING plus one
+        UPDATE ... RETURNING like_count, without loading the post first.
         """
-        post = self.get_object()
+        post_id = _object_id(pk)
         username = request.data.get('username', 'Guest')
         
         try:
-            # Get or create user
-            user, _ = User.objects.get_or_create(
-                username=username,
-                defaults={'email': f'{username}@example.com'}
-            )
-            
-            # Use atomic transaction to ensure consistency
-            with transaction.atomic():
-                like, created = Like.objects.get_or_create(
-                    user=user,
-                    post=post
-                )
-                
-                if not created:
-                    return Response(
-                        {'detail': 'You have already liked this post.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Refresh post to get updated like_count
-                post.refresh_from_db()
-                
-                return Response(
-                    {
-                        'detail': 'Post liked successfully.',
-                        'like_count': post.like_count
-                    },
-                    status=status.HTTP_201_CREATED
-                )
-        
-        except IntegrityError:
-            # This handles the race condition where two requests try to create the same like
+            like_count = users.with_user_id(username, lambda user_id: likes.add_like(user_id, Post, post_id))
+        except Post.DoesNotExist:
+            raise Http404
+        
+        if like_count is None:
+            # The unique constraint rejected a duplicate, including concurrent double likes
             return Response(
                 {'detail': 'You have already liked this post.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return Response(
+            {
+                'detail': 'Post liked successfully.',
+                'like_count': like_count
+            },
+            status=status.HTTP_201_CREATED
+        )
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def unlike(self, request, pk=None):
         """
         Unlike a post.
         """
-        post = self.get_object()
+        post_id = _object_id(pk)
         username = request.data.get('username', 'Guest')
         
+        user_id = users.resolve_user_id(username)
+        
         try:
-            user, _ = User.objects.get_or_create(
-                username=username,
-                defaults={'email': f'{username}@example.com'}
-            )
-            
-            with transaction.atomic():
-                like = Like.objects.get(user=user, post=post)
-                like.delete()
-                
-                # Refresh post to get updated like_count
-                post.refresh_from_db()
-                
-                return Response(
-                    {
-                        'detail': 'Post unliked successfully.',
-                        'like_count': post.like_count
-                    },
-                    status=status.HTTP_200_OK
-                )
-        
-        except Like.DoesNotExist:
+            like_count = likes.remove_like(user_id, Post, post_id)
+        except Post.DoesNotExist:
+            raise Http404
+        
+        if like_count is None:
             return Response(
                 {'detail': 'You have not liked this post.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return Response(
+            {
+                'detail': 'Post unliked successfully.',
+                'like_count': like_count
+            },
+            status=status.HTTP_200_OK
+        )
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(StreamingJSONMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing comments.
     """
     queryset = Comment.objects.all()
     permission_classes = [AllowAny]
+    pagination_class = FeedPagination
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -149,84 +386,145 @@ class CommentViewSet(viewsets.ModelViewSet):
         
         return queryset.order_by('-created_at')
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Search comments by content, best matches first. Takes the same `q`
+        as posts' search, and comments come without their replies.
+        """
+        return _search_page(request, Comment, comment_rows, render_comments)
+    
+    @action(detail=True, methods=['get'])
+    def subtree(self, request, pk=None):
+        """
+        Get the replies under a comment, for expanding one branch of a thread.
+        
+        Query params:
+        - depth: levels of replies to include, up to 10 (default 3)
+        - limit: newest replies to include per comment, up to 100 (default 20)
+        - cursor: continue after the replies already loaded (from `next` or `more_replies`)
+        
+        Reads only the branch, with one tree_path range scan. Comments with
+        replies that weren't included link to them in `more_replies`.
+        """
+        depth = _bounded_int_param(request, 'depth', SUBTREE_DEPTH, SUBTREE_MAX_DEPTH)
+        limit = _bounded_int_param(request, 'limit', SUBTREE_PAGE_SIZE, SUBTREE_MAX_PAGE_SIZE)
+        paginator = FeedPagination()
+        cursor = request.query_params.get(paginator.cursor_query_param)
+        after = paginator.decode_cursor(cursor) if cursor else None
+        
+        root = Comment.objects.filter(pk=_object_id(pk)).only('post_id', 'tree_path', 'depth').first()
+        if root is None:
+            raise Http404
+        replies = load_subtree(root, depth, limit, after)
+        
+        def more_replies(comment):
+            url = request.build_absolute_uri(reverse('comment-subtree', args=[comment.pk]))
+            params = {'depth': depth, 'limit': limit}
+            if comment.tree_replies:
+                params[paginator.cursor_query_param] = paginator.encode_cursor(comment.tree_replies[-1])
+            return f'{url}?{urlencode(params)}'
+        
+        context = dict(self.get_serializer_context(), more_replies=more_replies)
+        return Response({
+            'id': root.pk,
+            'next': more_replies(root) if root.more_replies else None,
+            'results': SubtreeCommentSerializer(replies, many=True, context=context).data,
+        })
+    
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def like(self, request, pk=None):
         """
         Like a comment. Handles race conditions with database constraints.
+        The like is a single INSERT ... ON CONFLICT DO NOTHING plus one
+        UPDATE ... RETURNING like_count, without loading the comment first.
         """
-        comment = self.get_object()
+        comment_id = _object_id(pk)
         username = request.data.get('username', 'Guest')
         
         try:
-            # Get or create user
-            user, _ = User.objects.get_or_create(
-                username=username,
-                defaults={'email': f'{username}@example.com'}
-            )
-            
-            with transaction.atomic():
-                like, created = Like.objects.get_or_create(
-                    user=user,
-                    comment=comment
-                )
-                
-                if not created:
-                    return Response(
-                        {'detail': 'You have already liked this comment.'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Refresh comment to get updated like_count
-                comment.refresh_from_db()
-                
-                return Response(
-                    {
-                        'detail': 'Comment liked successfully.',
-                        'like_count': comment.like_count
-                    },
-                    status=status.HTTP_201_CREATED
-                )
-        
-        except IntegrityError:
+            like_count = users.with_user_id(username, lambda user_id: likes.add_like(user_id, Comment, comment_id))
+        except Comment.DoesNotExist:
+            raise Http404
+        
+        if like_count is None:
+            # The unique constraint rejected a duplicate, including concurrent double likes
             return Response(
                 {'detail': 'You have already liked this comment.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return Response(
+            {
+                'detail': 'Comment liked successfully.',
+                'like_count': like_count
+            },
+            status=status.HTTP_201_CREATED
+        )
     
     @action(detail=True, methods=['post'], permission_classes=[AllowAny])
     def unlike(self, request, pk=None):
         """
         Unlike a comment.
         """
-        comment = self.get_object()
+        comment_id = _object_id(pk)
         username = request.data.get('username', 'Guest')
         
+        user_id = users.resolve_user_id(username)
+        
         try:
-            user, _ = User.objects.get_or_create(
-                username=username,
-                defaults={'email': f'{username}@example.com'}
-            )
-            
-            with transaction.atomic():
-                like = Like.objects.get(user=user, comment=comment)
-                like.delete()
-                
-                # Refresh comment to get updated like_count
-                comment.refresh_from_db()
-                
-                return Response(
-                    {
-                        'detail': 'Comment unliked successfully.',
-                        'like_count': comment.like_count
-                    },
-                    status=status.HTTP_200_OK
-                )
-        
-        except Like.DoesNotExist:
+            like_count = likes.remove_like(user_id, Comment, comment_id)
+        except Comment.DoesNotExist:
+            raise Http404
+        
+        if like_count is None:
             return Response(
                 {'detail': 'You have not liked this comment.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        return Response(
+            {
+                'detail': 'Comment unliked successfully.',
+                'like_count': like_count
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class LikeViewSet(viewsets.ViewSet):
+    """
+    ViewSet for bulk like ingestion.
+    """
+    permission_classes = [AllowAny]
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply many like/unlike operations in one request, e.g. when a mobile
+        client flushes likes it queued while offline.
+        
+        Body: {"operations": [{"username": ..., "action": "like" | "unlike",
+        "post": id} or {..., "comment": id}, ...]}
+        
+        Returns one result per operation, in order, with its status and the
+        updated like_count.
+        """
+        serializer = LikeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        operations = [
+            {
+                'username': operation['username'],
+                'action': operation['action'],
+                'model': Post if operation.get('post') is not None else Comment,
+                'pk': operation['post'] if operation.get('post') is not None else operation['comment'],
+            }
+            for operation in serializer.validated_data['operations']
+        ]
+        
+        return Response({'results': likes.apply_like_batch(operations)})
 
 
 class LeaderboardViewSet(viewsets.ViewSet):
@@ -238,59 +536,36 @@ class LeaderboardViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def top_users(self, request):
         """
-        Get top 5 users by karma earned in the last 24 hours.
+        Get top users by karma earned in a recent window (default: top 5 in the last 24 hours).
+        
+        Query params:
+        - window: one of 1h, 24h, 7d
+        - limit: number of users, up to 50
         
         Karma calculation:
         - 1 Like on a Post = 5 Karma
         - 1 Like on a Comment = 1 Karma
         
-        This is calculated dynamically from the Like table based on likes received
-        in the last 24 hours, not stored in a field.
-        """
-        # Calculate time 24 hours ago
-        twenty_four_hours_ago = timezone.now() - timedelta(hours=24)
-        
-        # This is the critical query for the leaderboard
-        # It counts likes received on posts and comments in the last 24 hours
-        leaderboard_data = User.objects.filter(
-            Q(posts__likes__created_at__gte=twenty_four_hours_ago) |
-            Q(comments__likes__created_at__gte=twenty_four_hours_ago)
-        ).annotate(
-            # Count likes received on user's posts in last 24h (each worth 5 karma)
-            post_likes=Count(
-                'posts__likes',
-                filter=Q(posts__likes__created_at__gte=twenty_four_hours_ago),
-                distinct=True
-            ),
-            # Count likes received on user's comments in last 24h (each worth 1 karma)
-            comment_likes=Count(
-                'comments__likes',
-                filter=Q(comments__likes__created_at__gte=twenty_four_hours_ago),
-                distinct=True
-            ),
-        ).annotate(
-            # Calculate total karma: (post_likes * 5) + (comment_likes * 1)
-            karma=(F('post_likes') * 5) + (F('comment_likes') * 1)
-        ).filter(
-            karma__gt=0
-        ).order_by('-karma')[:5]
-        
-        # Format the data for the serializer
-        formatted_data = [
-            {
-                'user_id': user.id,
-                'username': user.username,
-                'karma': user.karma or 0,
-                'post_likes': user.post_likes or 0,  # Number of likes on posts
-                'comment_likes': user.comment_likes or 0,  # Number of likes on comments
-            }
-            for user in leaderboard_data
-        ]
+        This is calculated dynamically from the KarmaEvent ledger (one row per
+        like, removed with the like) based on likes received in the window,
+        not stored in a field. All windows are ranked in one pass and cached
+        briefly per (window, limit), and invalidated when a like could change
+        the ranking.
+        """
+        window, limit = _leaderboard_params(request.query_params)
         
-        serializer = LeaderboardSerializer(formatted_data, many=True)
-        return Response(serializer.data)
+        generation = versions.leaderboard_version()
+        headers, not_modified = _conditional_get(request, karma.leaderboard_version(generation))
+        if not_modified is not None:
+            return not_modified
+        
+        leaderboard_data = karma.cached_top_users(window, limit, generation)
+        
+        serializer = LeaderboardSerializer(leaderboard_data, many=True)
+        return Response(serializer.data, headers=headers)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing users.
@@ -298,8 +573,77 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     
+    @action(detail=True, methods=['post'], permission_classes=[AllowAny])
+    def follow(self, request, pk=None):
+        """
+        Follow a user, adding their posts to the follower's following feed.
+        """
+        followee_id = _object_id(pk)
+        if not User.objects.filter(pk=followee_id).exists():
+            raise Http404
+        username = request.data.get('username', 'Guest')
+        if users.resolve_user_id(username) == followee_id:
+            return Response({'detail': 'You cannot follow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        if not users.with_user_id(username, lambda follower_id: following.follow(follower_id, followee_id)):
+            return Response({'detail': 'You already follow this user.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'detail': 'User followed successfully.'}, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'], permission_classes=[AllowAny])
+    def unfollow(self, request, pk=None):
+        """
+        Unfollow a user.
+        """
+        followee_id = _object_id(pk)
+        follower_id = users.resolve_user_id(request.data.get('username', 'Guest'))
+        
+        if not following.unfollow(follower_id, followee_id):
+            return Response({'detail': 'You do not follow this user.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'detail': 'User unfollowed successfully.'}, status=status.HTTP_200_OK)
+    
     @action(detail=False, methods=['get'], permission_classes=[AllowAny])
     def me(self, request):
         """Get the current user's information."""
         serializer = self.get_serializer(request.user)
         return Response(serializer.data)
+
+
+async def live_events(request):
+    """
+    Server-Sent Events stream of live updates, replacing polling.
+    Only served through asgi.py: under WSGI, Django collects an async stream
+    into a list, so it would hold a worker forever. Answers 501 there.
+    
+    Query params:
+    - posts: comma separated post ids to follow (default: all posts)
+    - window: a leaderboard window (1h, 24h, 7d) to follow, sent as diffs
+    - limit: leaderboard size, up to 50
+    
+    Events: `post` (like count, comment like counts and new comments of a
+    post, coalesced), `leaderboard` and `resync` (updates were dropped,
+    refetch).
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'detail': 'Live updates are only served over ASGI.'}, status=501)
+    try:
+        post_ids = {int(pk) for pk in request.GET['posts'].split(',')} if request.GET.get('posts') else None
+        limit = int(request.GET.get('limit', karma.LEADERBOARD_SIZE))
+    except ValueError:
+        return JsonResponse({'detail': 'posts must be comma separated ids and limit a number.'}, status=400)
+    window = request.GET.get('window')
+    if window is not None and window not in karma.LEADERBOARD_WINDOWS:
+        return JsonResponse(
+            {'detail': f"window must be one of: {', '.join(karma.LEADERBOARD_WINDOWS)}."}, status=400
+        )
+    if not 1 <= limit <= karma.LEADERBOARD_MAX_SIZE:
+        return JsonResponse(
+            {'detail': f'limit must be a number between 1 and {karma.LEADERBOARD_MAX_SIZE}.'}, status=400
+        )
+    
+    response = StreamingHttpResponse(
+        events.event_stream(post_ids, window, limit), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Keep proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response